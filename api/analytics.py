@@ -0,0 +1,185 @@
+import os
+import time
+import asyncio
+import logging
+import numpy as np
+from sqlalchemy import text
+from . import cache, database
+
+# 'memory' serves the report endpoints from an in-process snapshot of the marts; 'sql' queries Postgres
+ANALYTICS_MODE = os.getenv("API_ANALYTICS_MODE", "sql").lower()
+ENABLED = ANALYTICS_MODE == "memory"
+
+logger = logging.getLogger(__name__)
+
+def _dictionary_encode(values):
+    """Returns (sorted distinct values, int32 code per value)."""
+    names, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return names, codes.astype(np.int32)
+
+def _date_string(date_key):
+    date_key = int(date_key)
+    return f"{date_key // 10000:04d}-{date_key // 100 % 100:02d}-{date_key % 100:02d}"
+
+class Snapshot:
+    """
+    Columnar copy of fct_messages, fct_image_detections and
+    fct_product_mentions for one warehouse version. Channels, categories,
+    object and product names are dictionary-encoded to
+    int32 codes, so every report is a mask plus np.bincount/np.unique over
+    flat arrays.
+    """
+
+    def __init__(self, version, channels, messages, detections, mentions=()):
+        self.version = version
+        self.loaded_at = time.time()
+
+        # channels: (channel_key, channel_name) of every dim_channels row
+        self.channel_names = np.array([name for _, name in channels], dtype=object)
+        self.channel_codes = {name: code for code, name in enumerate(self.channel_names)}
+        key_to_code = {key: code for code, (key, _) in enumerate(channels)}
+
+        # messages: (channel_key, date_key, view_count, forward_count)
+        self.message_channel = np.array([key_to_code.get(row[0], -1) for row in messages], dtype=np.int32)
+        self.message_date = np.array([row[1] or 0 for row in messages], dtype=np.int32)
+        self.message_views = np.array([row[2] or 0 for row in messages], dtype=np.int64)
+        self.message_forwards = np.array([row[3] or 0 for row in messages], dtype=np.int64)
+
+        # detections: (image_category, detected_objects, message view_count)
+        self.category_names, self.image_category = _dictionary_encode([row[0] for row in detections])
+        self.image_views = np.array([row[2] or 0 for row in detections], dtype=np.int64)
+        objects_per_image = [row[1] or [] for row in detections]
+        instance_image = np.repeat(np.arange(len(detections), dtype=np.int32),
+                                   [len(objects) for objects in objects_per_image])
+        self.object_names, instance_object = _dictionary_encode(
+            [name for objects in objects_per_image for name in objects])
+        # One entry per detected object instance, for counts like fct_detected_objects
+        self.instance_object = instance_object
+        # One entry per distinct (image, object) pair, for per-image engagement
+        n_objects = max(len(self.object_names), 1)
+        pairs = np.unique(instance_image.astype(np.int64) * n_objects + instance_object)
+        self.pair_image = (pairs // n_objects).astype(np.int32)
+        self.pair_object = (pairs % n_objects).astype(np.int32)
+
+        # mentions: product_name of each (message, product) row
+        self.product_names, self.mention_product = _dictionary_encode(list(mentions))
+
+    @property
+    def nbytes(self):
+        return sum(value.nbytes for value in vars(self).values()
+                   if isinstance(value, np.ndarray) and value.dtype != object)
+
+    def has_channel(self, channel_name):
+        return channel_name in self.channel_codes
+
+    def channel_activity(self, channel_name):
+        """Posts per day for a channel, newest day first."""
+        code = self.channel_codes.get(channel_name)
+        if code is None:
+            return []
+        days, counts = np.unique(self.message_date[self.message_channel == code], return_counts=True)
+        return [{"date": _date_string(day), "post_count": int(count)} for day, count in zip(days[::-1], counts[::-1])]
+
+    def visual_content(self):
+        """Images and average message views per image category."""
+        counts = np.bincount(self.image_category, minlength=len(self.category_names))
+        views = np.bincount(self.image_category, weights=self.image_views, minlength=len(self.category_names))
+        return [
+            {"image_category": str(name), "count": int(count), "avg_views": float(total / count) if count else 0.0}
+            for name, count, total in zip(self.category_names, counts, views)
+            if count
+        ]
+
+    def top_products(self, limit):
+        """Products mentioned in the most messages."""
+        counts = np.bincount(self.mention_product, minlength=len(self.product_names))
+        order = np.argsort(-counts, kind='stable')[:max(limit, 0)]
+        return [{"product_name": str(self.product_names[i]), "count": int(counts[i])} for i in order if counts[i]]
+
+    def top_objects(self, limit):
+        """Most often detected objects other than people."""
+        counts = np.bincount(self.instance_object, minlength=len(self.object_names))
+        person = np.flatnonzero(self.object_names == 'person')
+        counts[person] = 0
+        order = np.argsort(-counts, kind='stable')[:max(limit, 0)]
+        return [{"object_name": str(self.object_names[i]), "count": int(counts[i])} for i in order if counts[i]]
+
+    def engagement_by_object(self, limit, min_images):
+        """Images showing each object and the views their messages drew, best average first."""
+        n_objects = len(self.object_names)
+        images = np.bincount(self.pair_object, minlength=n_objects)
+        views = np.bincount(self.pair_object, weights=self.image_views[self.pair_image], minlength=n_objects)
+        keep = np.flatnonzero(images >= max(min_images, 1))
+        average = views[keep] / images[keep]
+        order = keep[np.lexsort((-images[keep], -average))][:max(limit, 0)]
+        return [
+            {
+                "object_name": str(self.object_names[i]),
+                "image_count": int(images[i]),
+                "total_views": int(views[i]),
+                "avg_views": float(views[i] / images[i]),
+            }
+            for i in order
+        ]
+
+async def load_snapshot(version):
+    """Reads the marts into a Snapshot tagged with version."""
+    async with database.AsyncSessionLocal() as db:
+        # A full scan of the fact tables can outlast the per-query API timeout
+        await db.execute(text("SET LOCAL statement_timeout = 0"))
+        channels = (await db.execute(text("SELECT channel_key, channel_name FROM dim_channels"))).fetchall()
+        messages = (await db.execute(text("""
+            SELECT channel_key, date_key, view_count, forward_count FROM fct_messages
+        """))).fetchall()
+        detections = (await db.execute(text("""
+            SELECT d.image_category, d.detected_objects, m.view_count
+            FROM fct_image_detections d
+            JOIN fct_messages m ON d.channel_key = m.channel_key AND d.message_id = m.message_id
+        """))).fetchall()
+        mentions = (await db.execute(text("SELECT product_name FROM fct_product_mentions"))).scalars().all()
+        await db.rollback()
+    return Snapshot(version, channels, messages, detections, mentions)
+
+class SnapshotHolder:
+    """
+    The current Snapshot, rebuilt when the warehouse version (see cache.DataVersion)
+    moves. One request rebuilds it and the others wait for that rebuild:
+    responses are cached and tagged with the version, so they must come from
+    its snapshot. A failed rebuild is logged and fails the waiting requests;
+    the next request tries again. Without a version stamp the first snapshot
+    is kept.
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self._refresh = None
+
+    async def get(self, db):
+        version = await cache.data_version.get(db)
+        while self.snapshot is None or (version is not None and version != self.snapshot.version):
+            if self._refresh is None or self._refresh.done():
+                self._refresh = asyncio.ensure_future(self._load(version))
+                self._refresh.add_done_callback(_log_failure)
+            # Shielded: a client hanging up does not cancel the rebuild for the others
+            await asyncio.shield(self._refresh)
+        return self.snapshot
+
+    async def _load(self, version):
+        start = time.perf_counter()
+        snapshot = await load_snapshot(version)
+        self.snapshot = snapshot
+        logger.info(f"Analytics snapshot for version {version}: {len(snapshot.message_date)} messages, "
+                    f"{len(snapshot.image_category)} images, {snapshot.nbytes / 2**20:.1f} MiB "
+                    f"in {time.perf_counter() - start:.2f}s")
+
+def _log_failure(task):
+    # Retrieves the exception even when every waiting request has gone away
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Analytics snapshot rebuild failed: {task.exception()!r}")
+
+holder = SnapshotHolder()
+
+async def preload():
+    """Builds the first snapshot at startup, so no request pays for it."""
+    async with database.AsyncSessionLocal() as db:
+        await holder.get(db)
@@ -0,0 +1,101 @@
+import os
+import time
+import hashlib
+from functools import lru_cache
+from collections import OrderedDict
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", "256"))
+# How long a warehouse version read is trusted before Postgres is asked again
+VERSION_TTL_SECONDS = float(os.getenv("API_CACHE_VERSION_TTL", "5"))
+
+class ResponseCache:
+    """Least-recently-used map of cache key -> encoded response body, holding at most max_entries."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return body
+
+    def set(self, key, body):
+        self._entries[key] = body
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class DataVersion:
+    """
+    The warehouse version stamp, bumped by the pipeline after dbt builds and
+    tests the marts (the bump_warehouse_version macro). Reads are memoised for
+    ttl seconds so most requests never reach the database for it.
+    """
+
+    def __init__(self, ttl=VERSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._version = None
+        self._read_at = float('-inf')
+
+    async def get(self, db):
+        """Returns the current version, or None if the pipeline has never stamped one."""
+        if time.monotonic() - self._read_at < self.ttl:
+            return self._version
+        try:
+            result = await db.execute(text("SELECT version FROM warehouse_version WHERE id = 1"))
+            row = result.fetchone()
+            self._version = row[0] if row else None
+        except DBAPIError:
+            # Table not created yet: leave the session usable and serve uncached
+            await db.rollback()
+            self._version = None
+        self._read_at = time.monotonic()
+        return self._version
+
+response_cache = ResponseCache()
+data_version = DataVersion()
+
+@lru_cache(maxsize=None)
+def _adapter(response_model):
+    return TypeAdapter(response_model)
+
+async def cached_response(request: Request, db, compute, response_model):
+    """
+    Serves a JSON report from the cache, keyed by endpoint, query parameters
+    and warehouse version; compute() is awaited only on a miss. Responses carry
+    an ETag, and a matching If-None-Match gets an empty 304. The route's
+    response_model is passed in because a Response skips FastAPI's own
+    validation: a miss is validated and serialized through it the way FastAPI
+    does, so cached and uncached responses carry the same JSON.
+    """
+    version = await data_version.get(db)
+    if version is None:
+        return await compute()
+
+    params = sorted(request.query_params.multi_items())
+    key = (request.url.path, tuple(params), version)
+    digest = hashlib.sha1(repr(key[:2]).encode()).hexdigest()[:16]
+    etag = f'"{version}-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    client_tags = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    if etag in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=headers)
+
+    body = response_cache.get(key)
+    if body is None:
+        adapter = _adapter(response_model)
+        body = adapter.dump_json(adapter.validate_python(await compute()), by_alias=True)
+        response_cache.set(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
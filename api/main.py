@@ -1,102 +1,234 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+import json
+import base64
+from datetime import date, datetime, time, timedelta
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing import List
-from . import database, schemas
+from typing import List, Literal, Optional
+from . import analytics, cache, database, metrics, schemas
 
 app = FastAPI(
     title="Medical Telegram Warehouse API",
     description="Analytical API for querying Telegram channel data and YOLO enrichment results.",
     version="1.0.0"
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.on_event("startup")
+async def load_analytics_snapshot():
+    if analytics.ENABLED:
+        await analytics.preload()
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to the Medical Warehouse API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Request, query and connection pool metrics of this process, for Prometheus to scrape."""
+    return await metrics.metrics_response()
+
 @app.get("/api/reports/top-products", response_model=List[schemas.TopProduct])
-def get_top_products(limit: int = 10, db: Session = Depends(database.get_db)):
+async def get_top_products(request: Request, limit: int = 10, db: AsyncSession = Depends(database.get_async_db)):
     """
-    Returns top detected objects/products from images. 
-    Note: Using detected objects as a proxy for "products".
+    Returns the products and drugs mentioned in the most messages, matched
+    against the product dictionary by src/text_enrich.py.
     """
-    try:
-        # We need to unnest the array if it's stored as array, or parse the string.
-        # Since we stored it as string in raw, let's look at fct_image_detections.
-        # Assuming fct_image_detections has it properly or we parse.
-        # Actually, let's query the simpler `image_category` or attempt to parse `detected_objects`
-        # For this prototype, we'll return top image categories as "products" if object parsing is hard in SQL,
-        # BUT the requirement says "Most frequently mentioned terms/products". 
-        # Let's try to extract from message_text using simple SQL split if possible, or use YOLO objects.
-        # Let's stick to YOLO objects for "Visual Products".
-        
-        # Postgres specific: unnest array if it was array. 
-        # If text, we might need to rely on simplistic counting of image categories for stability.
-        # Let's query image_category for reliability in this demo.
-        
+    async def compute():
+        if analytics.ENABLED:
+            return (await analytics.holder.get(db)).top_products(limit)
+
+        # One fct_product_mentions row per message per product, so count(*) counts messages
         query = text("""
-            SELECT image_category as product_name, count(*) as count 
-            FROM fct_image_detections 
-            WHERE image_category != 'other'
-            GROUP BY image_category 
-            ORDER BY count DESC 
+            SELECT product_name, count(*) as count
+            FROM fct_product_mentions
+            GROUP BY product_name
+            ORDER BY count DESC
             LIMIT :limit
         """)
-        result = db.execute(query, {"limit": limit}).fetchall()
+        result = (await db.execute(query, {"limit": limit})).fetchall()
         return [{"product_name": row[0], "count": row[1]} for row in result]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+    return await cache.cached_response(request, db, compute, List[schemas.TopProduct])
+
+@app.get("/api/reports/top-objects", response_model=List[schemas.TopObject])
+async def get_top_objects(request: Request, limit: int = 10, db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Returns the objects most frequently detected in images, people excluded.
+    """
+    async def compute():
+        if analytics.ENABLED:
+            return (await analytics.holder.get(db)).top_objects(limit)
+
+        # agg_daily_object_counts holds one row per object per day
+        query = text("""
+            SELECT object_name, sum(object_count)::bigint as count
+            FROM agg_daily_object_counts
+            WHERE object_name != 'person'
+            GROUP BY object_name
+            ORDER BY count DESC
+            LIMIT :limit
+        """)
+        result = (await db.execute(query, {"limit": limit})).fetchall()
+        return [{"object_name": row[0], "count": row[1]} for row in result]
+
+    return await cache.cached_response(request, db, compute, List[schemas.TopObject])
+
+@app.get("/api/images/search", response_model=List[schemas.ImageDetection])
+async def search_images(object_name: str = Query(..., alias="object"), limit: int = 20,
+                        db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Returns images in which the given object (e.g. 'bottle') was detected.
+    """
+    # @> on the text[] column is served by the GIN index on fct_image_detections
+    sql = text("""
+        SELECT
+            d.message_id,
+            c.channel_name,
+            d.image_path,
+            d.image_category,
+            d.detected_objects,
+            d.confidence_score
+        FROM fct_image_detections d
+        JOIN dim_channels c ON d.channel_key = c.channel_key
+        WHERE d.detected_objects @> ARRAY[:object_name]::text[]
+        ORDER BY d.confidence_score DESC
+        LIMIT :limit
+    """)
+    result = (await db.execute(sql, {"object_name": object_name, "limit": limit})).fetchall()
+
+    return [
+        {
+            "message_id": row[0],
+            "channel_name": row[1],
+            "image_path": row[2],
+            "image_category": row[3],
+            "detected_objects": row[4],
+            "confidence_score": float(row[5]) if row[5] is not None else 0.0
+        }
+        for row in result
+    ]
 
 @app.get("/api/channels/{channel_name}/activity", response_model=List[schemas.ChannelActivity])
-def get_channel_activity(channel_name: str, db: Session = Depends(database.get_db)):
+async def get_channel_activity(request: Request, channel_name: str, db: AsyncSession = Depends(database.get_async_db)):
     """
     Returns daily posting activity for a specific channel.
     """
-    # Join fct_messages with dim_dates and dim_channels
-    # Note: adjusting for your schema exact names
-    query = text("""
-        SELECT 
-            d.full_date as date, 
-            count(*) as post_count
-        FROM fct_messages m
-        JOIN dim_channels c ON m.channel_key = c.channel_key
-        JOIN dim_dates d ON m.date_key = d.date_key
-        WHERE c.channel_name = :channel
-        GROUP BY d.full_date
-        ORDER BY d.full_date DESC
-    """)
-    result = db.execute(query, {"channel": channel_name}).fetchall()
+    async def compute():
+        if analytics.ENABLED:
+            snapshot = await analytics.holder.get(db)
+            if not snapshot.has_channel(channel_name):
+                raise HTTPException(status_code=404, detail="Channel not found")
+            return snapshot.channel_activity(channel_name)
+
+        # agg_channel_daily_activity is maintained by dbt, one row per channel per day
+        query = text("""
+            SELECT 
+                full_date as date, 
+                post_count
+            FROM agg_channel_daily_activity
+            WHERE channel_name = :channel
+            ORDER BY full_date DESC
+        """)
+        result = (await db.execute(query, {"channel": channel_name})).fetchall()
     
-    if not result:
-        # Check if channel exists to return 404 vs empty list
-        check = db.execute(text("SELECT 1 FROM dim_channels WHERE channel_name = :channel"), {"channel": channel_name}).fetchone()
-        if not check:
-             raise HTTPException(status_code=404, detail="Channel not found")
-        return []
+        if not result:
+            # Check if channel exists to return 404 vs empty list
+            check = (await db.execute(text("SELECT 1 FROM dim_channels WHERE channel_name = :channel"), {"channel": channel_name})).fetchone()
+            if not check:
+                 raise HTTPException(status_code=404, detail="Channel not found")
+            return []
         
-    return [{"date": str(row[0]), "post_count": row[1]} for row in result]
+        return [{"date": str(row[0]), "post_count": row[1]} for row in result]
+
+    return await cache.cached_response(request, db, compute, List[schemas.ChannelActivity])
+
+def _encode_cursor(rank, message_date, message_id):
+    payload = json.dumps([rank, message_date.isoformat(), message_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+def _decode_cursor(cursor):
+    """Returns (rank, message_date, message_id); asyncpg needs the date as a datetime."""
+    try:
+        rank, message_date, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), datetime.fromisoformat(message_date), int(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
 @app.get("/api/search/messages", response_model=List[schemas.Message])
-def search_messages(query: str, limit: int = 20, db: Session = Depends(database.get_db)):
+async def search_messages(response: Response, query: str,
+                          mode: Literal["fts", "substring"] = "substring",
+                          channel: Optional[str] = None,
+                          date_from: Optional[date] = None,
+                          date_to: Optional[date] = None,
+                          cursor: Optional[str] = None,
+                          limit: int = Query(20, ge=1, le=100),
+                          db: AsyncSession = Depends(database.get_async_db)):
     """
     Search messages by keyword.
+
+    mode=substring matches anywhere in the text (trigram index); mode=fts runs
+    ranked full-text search over whole words. Results come newest first (best
+    match first for fts). When more results exist, the X-Next-Cursor response
+    header holds the cursor for the next page.
     """
-    sql = text("""
+    params = {"query": query, "limit": limit}
+    conditions = []
+
+    if mode == "fts":
+        rank = "ts_rank(m.search_vector, websearch_to_tsquery('simple', :query))"
+        conditions.append("m.search_vector @@ websearch_to_tsquery('simple', :query)")
+        sort_columns = [rank, "m.message_date", "m.message_id"]
+        cursor_params = "CAST(:cursor_rank AS real), CAST(:cursor_date AS timestamp), :cursor_id"
+    else:
+        rank = "CAST(0 AS real)"
+        conditions.append("m.message_text ILIKE :pattern")
+        params["pattern"] = f"%{_escape_like(query)}%"
+        sort_columns = ["m.message_date", "m.message_id"]
+        cursor_params = "CAST(:cursor_date AS timestamp), :cursor_id"
+
+    if channel:
+        conditions.append("c.channel_name = :channel")
+        params["channel"] = channel
+    if date_from:
+        conditions.append("m.message_date >= :date_from")
+        params["date_from"] = datetime.combine(date_from, time.min)
+    if date_to:
+        conditions.append("m.message_date < :date_to")
+        params["date_to"] = datetime.combine(date_to + timedelta(days=1), time.min)
+    if cursor:
+        # Keyset pagination: continue strictly after the last row of the previous page
+        cursor_rank, cursor_date, cursor_id = _decode_cursor(cursor)
+        conditions.append(f"({', '.join(sort_columns)}) < ({cursor_params})")
+        params.update(cursor_date=cursor_date, cursor_id=cursor_id)
+        if mode == "fts":
+            params["cursor_rank"] = cursor_rank
+
+    order_by = ", ".join(f"{column} DESC" for column in sort_columns)
+    sql = text(f"""
         SELECT 
             m.message_id, 
             c.channel_name, 
-            d.full_date as message_date,
+            m.message_date,
             m.message_text, 
             m.view_count as views, 
-            m.forward_count as forwards
+            m.forward_count as forwards,
+            {rank} as rank
         FROM fct_messages m
         JOIN dim_channels c ON m.channel_key = c.channel_key
-        JOIN dim_dates d ON m.date_key = d.date_key
-        WHERE m.message_text ILIKE :query
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {order_by}
         LIMIT :limit
     """)
-    result = db.execute(sql, {"query": f"%{query}%", "limit": limit}).fetchall()
-    
+    result = (await db.execute(sql, params)).fetchall()
+
+    if len(result) == limit:
+        last = result[-1]
+        response.headers["X-Next-Cursor"] = _encode_cursor(last[6], last[2], last[0])
+
     return [
         {
             "message_id": row[0],
@@ -110,27 +242,67 @@ def search_messages(query: str, limit: int = 20, db: Session = Depends(database.
     ]
 
 @app.get("/api/reports/visual-content", response_model=List[schemas.VisualStats])
-def get_visual_stats(db: Session = Depends(database.get_db)):
+async def get_visual_stats(request: Request, db: AsyncSession = Depends(database.get_async_db)):
     """
     Returns statistics about image categories + average views per category.
     """
-    # Join fct_image_detections back to fct_messages to get view counts 
-    # (if not already in fct_image_detections, but wait, fct_image_detections doesn't have views usually, 
-    # checking schema... I didn't put views in fct_image_detections.
-    # So we join fct_image_detections -> fct_messages)
-    
-    sql = text("""
-        SELECT 
-            d.image_category, 
-            count(*) as count,
-            avg(m.view_count) as avg_views
-        FROM fct_image_detections d
-        JOIN fct_messages m ON d.message_id = m.message_id
-        GROUP BY d.image_category
-    """)
-    result = db.execute(sql).fetchall()
+    async def compute():
+        if analytics.ENABLED:
+            return (await analytics.holder.get(db)).visual_content()
+
+        # agg_daily_category_stats already carries the message views per category and day
+        sql = text("""
+            SELECT 
+                image_category, 
+                sum(image_count)::bigint as count,
+                sum(total_views)::float / nullif(sum(image_count), 0) as avg_views
+            FROM agg_daily_category_stats
+            GROUP BY image_category
+        """)
+        result = (await db.execute(sql)).fetchall()
     
-    return [
-        {"image_category": row[0], "count": row[1], "avg_views": float(row[2]) if row[2] else 0.0} 
-        for row in result
-    ]
+        return [
+            {"image_category": row[0], "count": row[1], "avg_views": float(row[2]) if row[2] else 0.0} 
+            for row in result
+        ]
+
+    return await cache.cached_response(request, db, compute, List[schemas.VisualStats])
+
+@app.get("/api/reports/engagement-by-object", response_model=List[schemas.ObjectEngagement])
+async def get_engagement_by_object(request: Request, limit: int = 10, min_images: int = 1,
+                                   db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Returns, per detected object, how many images show it and the views of the
+    messages carrying those images, highest average views first. Objects seen
+    in fewer than min_images images are left out.
+    """
+    async def compute():
+        if analytics.ENABLED:
+            return (await analytics.holder.get(db)).engagement_by_object(limit, min_images)
+
+        # An image with two bottles counts once for 'bottle'
+        sql = text("""
+            WITH image_objects AS (
+                SELECT DISTINCT image_path, channel_key, message_id, object_name
+                FROM fct_detected_objects
+            )
+            SELECT
+                o.object_name,
+                count(*) as image_count,
+                coalesce(sum(m.view_count), 0)::bigint as total_views,
+                coalesce(sum(m.view_count), 0)::float / count(*) as avg_views
+            FROM image_objects o
+            JOIN fct_messages m ON o.channel_key = m.channel_key AND o.message_id = m.message_id
+            GROUP BY o.object_name
+            HAVING count(*) >= greatest(:min_images, 1)
+            ORDER BY avg_views DESC, image_count DESC
+            LIMIT :limit
+        """)
+        result = (await db.execute(sql, {"limit": limit, "min_images": min_images})).fetchall()
+
+        return [
+            {"object_name": row[0], "image_count": row[1], "total_views": row[2], "avg_views": float(row[3])}
+            for row in result
+        ]
+
+    return await cache.cached_response(request, db, compute, List[schemas.ObjectEngagement])
@@ -0,0 +1,175 @@
+import os
+import time
+import logging
+import contextvars
+from anyio import to_thread
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from starlette.routing import Match
+
+# Queries slower than this are logged with their statement; 0 disables the log
+SLOW_QUERY_MS = float(os.getenv("API_SLOW_QUERY_MS", "500"))
+# Longest statement text written to the slow-query log
+SLOW_QUERY_MAX_CHARS = 1000
+
+logger = logging.getLogger(__name__)
+
+# Route label for requests that match no route, so stray paths do not add label values
+UNMATCHED_ROUTE = "unmatched"
+
+REQUEST_LATENCY = Histogram(
+    "api_request_duration_seconds", "Time from receiving a request to sending the last body byte.",
+    ["method", "route", "status"],
+)
+REQUEST_DB_TIME = Histogram(
+    "api_request_db_seconds", "Time a request spent in database queries.",
+    ["method", "route"],
+)
+REQUESTS_IN_FLIGHT = Gauge("api_requests_in_flight", "Requests being handled.", ["method", "route"])
+RESPONSE_SIZE = Histogram(
+    "api_response_size_bytes", "Response body size.", ["method", "route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+THREADPOOL_IN_USE = Gauge("api_threadpool_threads_in_use", "Worker threads running sync endpoints and dependencies.")
+THREADPOOL_LIMIT = Gauge("api_threadpool_threads_limit", "Most worker threads that can run at once.")
+
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Time to execute a query and receive its result.",
+    ["engine", "operation"],
+)
+QUERY_ERRORS = Counter("db_query_errors_total", "Queries that raised an error.", ["engine", "operation"])
+SLOW_QUERIES = Counter("db_slow_queries_total", "Queries slower than API_SLOW_QUERY_MS.", ["engine", "operation"])
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to get a connection from the pool, opening one if needed.",
+    ["engine"],
+)
+POOL_CHECKOUT_TIMEOUTS = Counter("db_pool_checkout_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT.",
+                                 ["engine"])
+POOL_IN_USE = Gauge("db_pool_connections_in_use", "Connections checked out of the pool.", ["engine"])
+POOL_IDLE = Gauge("db_pool_connections_idle", "Open connections waiting in the pool.", ["engine"])
+POOL_LIMIT = Gauge("db_pool_connections_limit", "Most connections the pool opens (pool size plus overflow).",
+                   ["engine"])
+
+# Seconds of database time of the request being handled, as a one-item list the query hooks add to
+_request_db_seconds = contextvars.ContextVar("request_db_seconds", default=None)
+
+def route_template(scope):
+    """Returns the path template of the route a request matches, e.g. '/api/channels/{channel_name}/activity'."""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", UNMATCHED_ROUTE)
+    return UNMATCHED_ROUTE
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording, per method and route template, the request
+    latency, the part of it spent in database queries, the requests in
+    flight and the response size.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method, route = scope["method"], route_template(scope)
+        # An exception escaping the app becomes a 500 further out
+        status = 500
+        size = 0
+
+        async def send_and_measure(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        db_seconds = [0.0]
+        token = _request_db_seconds.set(db_seconds)
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(time.perf_counter() - start)
+            in_flight.dec()
+            _request_db_seconds.reset(token)
+            REQUEST_DB_TIME.labels(method, route).observe(db_seconds[0])
+            RESPONSE_SIZE.labels(method, route).observe(size)
+
+def _operation(statement):
+    """The statement's leading keyword, e.g. 'SELECT', as a low-cardinality label."""
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+def instrument_engine(engine, name, max_connections):
+    """
+    Times every query run on engine (a sync Engine; pass
+    AsyncEngine.sync_engine for an async one), logs the slow ones and
+    exposes the pool's usage under the engine label name.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = _operation(statement)
+        QUERY_DURATION.labels(name, operation).observe(elapsed)
+        db_seconds = _request_db_seconds.get()
+        if db_seconds is not None:
+            db_seconds[0] += elapsed
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            SLOW_QUERIES.labels(name, operation).inc()
+            # Parameters are left out: they hold user input such as search terms
+            logger.warning(f"Slow query ({elapsed * 1000:.0f} ms, {name}): "
+                           f"{' '.join(statement.split())[:SLOW_QUERY_MAX_CHARS]}")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+        QUERY_ERRORS.labels(name, _operation(context.statement or "")).inc()
+
+    # engine.pool is looked up on each scrape: dispose() replaces it
+    POOL_IN_USE.labels(name).set_function(lambda: engine.pool.checkedout())
+    POOL_IDLE.labels(name).set_function(lambda: engine.pool.checkedin())
+    POOL_LIMIT.labels(name).set(max_connections)
+
+def timed_pool(pool_class, name):
+    """A subclass of pool_class that records how long each checkout waits, under the engine label name."""
+    wait = POOL_CHECKOUT_WAIT.labels(name)
+    timeouts = POOL_CHECKOUT_TIMEOUTS.labels(name)
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except PoolTimeoutError:
+                timeouts.inc()
+                raise
+            finally:
+                wait.observe(time.perf_counter() - start)
+
+    TimedPool.__name__ = TimedPool.__qualname__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+async def metrics_response():
+    """All metrics of this process in the Prometheus text format."""
+    # The limiter belongs to the running event loop, so it is read here rather than at import
+    limiter = to_thread.current_default_thread_limiter()
+    THREADPOOL_IN_USE.set(limiter.borrowed_tokens)
+    THREADPOOL_LIMIT.set(limiter.total_tokens)
+    # Passed as a header: a media_type would get a second charset appended
+    return Response(generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST})
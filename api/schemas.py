@@ -22,3 +22,21 @@ class VisualStats(BaseModel):
 class TopProduct(BaseModel):
     product_name: str
     count: int
+
+class TopObject(BaseModel):
+    object_name: str
+    count: int
+
+class ObjectEngagement(BaseModel):
+    object_name: str
+    image_count: int
+    total_views: int
+    avg_views: float
+
+class ImageDetection(BaseModel):
+    message_id: int
+    channel_name: str
+    image_path: str
+    image_category: str
+    detected_objects: List[str]
+    confidence_score: float
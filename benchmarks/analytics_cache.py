@@ -0,0 +1,84 @@
+"""
+Compares report endpoint latency served by SQL against the in-memory analytics snapshot.
+
+Runs the report endpoints in-process, with the response cache off, once
+with API_ANALYTICS_MODE=sql and once from the columnar snapshot
+(api/analytics.py), against marts already built in DB_NAME, e.g. by
+run_suite.py. Also reports how long the snapshot takes to load and how much
+memory its arrays hold.
+
+Run from the repository root:
+    python benchmarks/analytics_cache.py --db-name medical_bench --channel tikvahpharma [--requests 200]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+import run_suite
+
+def report_paths(channel_name):
+    return [
+        "/api/reports/top-products?limit=10",
+        "/api/reports/top-objects?limit=10",
+        "/api/reports/visual-content",
+        "/api/reports/engagement-by-object?limit=10",
+        f"/api/channels/{channel_name}/activity",
+    ]
+
+async def load_snapshot():
+    from api import analytics, cache, database
+
+    async with database.AsyncSessionLocal() as db:
+        version = await cache.data_version.get(db)
+    start = time.perf_counter()
+    analytics.holder.snapshot = await analytics.load_snapshot(version)
+    return time.perf_counter() - start, analytics.holder.snapshot
+
+async def compare(paths, requests):
+    """
+    Returns (SQL latencies, snapshot load seconds, snapshot, snapshot latencies).
+    All in one event loop: the engine's pooled asyncpg connections belong to
+    the loop that opened them.
+    """
+    from api import analytics, database
+
+    try:
+        analytics.ENABLED = False
+        sql = await run_suite.time_requests(paths, requests)
+        elapsed, snapshot = await load_snapshot()
+        analytics.ENABLED = True
+        memory = await run_suite.time_requests(paths, requests)
+    finally:
+        await database.async_engine.dispose()
+    return sql, elapsed, snapshot, memory
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db-name', help="Database holding the marts (default: DB_NAME from .env)")
+    parser.add_argument('--channel', required=True, help="Channel for the activity endpoint")
+    parser.add_argument('--requests', type=int, default=200, help="Timed requests per endpoint and mode")
+    args = parser.parse_args()
+
+    if args.db_name:
+        os.environ['DB_NAME'] = args.db_name
+    # Every request must reach the query or the snapshot, not a cached body
+    os.environ['API_CACHE_MAX_ENTRIES'] = '0'
+
+    paths = report_paths(args.channel)
+    sql, elapsed, snapshot, memory = asyncio.run(compare(paths, args.requests))
+    print(f"Snapshot: {len(snapshot.message_date)} messages, {len(snapshot.image_category)} images, "
+          f"{snapshot.nbytes / 2**20:.1f} MiB, loaded in {elapsed:.2f}s")
+
+    print(f"{'endpoint':<45} {'sql p50':>8} {'p99':>8} {'memory p50':>11} {'p99':>8} {'speedup':>8}")
+    for path in paths:
+        sql_p50, memory_p50 = run_suite.percentile(sql[path], 50), run_suite.percentile(memory[path], 50)
+        print(f"{path:<45} {sql_p50:8.2f} {run_suite.percentile(sql[path], 99):8.2f} "
+              f"{memory_p50:11.2f} {run_suite.percentile(memory[path], 99):8.2f} {sql_p50 / memory_p50:7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Load-tests the API against a local Postgres and compares a baseline with the current tree.
+
+Both servers are started here with uvicorn on the same database (DB_* from
+.env). The baseline is either a running server (--baseline-url) or a git ref
+checked out into a temporary worktree, e.g. the last commit with the
+synchronous handlers.
+
+Run from the repository root:
+    python benchmarks/api_load_test.py --baseline-ref <sync commit> [--concurrency 50] [--duration 20]
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PATHS = [
+    "/api/reports/top-products?limit=10",
+    "/api/reports/top-objects?limit=10",
+    "/api/reports/visual-content",
+    "/api/channels/lobelia4cosmetics/activity",
+    "/api/search/messages?query=cream&limit=20",
+    "/api/images/search?object=bottle&limit=20",
+]
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+@contextmanager
+def server(app_dir, port, workers):
+    """Runs api.main:app from app_dir until the block exits."""
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api.main:app', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=app_dir,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(url + "/", timeout=1)
+                break
+            except httpx.TransportError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"Server in {app_dir} did not start")
+                time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+@contextmanager
+def worktree(ref):
+    """Checks ref out into a temporary git worktree."""
+    path = tempfile.mkdtemp(prefix='api-baseline-')
+    subprocess.run(['git', 'worktree', 'add', '--detach', path, ref], cwd=ROOT_DIR, check=True,
+                   stdout=subprocess.DEVNULL)
+    # The worktree has no .env; share the database settings of this checkout
+    if os.path.exists(os.path.join(ROOT_DIR, '.env')):
+        shutil.copy(os.path.join(ROOT_DIR, '.env'), path)
+    try:
+        yield path
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', path], cwd=ROOT_DIR, check=False)
+
+async def load(base_url, paths, concurrency, duration, warmup):
+    """Returns (sorted latencies in ms, error count, elapsed seconds) for the measured window."""
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def worker(offset, until, record):
+            nonlocal errors
+            i = offset
+            while time.perf_counter() < until:
+                path = paths[i % len(paths)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if not record:
+                    continue
+                if ok:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+
+        # Warm up pools and caches, then measure
+        until = time.perf_counter() + warmup
+        await asyncio.gather(*(worker(n, until, False) for n in range(concurrency)))
+        start = time.perf_counter()
+        until = start + duration
+        await asyncio.gather(*(worker(n, until, True) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return sorted(latencies), errors, elapsed
+
+def report(label, latencies, errors, elapsed):
+    rps = len(latencies) / elapsed
+    p50 = percentile(latencies, 50) if latencies else float('nan')
+    p99 = percentile(latencies, 99) if latencies else float('nan')
+    print(f"{label:>10} {len(latencies):>9} {errors:>7} {rps:>9.1f} {p50:>8.1f} {p99:>8.1f}")
+    return rps, p99
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    baseline = parser.add_mutually_exclusive_group(required=True)
+    baseline.add_argument('--baseline-ref', help="Git ref to serve as the baseline")
+    baseline.add_argument('--baseline-url', help="URL of an already running baseline server")
+    parser.add_argument('--candidate-url', help="URL of an already running candidate server (default: start the working tree)")
+    parser.add_argument('--concurrency', type=int, default=50, help="Concurrent client connections")
+    parser.add_argument('--duration', type=float, default=20, help="Measured seconds per server")
+    parser.add_argument('--warmup', type=float, default=3, help="Unmeasured seconds per server")
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn worker processes per started server")
+    parser.add_argument('--paths', default=','.join(DEFAULT_PATHS), help="Comma-separated request paths, cycled through")
+    args = parser.parse_args()
+
+    paths = args.paths.split(',')
+
+    def run(label, app_dir, url, port):
+        if url:
+            return report(label, *asyncio.run(load(url, paths, args.concurrency, args.duration, args.warmup)))
+        with server(app_dir, port, args.workers) as started_url:
+            return report(label, *asyncio.run(load(started_url, paths, args.concurrency, args.duration, args.warmup)))
+
+    print(f"{len(paths)} paths, {args.concurrency} connections, {args.duration:.0f}s per server")
+    print(f"{'server':>10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    if args.baseline_ref:
+        with worktree(args.baseline_ref) as baseline_dir:
+            base_rps, base_p99 = run('baseline', baseline_dir, None, 8101)
+    else:
+        base_rps, base_p99 = run('baseline', None, args.baseline_url, None)
+    cand_rps, cand_p99 = run('candidate', ROOT_DIR, args.candidate_url, 8102)
+
+    print(f"candidate vs baseline: {cand_rps / base_rps:.2f}x req/s, p99 {cand_p99 / base_p99:.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures loader parsing throughput for several worker counts, without a database.
+
+Times turning raw message files into COPY-ready CSV: the single-core
+json.load path the loader used before, and message_batches' orjson/Arrow
+parsing with 0 (in-process) to N worker processes. Generate input with
+benchmarks/synthetic_data.py.
+
+Run from the repository root:
+    python benchmarks/loader_parsing.py --root /tmp/bench [--workers 0,1,2,4,8]
+"""
+import os
+import io
+import sys
+import csv
+import time
+import argparse
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+import loader
+import message_batches
+
+def time_json_load(json_files):
+    """The previous path: json.load per file, then one Python tuple per record written with csv."""
+    start = time.perf_counter()
+    rows = 0
+    for record in loader.iter_records(json_files):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([record.get(col) for col, _ in loader.MESSAGE_COLUMNS])
+        rows += 1
+    return rows, time.perf_counter() - start
+
+def time_arrow(json_files, workers, chunk_rows):
+    start = time.perf_counter()
+    rows = 0
+    batches = (batch for _, batch in loader.iter_message_batches(json_files, parse_workers=workers))
+    for table in message_batches.iter_tables(batches, chunk_rows):
+        buffer = io.BytesIO()
+        message_batches.pa_csv.write_csv(table, buffer, message_batches.pa_csv.WriteOptions(include_header=False))
+        rows += table.num_rows
+    return rows, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', required=True, help="Directory holding data/raw/telegram_messages")
+    parser.add_argument('--workers', default=f"0,1,2,4,{os.cpu_count() or 4}",
+                        help="Comma-separated parse worker counts")
+    parser.add_argument('--chunk-rows', type=int, default=loader.COPY_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    os.chdir(args.root)
+    json_files = loader.find_json_files()
+    if not json_files:
+        print(f"No raw message files under {args.root}.")
+        return
+    print(f"{len(json_files)} files, {os.cpu_count()} cores")
+
+    rows, elapsed = time_json_load(json_files)
+    baseline = rows / elapsed
+    print(f"{'json.load':>12}: {rows} rows in {elapsed:6.2f}s  {baseline:>10,.0f} rows/s")
+    for workers in sorted({int(w) for w in args.workers.split(',')}):
+        rows, elapsed = time_arrow(json_files, workers, args.chunk_rows)
+        rate = rows / elapsed
+        print(f"{f'arrow x{workers}':>12}: {rows} rows in {elapsed:6.2f}s  {rate:>10,.0f} rows/s  "
+              f"({rate / baseline:.1f}x)")
+
+if __name__ == '__main__':
+    main()
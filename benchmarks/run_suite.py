@@ -0,0 +1,204 @@
+"""
+Runs the offline end-to-end benchmark suite on synthetic data against a local Postgres.
+
+Times the loader, the YOLO detection loop, product mention extraction, the
+dbt marts and every API endpoint on a dataset from synthetic_data.py, and
+saves the timings as a run report in the format of src/instrumentation.py, so
+any two runs compare with `python src/instrumentation.py compare` or
+--baseline here. Point DB_NAME at a scratch database: the loader replaces
+raw.telegram_messages and dbt rebuilds the marts.
+
+Run from the repository root:
+    createdb medical_bench
+    python benchmarks/run_suite.py --root /tmp/bench --generate 1000000 --db-name medical_bench \\
+        --output benchmarks/results/baseline.json
+    python benchmarks/run_suite.py --root /tmp/bench --db-name medical_bench \\
+        --output benchmarks/results/candidate.json --baseline benchmarks/results/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT_DIR, 'src')
+DBT_DIR = os.path.join(ROOT_DIR, 'medical_warehouse')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from dotenv import load_dotenv
+import instrumentation
+import synthetic_data
+
+# dbt runs as a subprocess and reads the DB_* settings from the environment
+load_dotenv(os.path.join(ROOT_DIR, '.env'))
+
+STEPS = ['loader', 'yolo', 'text', 'dbt', 'api']
+
+def api_paths(channel_name):
+    return [
+        "/api/reports/top-products?limit=10",
+        "/api/reports/top-objects?limit=10",
+        "/api/reports/visual-content",
+        "/api/reports/engagement-by-object?limit=10",
+        f"/api/channels/{channel_name}/activity",
+        "/api/search/messages?query=cream&limit=20",
+        "/api/search/messages?query=paracetamol&mode=fts&limit=20",
+        "/api/images/search?object=bottle&limit=20",
+    ]
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def bench_loader():
+    """
+    A full COPY load, then an incremental load that finds every file
+    unchanged. The copy load does not write the raw.loaded_files manifest,
+    so an untimed incremental load brings it up to date first; otherwise the
+    no-op stage of a fresh database would re-parse and upsert every file.
+    """
+    import loader
+
+    with instrumentation.stage('loader'):
+        loader.load_data('copy')
+        with instrumentation.unrecorded():
+            loader.load_data_incremental()
+        with instrumentation.stage('incremental_noop', unit='files') as noop:
+            noop.items = loader.load_data_incremental()['files']
+
+def bench_yolo(images):
+    """
+    The batched detection loop on its own, then run_detection to store results
+    for the marts (served from the detection cache on later runs).
+    """
+    import yolo_detect
+
+    image_paths = yolo_detect.find_images()[:images]
+    if not image_paths:
+        print("No synthetic images; skipping yolo.")
+        return
+    with instrumentation.stage('yolo'):
+        model, _ = yolo_detect.load_model()
+        # One-off model initialisation is not part of the loop
+        yolo_detect.detect_images(model, image_paths[:yolo_detect.BATCH_SIZE])
+        with instrumentation.stage('detection_loop', unit='images', items=len(image_paths)):
+            yolo_detect.detect_images(model, image_paths)
+        yolo_detect.run_detection(image_paths)
+
+def bench_text():
+    """Product mention extraction over every message, then a run that finds nothing new."""
+    import text_enrich
+
+    with instrumentation.stage('text'):
+        text_enrich.run_extraction()
+        with instrumentation.stage('incremental_noop', unit='messages') as noop:
+            noop.items = text_enrich.run_extraction()['messages']
+
+def dbt(*args):
+    subprocess.run(['dbt', *args], cwd=DBT_DIR, check=True)
+
+def bench_dbt():
+    """A full rebuild of the marts, then an incremental run with no new rows."""
+    with instrumentation.stage('dbt'):
+        dbt('seed')
+        for label, args in (('full_refresh', ['run', '--full-refresh']), ('incremental_noop', ['run'])):
+            with instrumentation.stage(label, unit='nodes') as dbt_stage:
+                dbt(*args)
+                instrumentation.record_dbt_results(os.path.join(DBT_DIR, 'target', 'run_results.json'))
+                dbt_stage.items = len(dbt_stage.children)
+        dbt('run-operation', 'bump_warehouse_version')
+
+async def time_requests(paths, requests):
+    """Returns {path: sorted latencies in ms} of requests sequential calls per path to the app in-process."""
+    import httpx
+    from api.main import app
+
+    latencies = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in paths:
+            # Warm up the connection pool and Postgres' buffers for this query
+            for _ in range(3):
+                (await client.get(path)).raise_for_status()
+            timings = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                (await client.get(path)).raise_for_status()
+                timings.append((time.perf_counter() - start) * 1000)
+            latencies[path] = sorted(timings)
+    return latencies
+
+def bench_api(paths, requests):
+    """Each endpoint's latency with the response cache off, so every request runs its query."""
+    os.environ['API_CACHE_MAX_ENTRIES'] = '0'
+    latencies = asyncio.run(time_requests(paths, requests))
+    with instrumentation.stage('api'):
+        for path, timings in latencies.items():
+            instrumentation.record(f"GET {path}", sum(timings) / 1000, items=len(timings), unit='requests')
+    return {path: {'p50': percentile(timings, 50), 'p95': percentile(timings, 95), 'p99': percentile(timings, 99)}
+            for path, timings in latencies.items()}
+
+def git_commit():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', required=True, help="Synthetic dataset directory (see synthetic_data.py)")
+    parser.add_argument('--generate', type=int, metavar='MESSAGES',
+                        help="Generate a dataset of this many messages under --root first")
+    parser.add_argument('--days', type=int, default=30, help="Days of history to generate")
+    parser.add_argument('--db-name', help="Database to run against (default: DB_NAME from .env)")
+    parser.add_argument('--steps', default=','.join(STEPS), help=f"Comma-separated subset of {','.join(STEPS)}")
+    parser.add_argument('--images', type=int, default=1000, help="Images to run through YOLO")
+    parser.add_argument('--requests', type=int, default=50, help="Timed requests per API endpoint")
+    parser.add_argument('--output', help="Run report path (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--baseline', help="Run report to compare this run against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown that counts as a regression (default: 0.2)")
+    args = parser.parse_args()
+
+    steps = args.steps.split(',')
+    root = os.path.abspath(args.root)
+    output = os.path.abspath(args.output or os.path.join(
+        ROOT_DIR, 'benchmarks', 'results', f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.json"))
+    # Set before the pipeline modules read their settings; dbt reads the same variables
+    if args.db_name:
+        os.environ['DB_NAME'] = args.db_name
+
+    if args.generate:
+        synthetic_data.generate(root, args.generate, days=args.days)
+    with open(os.path.join(root, 'data', 'raw', 'synthetic_manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    # The pipeline scripts resolve data/raw/... relative to the working directory
+    os.chdir(root)
+    latency_ms = None
+    if 'loader' in steps:
+        bench_loader()
+    if 'yolo' in steps:
+        bench_yolo(args.images)
+    if 'text' in steps:
+        bench_text()
+    if 'dbt' in steps:
+        bench_dbt()
+    if 'api' in steps:
+        latency_ms = bench_api(api_paths(manifest['channels'][0]), args.requests)
+
+    instrumentation.write_report(output, run_id=os.path.splitext(os.path.basename(output))[0],
+                                 script='run_suite', commit=git_commit(), dataset=manifest, latency_ms=latency_ms)
+    print(f"Report written to {output}")
+
+    if args.baseline:
+        regressions = instrumentation.compare(os.path.abspath(args.baseline), output, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stages regressed by more than {args.threshold:.0%}.")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares serial and concurrent scraping against the offline fake client.
+
+The fake client enforces no rate limits, so request pacing is switched off
+(see benchmarks/scraper_rate_limits.py for pacing): otherwise the download
+token bucket, not the concurrency, sets the pace of both runs.
+
+Usage: python benchmarks/scraper_concurrency.py [--channels 6] [--messages 60]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+# Requests per second high enough that the rate limiter never waits
+UNPACED = 1000.0
+
+async def run(channels, client_kwargs, channel_concurrency, media_workers):
+    import scraper
+    from fake_telegram import FakeTelegramClient
+
+    # Per-message progress logs would dominate the timings
+    logging.getLogger('').setLevel(logging.WARNING)
+    scraper.rate_limiter = scraper.RateLimiter({method: (UNPACED, int(UNPACED)) for method in scraper.RATE_LIMITS})
+
+    async with FakeTelegramClient(**client_kwargs) as client:
+        start = time.perf_counter()
+        await scraper.scrape_channels(client, channels, channel_concurrency, media_workers)
+        return time.perf_counter() - start, client.download_count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--channels', type=int, default=6)
+    parser.add_argument('--messages', type=int, default=60, help="Messages per channel")
+    parser.add_argument('--photo-ratio', type=float, default=0.5)
+    parser.add_argument('--request-latency', type=float, default=0.05)
+    parser.add_argument('--download-latency', type=float, default=0.1)
+    parser.add_argument('--channel-concurrency', type=int, default=3)
+    parser.add_argument('--media-workers', type=int, default=8)
+    args = parser.parse_args()
+
+    channels = [f"channel_{i}" for i in range(args.channels)]
+    client_kwargs = {
+        'messages_per_channel': args.messages,
+        'photo_ratio': args.photo_ratio,
+        'request_latency': args.request_latency,
+        'download_latency': args.download_latency,
+    }
+    configs = [
+        ('serial', 1, 0),
+        ('concurrent', args.channel_concurrency, args.media_workers),
+    ]
+
+    results = {}
+    for name, channel_concurrency, media_workers in configs:
+        # The scraper writes to relative data/ and logs/ paths; keep each run isolated
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            elapsed, downloads = asyncio.run(run(channels, client_kwargs, channel_concurrency, media_workers))
+        results[name] = elapsed
+        print(f"{name:>10}: {elapsed:6.2f}s  channels={channel_concurrency} media_workers={media_workers} "
+              f"downloads={downloads}")
+
+    print(f"speedup: {results['serial'] / results['concurrent']:.1f}x")
+
+if __name__ == '__main__':
+    main()
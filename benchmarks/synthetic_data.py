@@ -0,0 +1,213 @@
+"""
+Generates synthetic Telegram channel data in the layout the scraper writes.
+
+Messages go to <root>/data/raw/telegram_messages/YYYY-MM-DD/<channel>.json
+and photos to <root>/data/raw/images/<channel>/<id>.jpg, with image_path
+relative to <root> like the scraper's. Files are streamed one record at a
+time, so millions of messages need no more memory than a few. Output is
+deterministic for a given --seed.
+
+Run from the repository root:
+    python benchmarks/synthetic_data.py --root /tmp/bench [--messages 1000000] [--days 90] [--image-ratio 0.3]
+"""
+import os
+import json
+import random
+import argparse
+from datetime import date, datetime, time, timedelta, timezone
+
+import cv2
+import numpy as np
+
+CHANNELS = ['lobelia4cosmetics', 'tikvahpharma', 'CheMed123']
+
+PRODUCTS = [
+    'Paracetamol 500mg', 'Amoxicillin 250mg', 'Vitamin C 1000mg', 'Omeprazole 20mg',
+    'Ibuprofen 400mg', 'Metformin 850mg', 'Cetirizine 10mg', 'Azithromycin 500mg',
+    'Nivea Soft Cream', 'Cerave Moisturizing Lotion', 'Vaseline Petroleum Jelly',
+    'La Roche-Posay Sunscreen SPF50', 'Johnson Baby Oil', 'Dettol Antiseptic',
+    'Blood Pressure Monitor', 'Digital Thermometer', 'Glucometer Strips', 'Face Mask N95',
+]
+TEMPLATES = [
+    "{product}\nዋጋ: {price} ብር\n📞 {phone}",
+    "አዲስ ገቢ! {product} — {price} ETB\nDelivery available. Call {phone}",
+    "{product} available now. Price {price} birr. ለማዘዝ {phone}",
+    "💊 {product}\n✅ Original\n💵 {price} ብር\n📍 Bole, Addis Ababa\n{phone}",
+    "ቅናሽ! {product} እና {other} በ {price} ብር ብቻ",
+    "{product} #{tag} #pharmacy #ethiopia",
+]
+TAGS = ['skincare', 'medicine', 'vitamins', 'cosmetics', 'babycare', 'devices']
+
+def message_text(rng):
+    product, other = rng.sample(PRODUCTS, 2)
+    return rng.choice(TEMPLATES).format(
+        product=product,
+        other=other,
+        price=rng.choice([45, 80, 120, 250, 380, 560, 900, 1450, 2300]),
+        phone=f"+2519{rng.randint(10000000, 99999999)}",
+        tag=rng.choice(TAGS),
+    )
+
+def draw_image(rng, size):
+    """A product-photo stand-in: a coloured background with a few bottles, boxes and blobs."""
+    np_rng = np.random.default_rng(rng.getrandbits(32))
+    image = np.full((size, size, 3), np_rng.integers(120, 255, 3), dtype=np.uint8)
+    image = cv2.add(image, np_rng.integers(0, 25, (size, size, 3), dtype=np.uint8))
+    for _ in range(rng.randint(1, 4)):
+        color = tuple(int(c) for c in np_rng.integers(0, 255, 3))
+        x, y = rng.randint(0, size * 3 // 4), rng.randint(0, size * 3 // 4)
+        w, h = rng.randint(size // 10, size // 3), rng.randint(size // 6, size // 2)
+        shape = rng.random()
+        if shape < 0.4:
+            # Bottle: body plus neck
+            cv2.rectangle(image, (x, y + h // 4), (x + w, y + h), color, -1)
+            cv2.rectangle(image, (x + w // 3, y), (x + 2 * w // 3, y + h // 4), color, -1)
+        elif shape < 0.8:
+            cv2.rectangle(image, (x, y), (x + w, y + h), color, -1)
+        else:
+            cv2.circle(image, (x + w // 2, y + h // 2), w // 2, color, -1)
+    return image
+
+class ImageWriter:
+    """Writes JPEGs, reposting an earlier image of the channel for a share of them like real channels do."""
+
+    def __init__(self, root, rng, size, quality, duplicate_ratio):
+        self.root = root
+        self.rng = rng
+        self.size = size
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.duplicate_ratio = duplicate_ratio
+        self.recent = {}
+        self.count = 0
+        self.bytes = 0
+
+    def write(self, channel_name, message_id):
+        relative = os.path.join('data', 'raw', 'images', channel_name, f"{message_id}.jpg")
+        recent = self.recent.setdefault(channel_name, [])
+        if recent and self.rng.random() < self.duplicate_ratio:
+            encoded = self.rng.choice(recent)
+        else:
+            ok, buffer = cv2.imencode('.jpg', draw_image(self.rng, self.size), self.params)
+            if not ok:
+                raise RuntimeError("JPEG encoding failed")
+            encoded = buffer.tobytes()
+            recent.append(encoded)
+            del recent[:-20]
+        with open(os.path.join(self.root, relative), 'wb') as f:
+            f.write(encoded)
+        self.count += 1
+        self.bytes += len(encoded)
+        return relative
+
+def day_counts(rng, total, days):
+    """Splits total messages over days with some day-to-day variation."""
+    weights = [rng.uniform(0.5, 1.5) for _ in range(days)]
+    scale = total / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    counts[-1] += total - sum(counts)
+    return counts
+
+def write_file(path, records, fmt):
+    """Streams records to a JSON array (or NDJSON) file and returns how many were written."""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        if fmt == 'json':
+            f.write('[\n')
+        for record in records:
+            if fmt == 'json':
+                f.write(',\n' if count else '')
+                f.write(json.dumps(record, ensure_ascii=False, indent=4))
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+        if fmt == 'json':
+            f.write('\n]\n')
+    return count
+
+def generate(root, messages, days=30, end_date=None, channels=CHANNELS, image_ratio=0.3, max_images=None,
+             image_size=320, jpeg_quality=85, duplicate_ratio=0.1, fmt='json', seed=42):
+    """Writes the synthetic dataset under root and returns its manifest."""
+    rng = random.Random(seed)
+    end_date = end_date or datetime.now(timezone.utc).date() - timedelta(days=1)
+    start_date = end_date - timedelta(days=days - 1)
+    messages_dir = os.path.join(root, 'data', 'raw', 'telegram_messages')
+    for channel_name in channels:
+        os.makedirs(os.path.join(root, 'data', 'raw', 'images', channel_name), exist_ok=True)
+
+    images = ImageWriter(root, rng, image_size, jpeg_quality, duplicate_ratio)
+    next_id = {channel_name: 1 for channel_name in channels}
+    files = 0
+    written = 0
+
+    def records(channel_name, day, count):
+        # Telegram returns a day's messages newest first
+        seconds = sorted((rng.randrange(86400) for _ in range(count)), reverse=True)
+        first_id = next_id[channel_name]
+        next_id[channel_name] += count
+        for offset, second in enumerate(seconds):
+            message_id = first_id + count - 1 - offset
+            posted = datetime.combine(day, time(), tzinfo=timezone.utc) + timedelta(seconds=second)
+            has_media = rng.random() < image_ratio and (max_images is None or images.count < max_images)
+            yield {
+                'message_id': message_id,
+                'channel_name': channel_name,
+                'date': posted.isoformat(),
+                'message_text': message_text(rng) if not has_media or rng.random() < 0.8 else '',
+                'views': int(rng.lognormvariate(7, 1.2)),
+                'forwards': int(rng.expovariate(1 / 4)),
+                'has_media': has_media,
+                'image_path': images.write(channel_name, message_id) if has_media else None,
+            }
+
+    per_channel = day_counts(rng, messages, len(channels))
+    for channel_name, channel_total in zip(channels, per_channel):
+        for offset, count in enumerate(day_counts(rng, channel_total, days)):
+            if count == 0:
+                continue
+            day = start_date + timedelta(days=offset)
+            folder = os.path.join(messages_dir, day.isoformat())
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{channel_name}.{'json' if fmt == 'json' else 'jsonl'}")
+            written += write_file(path, records(channel_name, day, count), fmt)
+            files += 1
+        print(f"{channel_name}: {channel_total} messages")
+
+    manifest = {
+        'messages': written,
+        'files': files,
+        'images': images.count,
+        'image_bytes': images.bytes,
+        'channels': list(channels),
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'image_size': image_size,
+        'format': fmt,
+        'seed': seed,
+    }
+    with open(os.path.join(root, 'data', 'raw', 'synthetic_manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', required=True, help="Directory to write data/raw/... under")
+    parser.add_argument('--messages', type=int, default=100000, help="Total messages across all channels")
+    parser.add_argument('--days', type=int, default=30, help="Days of history, ending yesterday (or --end-date)")
+    parser.add_argument('--end-date', type=date.fromisoformat)
+    parser.add_argument('--channels', default=','.join(CHANNELS))
+    parser.add_argument('--image-ratio', type=float, default=0.3, help="Share of messages with a photo")
+    parser.add_argument('--max-images', type=int, help="Stop attaching photos after this many")
+    parser.add_argument('--image-size', type=int, default=320, help="Photo width and height in pixels")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1, help="Share of photos that repost an earlier one")
+    parser.add_argument('--format', choices=['json', 'jsonl'], default='json')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    manifest = generate(args.root, args.messages, args.days, args.end_date, args.channels.split(','),
+                        args.image_ratio, args.max_images, args.image_size, duplicate_ratio=args.duplicate_ratio,
+                        fmt=args.format, seed=args.seed)
+    print(f"Wrote {manifest['messages']} messages in {manifest['files']} files and "
+          f"{manifest['images']} images ({manifest['image_bytes'] / 2**20:.1f} MiB) under {args.root}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Compares YOLO inference backends on a fixed image set: latency percentiles,
+throughput, and agreement of classify_image categories with the PyTorch
+640px baseline.
+
+Run from the repository root:
+    python benchmarks/yolo_backends.py [--images 200] [--configs torch:640,torch:320,onnx:640,onnx:320]
+"""
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+import yolo_detect
+
+BASELINE = ('torch', 640)
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_config(backend, imgsz, image_paths, batch_size):
+    """Returns (per-image latencies in ms, batched images/s, {image_path: category})."""
+    model, _ = yolo_detect.load_model(backend)
+    images = [yolo_detect.load_image(path, imgsz) for path in image_paths]
+
+    # Warm up so one-off session and graph initialisation is not counted
+    for image in images[:3]:
+        model([image], imgsz=imgsz, verbose=False)
+
+    # Latency: one image per call, decoding excluded
+    latencies = []
+    categories = {}
+    for img_path, image in zip(image_paths, images):
+        start = time.perf_counter()
+        result = model([image], imgsz=imgsz, verbose=False)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        detected_classes, _ = yolo_detect.extract_detections(result, model.names)
+        categories[img_path] = yolo_detect.classify_image(set(detected_classes))
+
+    # Throughput: the production path, batched and with prefetched decoding
+    start = time.perf_counter()
+    yolo_detect.detect_images(model, image_paths, batch_size, imgsz=imgsz)
+    throughput = len(image_paths) / (time.perf_counter() - start)
+
+    return sorted(latencies), throughput, categories
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=200, help="Number of images in the fixed set")
+    parser.add_argument('--configs', default='torch:640,torch:320,onnx:640,onnx:320',
+                        help="Comma-separated backend:imgsz pairs")
+    parser.add_argument('--batch-size', type=int, default=yolo_detect.BATCH_SIZE)
+    args = parser.parse_args()
+
+    # A stable, sorted prefix so every run and every backend sees the same images
+    image_paths = yolo_detect.find_images()[:args.images]
+    if not image_paths:
+        print(f"No images found in {yolo_detect.IMAGE_DIR}.")
+        return
+
+    configs = [(backend, int(imgsz)) for backend, imgsz in
+               (config.split(':') for config in args.configs.split(','))]
+    if BASELINE not in configs:
+        configs.insert(0, BASELINE)
+
+    results = {config: run_config(*config, image_paths, args.batch_size) for config in configs}
+    baseline_categories = results[BASELINE][2]
+
+    print(f"{len(image_paths)} images, batch size {args.batch_size} for throughput")
+    print(f"{'backend':>12} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'images/s':>9} {'agreement':>10}")
+    for (backend, imgsz), (latencies, throughput, categories) in results.items():
+        agree = sum(categories[path] == baseline_categories[path] for path in image_paths)
+        print(f"{f'{backend}:{imgsz}':>12} {percentile(latencies, 50):8.1f} {percentile(latencies, 90):8.1f} "
+              f"{percentile(latencies, 99):8.1f} {throughput:9.1f} {agree / len(image_paths):9.1%}")
+
+    # Where the categories move, so a faster backend's errors can be judged
+    for (backend, imgsz), (_, _, categories) in results.items():
+        changes = Counter((baseline_categories[path], categories[path]) for path in image_paths
+                          if categories[path] != baseline_categories[path])
+        if changes:
+            summary = ', '.join(f"{old}->{new}: {count}" for (old, new), count in changes.most_common())
+            print(f"{backend}:{imgsz} category changes vs baseline: {summary}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Measures YOLO throughput for several batch sizes on the downloaded images.
+
+Run from the repository root: python benchmarks/yolo_batch_sizes.py [--images 256] [--batch-sizes 1,4,8,16,32]
+"""
+import os
+import sys
+import time
+import argparse
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+import yolo_detect
+from ultralytics import YOLO
+
+def time_per_image_loop(model, image_paths):
+    """The original loop: one model(path) call per image, boxes read one at a time."""
+    start = time.perf_counter()
+    for img_path in image_paths:
+        result = model(img_path, verbose=False)[0]
+        for box in result.boxes:
+            model.names[int(box.cls[0])], float(box.conf[0])
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=256, help="Number of images to time")
+    parser.add_argument('--batch-sizes', default='1,4,8,16,32')
+    parser.add_argument('--decode-workers', type=int, default=yolo_detect.DECODE_WORKERS)
+    parser.add_argument('--imgsz', type=int, default=yolo_detect.IMGSZ)
+    args = parser.parse_args()
+
+    image_paths = yolo_detect.find_images()[:args.images]
+    if not image_paths:
+        print(f"No images found in {yolo_detect.IMAGE_DIR}.")
+        return
+
+    model = YOLO('yolov8n.pt')
+    # Warm up so one-off model initialisation is not counted
+    yolo_detect.detect_images(model, image_paths[:4], batch_size=4, imgsz=args.imgsz)
+
+    print(f"{len(image_paths)} images, {args.decode_workers} decode workers, imgsz={args.imgsz}")
+    elapsed = time_per_image_loop(model, image_paths)
+    print(f"{'per-image loop':>16}: {len(image_paths) / elapsed:8.1f} images/s")
+
+    for batch_size in (int(size) for size in args.batch_sizes.split(',')):
+        start = time.perf_counter()
+        yolo_detect.detect_images(model, image_paths, batch_size, args.decode_workers, args.imgsz)
+        elapsed = time.perf_counter() - start
+        print(f"{f'batch {batch_size}':>16}: {len(image_paths) / elapsed:8.1f} images/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+{% macro bump_warehouse_version() %}
+    {#- Stamps a new data version once the marts are built and tested; the API keys its response cache on it -#}
+    {% set sql %}
+        create table if not exists {{ target.schema }}.warehouse_version (
+            id integer primary key default 1 check (id = 1),
+            version bigint not null,
+            updated_at timestamptz not null default now()
+        );
+        insert into {{ target.schema }}.warehouse_version (id, version)
+        values (1, 1)
+        on conflict (id) do update
+        set version = warehouse_version.version + 1,
+            updated_at = now();
+        commit;
+    {% endset %}
+    {% do run_query(sql) %}
+    {{ log("Bumped warehouse_version", info=True) }}
+{% endmacro %}
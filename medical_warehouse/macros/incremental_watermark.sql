@@ -0,0 +1,7 @@
+{% macro incremental_watermark(column) %}
+    {#- Newest value of column already in this model, less the incremental_lookback var. Loader and
+        detector rows are stamped with their transaction's now() but only become visible at commit,
+        so a long transaction can commit rows older than what the last run saw; the merge on
+        unique_key makes the re-read rows harmless. -#}
+    (select coalesce(max({{ column }}), '-infinity') - interval '{{ var("incremental_lookback") }}' from {{ this }})
+{%- endmacro %}
@@ -0,0 +1,57 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key=['channel_key', 'date_key'],
+        indexes=[
+            {'columns': ['channel_name', 'full_date']}
+        ]
+    )
+}}
+
+with messages as (
+    select * from {{ ref('fct_messages') }}
+),
+
+channels as (
+    select * from {{ ref('dim_channels') }}
+),
+
+{% if is_incremental() %}
+-- Days with new or changed messages are recomputed in full
+affected_days as (
+    select distinct channel_key, date_key
+    from messages
+    where loaded_at > {{ incremental_watermark('loaded_at') }}
+),
+{% endif %}
+
+daily as (
+    select
+        m.channel_key,
+        m.date_key,
+        count(*) as post_count,
+        sum(m.view_count) as total_views,
+        sum(m.forward_count) as total_forwards,
+        max(m.loaded_at) as loaded_at
+    from messages m
+    {% if is_incremental() %}
+    where (m.channel_key, m.date_key) in (select channel_key, date_key from affected_days)
+    {% endif %}
+    group by m.channel_key, m.date_key
+),
+
+final as (
+    select
+        d.channel_key,
+        c.channel_name,
+        d.date_key,
+        to_date(cast(d.date_key as text), 'YYYYMMDD') as full_date,
+        d.post_count,
+        d.total_views,
+        d.total_forwards,
+        d.loaded_at
+    from daily d
+    left join channels c on d.channel_key = c.channel_key
+)
+
+select * from final
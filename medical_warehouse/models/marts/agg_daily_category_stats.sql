@@ -0,0 +1,48 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='date_key',
+        indexes=[
+            {'columns': ['image_category']}
+        ]
+    )
+}}
+
+with detections as (
+    select * from {{ ref('fct_image_detections') }}
+),
+
+messages as (
+    select * from {{ ref('fct_messages') }}
+),
+
+{% if is_incremental() %}
+-- A day is recomputed when one of its images is re-detected or its message's views change.
+-- Replacing whole days (delete+insert on date_key) also drops categories a day no longer has.
+affected_days as (
+    select date_key from detections
+    where detected_at > {{ incremental_watermark('detected_at') }}
+    union
+    select date_key from messages
+    where has_media
+      and loaded_at > {{ incremental_watermark('loaded_at') }}
+),
+{% endif %}
+
+final as (
+    select
+        d.date_key,
+        d.image_category,
+        count(*) as image_count,
+        sum(m.view_count) as total_views,
+        max(d.detected_at) as detected_at,
+        max(m.loaded_at) as loaded_at
+    from detections d
+    inner join messages m on d.channel_key = m.channel_key and d.message_id = m.message_id
+    {% if is_incremental() %}
+    where d.date_key in (select date_key from affected_days)
+    {% endif %}
+    group by d.date_key, d.image_category
+)
+
+select * from final
@@ -0,0 +1,38 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='date_key',
+        indexes=[
+            {'columns': ['object_name']}
+        ]
+    )
+}}
+
+with objects as (
+    select * from {{ ref('fct_detected_objects') }}
+),
+
+{% if is_incremental() %}
+-- Whole days are replaced so objects no longer detected on a day disappear with it
+affected_days as (
+    select distinct date_key
+    from objects
+    where detected_at > {{ incremental_watermark('detected_at') }}
+),
+{% endif %}
+
+final as (
+    select
+        date_key,
+        object_name,
+        count(*) as object_count,
+        count(distinct image_path) as image_count,
+        max(detected_at) as detected_at
+    from objects
+    {% if is_incremental() %}
+    where date_key in (select date_key from affected_days)
+    {% endif %}
+    group by date_key, object_name
+)
+
+select * from final
@@ -1,3 +1,10 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='date_key'
+    )
+}}
+
 with date_spine as (
     -- Generate dates for the last 5 years up to 1 year in the future
     select
@@ -18,6 +25,10 @@ date_dims as (
         extract(year from full_date) as year,
         case when extract(dow from full_date) in (0, 6) then true else false end as is_weekend
     from date_spine
+    {% if is_incremental() %}
+    -- Existing dates never change; only add the days the window has rolled forward to
+    where full_date > (select max(full_date) from {{ this }})
+    {% endif %}
 )
 
 select * from date_dims
@@ -0,0 +1,35 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='image_path',
+        indexes=[
+            {'columns': ['object_name']},
+            {'columns': ['image_path']}
+        ]
+    )
+}}
+
+with detections as (
+    select * from {{ ref('fct_image_detections') }}
+    {% if is_incremental() %}
+    -- Re-detected images replace all of their object rows (delete+insert on image_path)
+    where detected_at > {{ incremental_watermark('detected_at') }}
+    {% endif %}
+),
+
+-- One row per detected object instance; an image with two bottles yields two rows
+final as (
+    select
+        d.message_id,
+        d.channel_key,
+        d.date_key,
+        d.image_path,
+        d.image_category,
+        o.object_name,
+        o.object_position,
+        d.detected_at
+    from detections d
+    cross join lateral unnest(d.detected_objects) with ordinality as o(object_name, object_position)
+)
+
+select * from final
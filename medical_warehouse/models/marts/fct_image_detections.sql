@@ -1,5 +1,26 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='image_path',
+        indexes=[
+            {'columns': ['image_path'], 'unique': True},
+            {'columns': ['channel_key', 'message_id']},
+            {'columns': ['date_key']},
+            {'columns': ['detected_at']},
+            {'columns': ['detected_objects'], 'type': 'gin'}
+        ]
+    )
+}}
+
 with detections as (
     select * from {{ ref('stg_image_detections') }}
+    {% if is_incremental() %}
+    where detected_at > {{ incremental_watermark('detected_at') }}
+    {% endif %}
+),
+
+channels as (
+    select * from {{ ref('dim_channels') }}
 ),
 
 messages as (
@@ -11,11 +32,14 @@ final as (
         d.message_id,
         m.channel_key,
         m.date_key,
+        d.image_path,
         d.image_category,
         d.detected_objects,
-        d.confidence_score
+        d.confidence_score,
+        d.detected_at
     from detections d
-    inner join messages m on d.message_id = m.message_id
+    inner join channels c on d.channel_name = c.channel_name
+    inner join messages m on d.message_id = m.message_id and c.channel_key = m.channel_key
 )
 
 select * from final
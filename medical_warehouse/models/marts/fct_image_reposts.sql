@@ -0,0 +1,30 @@
+with groups as (
+    select * from {{ ref('stg_image_duplicate_groups') }}
+),
+
+channels as (
+    select * from {{ ref('dim_channels') }}
+),
+
+messages as (
+    select * from {{ ref('fct_messages') }}
+),
+
+final as (
+    select
+        g.group_id,
+        g.group_size,
+        -- Groups spanning several channels are cross-channel reposts
+        count(distinct g.channel_name) over (partition by g.group_id) as channel_count,
+        g.message_id,
+        c.channel_key,
+        m.date_key,
+        g.image_path,
+        g.hamming_distance,
+        g.is_representative
+    from groups g
+    left join channels c on g.channel_name = c.channel_name
+    left join messages m on g.message_id = m.message_id and c.channel_key = m.channel_key
+)
+
+select * from final
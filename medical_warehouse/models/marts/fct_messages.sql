@@ -1,5 +1,29 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key=['channel_key', 'message_id'],
+        indexes=[
+            {'columns': ['channel_key', 'message_id'], 'unique': True},
+            {'columns': ['date_key']},
+            {'columns': ['message_id']},
+            {'columns': ['loaded_at']},
+            {'columns': ['search_vector'], 'type': 'gin'},
+            {'columns': ['message_text gin_trgm_ops'], 'type': 'gin'},
+            {'columns': ['message_date', 'message_id']},
+            {'columns': ['channel_key', 'message_date']}
+        ]
+    )
+}}
+
 with messages as (
-    select * from {{ ref('stg_telegram_messages') }}
+    -- The full-reload loader modes can hold a message once per dated folder; keep the latest
+    select distinct on (channel_name, message_id) *
+    from {{ ref('stg_telegram_messages') }}
+    {% if is_incremental() %}
+    -- Only rows the loader inserted or changed since the last run
+    where loaded_at > {{ incremental_watermark('loaded_at') }}
+    {% endif %}
+    order by channel_name, message_id, loaded_at desc
 ),
 
 dates as (
@@ -15,11 +39,15 @@ final as (
         m.message_id,
         c.channel_key,
         coalesce(d.date_key, cast(to_char(m.message_date, 'YYYYMMDD') as integer)) as date_key,
+        m.message_date,
         m.message_text,
         length(m.message_text) as message_length,
+        -- 'simple' config: no stemming or stop words, which suit Amharic and mixed-language posts
+        to_tsvector('simple', coalesce(m.message_text, '')) as search_vector,
         m.views as view_count,
         m.forwards as forward_count,
-        m.has_media
+        m.has_media,
+        m.loaded_at
     from messages m
     left join channels c on m.channel_name = c.channel_name
     left join dates d on date(m.message_date) = d.full_date
@@ -0,0 +1,40 @@
+{{
+    config(
+        indexes=[
+            {'columns': ['product_name']},
+            {'columns': ['channel_key', 'message_id']},
+            {'columns': ['date_key']}
+        ]
+    )
+}}
+
+-- Rebuilt in full: re-matched messages can lose mentions, which an incremental
+-- merge keyed on the new rows would never delete
+with mentions as (
+    select * from {{ ref('stg_product_mentions') }}
+),
+
+channels as (
+    select * from {{ ref('dim_channels') }}
+),
+
+messages as (
+    select * from {{ ref('fct_messages') }}
+),
+
+final as (
+    select
+        m.message_id,
+        m.channel_key,
+        m.date_key,
+        p.product_name,
+        p.product_type,
+        p.mention_count,
+        m.view_count,
+        p.extracted_at
+    from mentions p
+    inner join channels c on p.channel_name = c.channel_name
+    inner join messages m on p.message_id = m.message_id and c.channel_key = m.channel_key
+)
+
+select * from final
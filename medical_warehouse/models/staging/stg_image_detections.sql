@@ -5,14 +5,14 @@ with source as (
 renamed as (
     select
         message_id,
+        -- Images are stored as data/raw/images/<channel_name>/<message_id>.jpg
+        substring(image_path from '([^/]+)/[^/]+$') as channel_name,
         image_path,
-        -- Parse the stringified list back if needed, or keep as text
-        -- For simplicity in this raw->stg pass, we keep it as is, 
-        -- or could cast to array if using Postgres native arrays.
-        -- Assuming it stored as a string representation of list like "['bottle', 'person']"
-        detected_objects, 
+        -- Native text[] of detected class names, e.g. {bottle,person}
+        detected_objects,
         cast(confidence_score as numeric) as confidence_score,
-        image_category
+        image_category,
+        detected_at
     from source
 )
 
@@ -0,0 +1,18 @@
+with source as (
+    select * from {{ source('medical', 'image_duplicate_groups') }}
+),
+
+renamed as (
+    select
+        group_id,
+        group_size,
+        message_id,
+        channel_name,
+        image_path,
+        content_hash,
+        hamming_distance,
+        is_representative
+    from source
+)
+
+select * from renamed
@@ -0,0 +1,16 @@
+with source as (
+    select * from {{ source('medical', 'product_mentions') }}
+),
+
+renamed as (
+    select
+        channel_name,
+        message_id,
+        product_name,
+        product_type,
+        mention_count,
+        extracted_at
+    from source
+)
+
+select * from renamed
@@ -11,7 +11,8 @@ renamed as (
         coalesce(views, 0) as views,
         coalesce(forwards, 0) as forwards,
         has_media,
-        image_path
+        image_path,
+        loaded_at
     from source
     -- Basic data cleaning: remove rows without a message id
     where message_id is not null
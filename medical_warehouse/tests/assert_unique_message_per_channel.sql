@@ -0,0 +1,5 @@
+-- Message ids are only unique within a channel; fct_messages is keyed on both
+select channel_key, message_id
+from {{ ref('fct_messages') }}
+group by channel_key, message_id
+having count(*) > 1
@@ -0,0 +1,131 @@
+import time
+import asyncio
+import random
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from telethon.errors import FloodWaitError
+
+# Placeholder bytes written for every downloaded photo
+FAKE_IMAGE_BYTES = b'\xff\xd8\xff\xe0fake-telegram-photo\xff\xd9'
+
+class FakePhoto:
+    """Stands in for telethon's MessageMediaPhoto."""
+
+class FakeMessage:
+    """The subset of telethon's Message that the scraper reads."""
+
+    def __init__(self, message_id, date, text, views, forwards, has_photo):
+        self.id = message_id
+        self.date = date
+        self.text = text
+        self.views = views
+        self.forwards = forwards
+        self.media = FakePhoto() if has_photo else None
+        self.photo = self.media
+
+class FakeTelegramClient:
+    """
+    Offline stand-in for telethon.TelegramClient.
+
+    Serves a deterministic history per channel and sleeps to simulate network
+    latency: request_latency per API call (and per page of page_size messages
+    while iterating), download_latency per photo. Pass it to the scraper
+    functions in place of a real client to measure scheduling changes without
+    a Telegram session.
+
+    To exercise rate limiting, flood_limit caps the calls per second of each
+    method (get_entity, history, download): a call over the cap in the last
+    second raises telethon's FloodWaitError asking for flood_wait_seconds.
+    error_rate is the chance of a call failing with ConnectionError.
+    """
+
+    def __init__(self, messages_per_channel=100, photo_ratio=0.5, request_latency=0.05,
+                 download_latency=0.2, page_size=100, seed=0, flood_limit=None, flood_wait_seconds=2,
+                 error_rate=0.0):
+        self.messages_per_channel = messages_per_channel
+        self.photo_ratio = photo_ratio
+        self.request_latency = request_latency
+        self.download_latency = download_latency
+        self.page_size = page_size
+        self.seed = seed
+        self.flood_limit = flood_limit
+        self.flood_wait_seconds = flood_wait_seconds
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.download_count = 0
+        self.flood_wait_count = 0
+        self.error_count = 0
+        self._calls = defaultdict(deque)
+        self._errors = random.Random(f"{seed}:errors")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def _check_limits(self, method):
+        """Raises the FloodWait or transient error a call to method would get from a strict server."""
+        if self.flood_limit is not None:
+            now = time.monotonic()
+            calls = self._calls[method]
+            while calls and calls[0] <= now - 1:
+                calls.popleft()
+            if len(calls) >= self.flood_limit:
+                self.flood_wait_count += 1
+                raise FloodWaitError(request=None, capture=self.flood_wait_seconds)
+            calls.append(now)
+        if self.error_rate and self._errors.random() < self.error_rate:
+            self.error_count += 1
+            raise ConnectionError(f"Simulated connection drop during {method}")
+
+    async def _request(self, method):
+        self.request_count += 1
+        self._check_limits(method)
+        await asyncio.sleep(self.request_latency)
+
+    def _history(self, channel_name):
+        """Returns the channel's messages, newest first, as Telegram does."""
+        rng = random.Random(f"{self.seed}:{channel_name}")
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        messages = []
+        for message_id in range(1, self.messages_per_channel + 1):
+            messages.append(FakeMessage(
+                message_id=message_id,
+                date=start + timedelta(minutes=37 * message_id),
+                text=f"{channel_name} post {message_id}",
+                views=rng.randint(50, 5000),
+                forwards=rng.randint(0, 50),
+                has_photo=rng.random() < self.photo_ratio,
+            ))
+        messages.reverse()
+        return messages
+
+    async def get_entity(self, channel_name):
+        await self._request('get_entity')
+        return channel_name
+
+    async def iter_messages(self, entity, limit=None, min_id=0, max_id=0, offset_id=0, offset_date=None):
+        history = self._history(entity)
+        served = 0
+        for message in history:
+            if min_id and message.id <= min_id:
+                break
+            if (max_id and message.id >= max_id) or (offset_id and message.id >= offset_id):
+                continue
+            if offset_date and message.date >= offset_date:
+                continue
+            if limit is not None and served >= limit:
+                break
+            if served % self.page_size == 0:
+                await self._request('history')
+            served += 1
+            yield message
+
+    async def download_media(self, media, file=None):
+        self._check_limits('download')
+        self.download_count += 1
+        await asyncio.sleep(self.download_latency)
+        with open(file, 'wb') as f:
+            f.write(FAKE_IMAGE_BYTES)
+        return file
@@ -0,0 +1,245 @@
+"""
+Per-stage performance instrumentation for the pipeline.
+
+Wrap a stage in `with stage('load', unit='rows') as st:` and set or add to
+st.items. Stages opened inside another become its sub-steps. Each records
+wall time, CPU time, peak RSS, items processed and throughput. metadata()
+flattens them for Dagster and write_report() saves them as JSON. Compare two
+run reports with:
+
+    python src/instrumentation.py compare data/reports/<run_a> data/reports/<run_b>
+"""
+import os
+import sys
+import glob
+import json
+import time
+import socket
+import argparse
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPORT_DIR = 'data/reports'
+
+def _cpu_seconds():
+    """CPU time of this process and of its finished child processes (e.g. YOLO workers)."""
+    if resource is None:
+        return time.process_time()
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+def _peak_rss_mb():
+    """Peak resident set size so far of this process or its largest finished child, in MiB."""
+    if resource is None:
+        return None
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports KiB, macOS bytes
+    return peak_kb / (1024 * 1024) if sys.platform == 'darwin' else peak_kb / 1024
+
+class Stage:
+    """Measurements of one stage or sub-step."""
+
+    def __init__(self, name, unit='items', items=0):
+        self.name = name
+        self.unit = unit
+        self.items = items
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.wall_s = None
+        self.cpu_s = None
+        self.peak_rss_mb = None
+        self.children = []
+
+    def add(self, count):
+        self.items += count
+
+    @property
+    def throughput(self):
+        """Items per wall-clock second, or None for stages without items or timing."""
+        return self.items / self.wall_s if self.wall_s and self.items else None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'wall_s': self.wall_s,
+            'cpu_s': self.cpu_s,
+            'peak_rss_mb': self.peak_rss_mb,
+            'items': self.items,
+            'unit': self.unit,
+            'throughput': self.throughput,
+            'children': [child.to_dict() for child in self.children],
+        }
+
+_current = contextvars.ContextVar('instrumentation_stage', default=None)
+_roots = []
+
+@contextmanager
+def stage(name, unit='items', items=0):
+    """
+    Measures the enclosed block as a stage, nested under the enclosing stage
+    if there is one. CPU time covers the whole process while the stage runs,
+    so concurrent stages each include the others' work.
+    """
+    parent = _current.get()
+    current = Stage(name, unit, items)
+    (parent.children if parent is not None else _roots).append(current)
+    token = _current.set(current)
+    wall_start, cpu_start = time.perf_counter(), _cpu_seconds()
+    try:
+        yield current
+    finally:
+        current.wall_s = time.perf_counter() - wall_start
+        current.cpu_s = _cpu_seconds() - cpu_start
+        current.peak_rss_mb = _peak_rss_mb()
+        _current.reset(token)
+
+@contextmanager
+def unrecorded():
+    """Runs the enclosed block without recording its stages, e.g. setup a benchmark should not time."""
+    token = _current.set(Stage('unrecorded'))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def record(name, wall_s, items=0, unit='items', cpu_s=None):
+    """Adds a stage measured elsewhere (e.g. a dbt model from run_results.json) under the current stage."""
+    parent = _current.get()
+    measured = Stage(name, unit, items)
+    measured.wall_s = wall_s
+    measured.cpu_s = cpu_s
+    (parent.children if parent is not None else _roots).append(measured)
+    return measured
+
+def record_dbt_results(path):
+    """
+    Records each model, seed or test of a dbt invocation as a stage under the
+    current one, from the run_results.json at path (in the dbt project's
+    target/ directory), with its rows affected as items. Does nothing if dbt
+    wrote no results.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)['results']
+    for result in results:
+        resource_type, *_, name = result['unique_id'].split('.')
+        rows = (result.get('adapter_response') or {}).get('rows_affected') or 0
+        record(f"{resource_type}:{name}", result['execution_time'], items=rows, unit='rows')
+
+def reset():
+    """Forgets recorded stages, e.g. between runs in a long-lived process."""
+    _roots.clear()
+
+def stages():
+    return [root.to_dict() for root in _roots]
+
+def _flatten(stage_dicts, prefix='', depth=None):
+    """Returns {'parent/child': stage_dict} for every stage, down to depth levels."""
+    flat = {}
+    for stage_dict in stage_dicts:
+        path = f"{prefix}{stage_dict['name']}"
+        flat[path] = stage_dict
+        if depth is None or depth > 1:
+            flat.update(_flatten(stage_dict['children'], f"{path}/", None if depth is None else depth - 1))
+    return flat
+
+def metadata(depth=2):
+    """Flat {'<stage path>.<measure>': value} of the recorded stages, for Dagster op metadata."""
+    values = {}
+    for path, stage_dict in _flatten(stages(), depth=depth).items():
+        for measure in ('wall_s', 'cpu_s', 'peak_rss_mb', 'items', 'throughput'):
+            value = stage_dict[measure]
+            if value is not None:
+                values[f"{path}.{measure}"] = round(value, 3) if isinstance(value, float) else value
+    return values
+
+def write_report(path, run_id=None, **extra):
+    """Writes the recorded stages to a JSON run report at path and returns the path."""
+    report = {
+        'run_id': run_id,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'host': socket.gethostname(),
+        **extra,
+        'stages': stages(),
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+def load_stages(path):
+    """Returns {stage path: stage dict} from a report file or a directory of reports (one run)."""
+    files = sorted(glob.glob(os.path.join(path, '**', '*.json'), recursive=True)) if os.path.isdir(path) else [path]
+    flat = {}
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        # Several steps of one run (e.g. partitions) report the same stage names
+        label = os.path.splitext(os.path.relpath(file_path, path))[0] if os.path.isdir(path) else ''
+        flat.update(_flatten(report['stages'], f"{label}:" if label else ''))
+    return flat
+
+def compare(baseline_path, candidate_path, threshold=0.2):
+    """
+    Prints wall time, CPU time and throughput of every stage in both runs
+    and returns the stage paths that regressed by more than threshold.
+    """
+    baseline, candidate = load_stages(baseline_path), load_stages(candidate_path)
+    regressions = []
+
+    def change(old, new):
+        return (new - old) / old if old and new is not None else None
+
+    print(f"{'stage':<60} {'wall s':>16} {'cpu s':>16} {'throughput':>20}")
+    for path in [p for p in candidate if p in baseline]:
+        old, new = baseline[path], candidate[path]
+        wall_change = change(old['wall_s'], new['wall_s'])
+        rate_change = change(old['throughput'], new['throughput'])
+        regressed = (wall_change is not None and wall_change > threshold) or \
+                    (rate_change is not None and rate_change < -threshold)
+        if regressed:
+            regressions.append(path)
+
+        def cell(measure):
+            if old[measure] is None or new[measure] is None:
+                return '-'
+            pct = change(old[measure], new[measure])
+            return f"{new[measure]:.2f} ({pct:+.0%})" if pct is not None else f"{new[measure]:.2f}"
+
+        print(f"{path:<60} {cell('wall_s'):>16} {cell('cpu_s'):>16} {cell('throughput'):>20}"
+              f"{'  REGRESSION' if regressed else ''}")
+
+    for path in sorted(set(baseline) ^ set(candidate)):
+        print(f"{path:<60} only in {'baseline' if path in baseline else 'candidate'}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compare pipeline run reports.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compare_parser = subparsers.add_parser('compare', help="Compare two run reports (files or run directories)")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help="Relative slowdown that counts as a regression (default: 0.2)")
+    args = parser.parse_args()
+
+    regressions = compare(args.baseline, args.candidate, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} stages regressed by more than {args.threshold:.0%}.")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,16 @@
 import os
 import json
+import hashlib
 import glob
+import time
+import argparse
 import pandas as pd
+import pyarrow as pa
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+import instrumentation
+import message_batches
+import processed_layer
 
 # Load environment variables
 load_dotenv()
@@ -14,64 +21,469 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
+RAW_MESSAGES_DIR = "data/raw/telegram_messages"
+
+# Number of rows buffered client-side before each COPY round-trip
+COPY_CHUNK_ROWS = int(os.getenv("LOADER_CHUNK_ROWS", "50000"))
+
+# Fixed schema of raw.telegram_messages, in COPY column order
+MESSAGE_COLUMNS = [
+    ('message_id', 'BIGINT'),
+    ('channel_name', 'TEXT'),
+    ('date', 'TEXT'),
+    ('message_text', 'TEXT'),
+    ('views', 'BIGINT'),
+    ('forwards', 'BIGINT'),
+    ('has_media', 'BOOLEAN'),
+    ('image_path', 'TEXT'),
+]
+
 def get_db_connection():
     """Constructs the database URL and returns a SQLAlchemy engine."""
     if not all([DB_NAME, DB_USER, DB_PASSWORD]):
         raise ValueError("Database credentials not fully set in .env")
-    
+
     db_url = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     return create_engine(db_url)
 
-def load_data():
+def find_json_files(base_path=RAW_MESSAGES_DIR):
+    """
+    Returns all raw message files, oldest dated folder first: NDJSON (.jsonl)
+    written by the scraper and JSON arrays (.json) from older dated folders.
+    """
+    paths = []
+    for pattern in ("*.json", "*.jsonl"):
+        paths.extend(glob.glob(os.path.join(base_path, "**", pattern), recursive=True))
+    return sorted(paths)
+
+def partition_file_paths(day, channel_name, base_path=RAW_MESSAGES_DIR):
+    """Returns the paths one channel's raw file of one dated folder can have, existing or not."""
+    folder = os.path.join(base_path, str(day))
+    return [os.path.join(folder, f"{channel_name}{ext}") for ext in (".json", ".jsonl")]
+
+def find_partition_files(day, channel_name, base_path=RAW_MESSAGES_DIR):
+    """Returns the raw message files of one channel in one dated folder."""
+    return [path for path in partition_file_paths(day, channel_name, base_path) if os.path.exists(path)]
+
+def iter_file_records(file_path):
+    """
+    Yields the records of one raw file. NDJSON is parsed line by line;
+    a malformed line (e.g. the tail of a write cut short by a crash) is
+    logged and skipped. JSON array files are read whole.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if not file_path.endswith('.jsonl'):
+            data = json.load(f)
+            if isinstance(data, list):
+                yield from data
+            else:
+                yield data
+            return
+
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping malformed line {line_number} in {file_path}: {e}")
+
+def iter_records(json_files, failed=None):
+    """
+    Yields message records one file at a time, never holding more than a
+    single file in memory. Paths that cannot be read are logged, skipped and
+    added to `failed` if given.
+    """
+    for file_path in json_files:
+        try:
+            yield from iter_file_records(file_path)
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+            if failed is not None:
+                failed.add(file_path)
+
+def iter_message_batches(json_files, failed=None, columns=MESSAGE_COLUMNS,
+                         parse_workers=message_batches.PARSE_WORKERS):
+    """
+    Yields (file index, RecordBatch) for each readable file, parsed in
+    parallel by message_batches. Paths that cannot be read are logged,
+    skipped and added to `failed` if given.
+    """
+    schema = message_batches.arrow_schema(columns)
+    parsed = message_batches.iter_file_batches(json_files, schema, parse_workers)
+    for seq, (file_path, batch, error) in enumerate(parsed):
+        if error is not None:
+            print(f"Error reading {file_path}: {error}")
+            if failed is not None:
+                failed.add(file_path)
+            continue
+        yield seq, batch
+
+def file_sha256(file_path):
+    """Returns the hex SHA-256 of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_data_pandas():
     """Reads JSON files and loads them into PostgreSQL."""
     engine = get_db_connection()
-    
+
     # Create 'raw' schema
     with engine.connect() as conn:
         conn.execute(text("CREATE SCHEMA IF NOT EXISTS raw;"))
         conn.commit()
-    
+
     # Find all JSON files
-    base_path = "data/raw/telegram_messages"
-    json_files = glob.glob(os.path.join(base_path, "**", "*.json"), recursive=True)
-    
+    json_files = find_json_files()
+
     if not json_files:
         print("No JSON files found in data/raw/telegram_messages.")
         return
 
-    all_data = []
     print(f"Found {len(json_files)} JSON files.")
-    
-    for file_path in json_files:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    all_data.extend(data)
-                else:
-                    all_data.append(data)
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}")
+    all_data = list(iter_records(json_files))
 
     if not all_data:
         print("No data extracted from files.")
         return
 
     df = pd.DataFrame(all_data)
-    
+    # The incremental dbt models pick up rows by load time
+    df['loaded_at'] = pd.Timestamp.now(tz='UTC')
+
     # Load to PostgreSQL
     # Using 'replace' to overwrite the table for idempotent runs during development
     # In production, 'append' with de-duplication would be better
     table_name = 'telegram_messages'
     schema = 'raw'
-    
+
     print(f"Loading {len(df)} rows into {schema}.{table_name}...")
-    
+
     try:
         df.to_sql(table_name, engine, schema=schema, if_exists='replace', index=False)
         print("Data loaded successfully.")
     except Exception as e:
         print(f"Error loading data to Postgres: {e}")
+        return
+
+    # to_sql has committed; the processed layer follows the table
+    for seq, batch in iter_message_batches(json_files):
+        processed_layer.write_messages(batch, json_files[seq])
+
+def load_data_copy(chunk_size=COPY_CHUNK_ROWS, parse_workers=message_batches.PARSE_WORKERS):
+    """
+    Streams JSON files into PostgreSQL with COPY FROM STDIN.
+
+    Files are parsed into Arrow batches by parse_workers processes while
+    the main process copies bounded chunks of them into a staging table,
+    which then replaces raw.telegram_messages in a single transaction.
+    Readers see either the old or the new table, never a partial load, and
+    client memory stays flat regardless of how many files there are. Each
+    file's messages are also written to the 'messages' Parquet dataset of
+    the processed layer, published once the swap commits.
+    """
+    json_files = find_json_files()
+
+    if not json_files:
+        print("No JSON files found in data/raw/telegram_messages.")
+        return
+
+    print(f"Found {len(json_files)} JSON files.")
+
+    engine = get_db_connection()
+    column_defs = ', '.join(f"{col} {col_type}" for col, col_type in MESSAGE_COLUMNS)
+
+    conn = engine.raw_connection()
+    layer_files = []
+    try:
+        cursor = conn.cursor()
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+        cursor.execute("DROP TABLE IF EXISTS raw.telegram_messages_staging;")
+        cursor.execute(
+            f"CREATE TABLE raw.telegram_messages_staging ({column_defs}, "
+            "loaded_at TIMESTAMPTZ NOT NULL DEFAULT now());"
+        )
+
+        start = time.perf_counter()
+        total_rows = 0
+        def batches():
+            for seq, batch in iter_message_batches(json_files, parse_workers=parse_workers):
+                processed_layer.write_messages(batch, json_files[seq], pending=layer_files)
+                yield batch
+
+        with instrumentation.stage('copy', unit='rows') as copied:
+            for table in message_batches.iter_tables(batches(), chunk_size):
+                message_batches.copy_table(cursor, 'raw.telegram_messages_staging', table)
+                total_rows += table.num_rows
+                print(f"Copied {total_rows} rows...")
+            copied.items = total_rows
+
+        if total_rows == 0:
+            conn.rollback()
+            processed_layer.discard(layer_files)
+            print("No data extracted from files.")
+            return
+
+        # Atomic swap. CASCADE drops the dbt staging views built on the old
+        # table; the next `dbt run` recreates them.
+        with instrumentation.stage('swap'):
+            cursor.execute("DROP TABLE IF EXISTS raw.telegram_messages CASCADE;")
+            cursor.execute("ALTER TABLE raw.telegram_messages_staging RENAME TO telegram_messages;")
+            conn.commit()
+        processed_layer.publish(layer_files)
+
+        elapsed = time.perf_counter() - start
+        rate = total_rows / elapsed if elapsed > 0 else float('inf')
+        print(f"Loaded {total_rows} rows into raw.telegram_messages in {elapsed:.2f}s ({rate:,.0f} rows/s).")
+    except Exception as e:
+        conn.rollback()
+        processed_layer.discard(layer_files)
+        print(f"Error loading data to Postgres: {e}")
+        raise
+    finally:
+        conn.close()
+
+def _ensure_incremental_tables(cursor):
+    """Creates the manifest and message tables, migrating a fully rebuilt table if needed."""
+    column_defs = ', '.join(f"{col} {col_type}" for col, col_type in MESSAGE_COLUMNS)
+
+    # Partitioned pipeline runs load concurrently; serialise the DDL until the caller commits
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('raw.telegram_messages'));")
+    cursor.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS raw.loaded_files (
+            file_path TEXT PRIMARY KEY,
+            file_size BIGINT NOT NULL,
+            file_mtime DOUBLE PRECISION NOT NULL,
+            content_hash TEXT NOT NULL,
+            row_count BIGINT NOT NULL,
+            loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS raw.telegram_messages ({column_defs}, "
+        "loaded_at TIMESTAMPTZ NOT NULL DEFAULT now());"
+    )
+    cursor.execute(
+        "ALTER TABLE raw.telegram_messages "
+        "ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMPTZ NOT NULL DEFAULT now();"
+    )
+
+    cursor.execute("""
+        SELECT 1 FROM pg_indexes
+        WHERE schemaname = 'raw' AND indexname = 'telegram_messages_natural_key';
+    """)
+    if cursor.fetchone() is None:
+        # Tables built by the full-reload modes hold one copy of a message per
+        # dated folder it appeared in; keep one before enforcing the key.
+        cursor.execute("""
+            DELETE FROM raw.telegram_messages a
+            USING raw.telegram_messages b
+            WHERE a.channel_name = b.channel_name
+              AND a.message_id = b.message_id
+              AND a.ctid < b.ctid;
+        """)
+        cursor.execute(
+            "CREATE UNIQUE INDEX telegram_messages_natural_key "
+            "ON raw.telegram_messages (channel_name, message_id);"
+        )
+        # text_enrich's keyset index on the same columns, now redundant
+        cursor.execute("DROP INDEX IF EXISTS raw.telegram_messages_channel_message;")
+
+def find_changed_files(cursor, json_files):
+    """
+    Compares files on disk with the raw.loaded_files manifest.
+
+    Files whose size and mtime match the manifest are skipped without being
+    read. Otherwise the content hash decides: a touched but identical file only
+    has its manifest entry refreshed. Returns (path, size, mtime, hash) tuples
+    for new or changed files.
+    """
+    cursor.execute("SELECT file_path, file_size, file_mtime, content_hash FROM raw.loaded_files;")
+    manifest = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    changed = []
+    for file_path in json_files:
+        stat = os.stat(file_path)
+        known = manifest.get(file_path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            continue
+
+        content_hash = file_sha256(file_path)
+        if known and known[2] == content_hash:
+            cursor.execute(
+                "UPDATE raw.loaded_files SET file_size = %s, file_mtime = %s WHERE file_path = %s;",
+                (stat.st_size, stat.st_mtime, file_path),
+            )
+            continue
+
+        changed.append((file_path, stat.st_size, stat.st_mtime, content_hash))
+    return changed
+
+def load_data_incremental(chunk_size=COPY_CHUNK_ROWS, json_files=None, parse_workers=message_batches.PARSE_WORKERS):
+    """
+    Loads only new or changed JSON files and merges them into raw.telegram_messages.
+
+    Rows are upserted on (channel_name, message_id), so re-scraped messages
+    update views and forwards in place instead of being duplicated. The merge
+    and the manifest update commit together, which makes re-runs idempotent.
+    The parsed files are also written to the 'messages' Parquet dataset of
+    the processed layer (see processed_layer) and published once the merge
+    commits, replacing what an earlier version of the same file wrote there.
+    json_files limits the load to those files (default: every raw file).
+    Returns {'files': ..., 'changed_files': ..., 'rows_read': ..., 'rows_merged': ...}.
+    """
+    json_files = find_json_files() if json_files is None else json_files
+    summary = {'files': len(json_files), 'changed_files': 0, 'rows_read': 0, 'rows_merged': 0}
+
+    if not json_files:
+        print("No JSON files found in data/raw/telegram_messages.")
+        return summary
+
+    engine = get_db_connection()
+    columns = [col for col, _ in MESSAGE_COLUMNS]
+    column_list = ', '.join(columns)
+    updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in columns[2:])
+    changed_check = ', '.join(f"t.{col}" for col in columns[2:])
+    excluded_check = ', '.join(f"EXCLUDED.{col}" for col in columns[2:])
+    incoming_columns = MESSAGE_COLUMNS + [('file_seq', 'INTEGER')]
+
+    conn = engine.raw_connection()
+    layer_files = []
+    try:
+        cursor = conn.cursor()
+        _ensure_incremental_tables(cursor)
+        conn.commit()
+
+        with instrumentation.stage('find_changed_files', unit='files', items=len(json_files)):
+            changed = find_changed_files(cursor, json_files)
+        print(f"Found {len(json_files)} JSON files, {len(changed)} new or changed.")
+        if not changed:
+            conn.commit()
+            return summary
+
+        column_defs = ', '.join(f"{col} {col_type}" for col, col_type in incoming_columns)
+        cursor.execute(f"CREATE TEMP TABLE incoming_messages ({column_defs}) ON COMMIT DROP;")
+
+        start = time.perf_counter()
+        row_counts = [0] * len(changed)
+        failed = set()
+
+        def incoming_batches():
+            changed_paths = [file_path for file_path, _, _, _ in changed]
+            for seq, batch in iter_message_batches(changed_paths, failed, parse_workers=parse_workers):
+                row_counts[seq] = batch.num_rows
+                processed_layer.write_messages(batch, changed_paths[seq], pending=layer_files)
+                yield batch.append_column('file_seq', pa.array([seq] * batch.num_rows, pa.int32()))
+
+        total_rows = 0
+        with instrumentation.stage('copy', unit='rows') as copied:
+            for table in message_batches.iter_tables(incoming_batches(), chunk_size):
+                message_batches.copy_table(cursor, 'incoming_messages', table)
+                total_rows += table.num_rows
+            copied.items = total_rows
+
+        # A message can appear in several new files (e.g. two dated folders);
+        # the most recent file wins. Unchanged rows keep their loaded_at.
+        with instrumentation.stage('merge', unit='rows') as merged:
+            cursor.execute(f"""
+                INSERT INTO raw.telegram_messages AS t ({column_list})
+                SELECT DISTINCT ON (channel_name, message_id) {column_list}
+                FROM incoming_messages
+                WHERE message_id IS NOT NULL AND channel_name IS NOT NULL
+                ORDER BY channel_name, message_id, file_seq DESC
+                ON CONFLICT (channel_name, message_id) DO UPDATE
+                SET {updates}, loaded_at = now()
+                WHERE ({changed_check}) IS DISTINCT FROM ({excluded_check});
+            """)
+            merged_rows = merged.items = cursor.rowcount
+
+        # Unreadable files stay out of the manifest so the next run retries them
+        for (file_path, size, mtime, content_hash), row_count in zip(changed, row_counts):
+            if file_path in failed:
+                continue
+            cursor.execute("""
+                INSERT INTO raw.loaded_files (file_path, file_size, file_mtime, content_hash, row_count)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (file_path) DO UPDATE
+                SET file_size = EXCLUDED.file_size,
+                    file_mtime = EXCLUDED.file_mtime,
+                    content_hash = EXCLUDED.content_hash,
+                    row_count = EXCLUDED.row_count,
+                    loaded_at = now();
+            """, (file_path, size, mtime, content_hash, row_count))
+        conn.commit()
+        processed_layer.publish(layer_files)
+
+        elapsed = time.perf_counter() - start
+        rate = total_rows / elapsed if elapsed > 0 else float('inf')
+        print(f"Read {total_rows} rows from {len(changed)} files, inserted or updated {merged_rows} "
+              f"in {elapsed:.2f}s ({rate:,.0f} rows/s).")
+        summary.update(changed_files=len(changed), rows_read=total_rows, rows_merged=merged_rows)
+        return summary
+    except Exception as e:
+        conn.rollback()
+        processed_layer.discard(layer_files)
+        print(f"Error loading data to Postgres: {e}")
+        raise
+    finally:
+        conn.close()
+
+def remove_partition(day, channel_name, base_path=RAW_MESSAGES_DIR):
+    """
+    Deletes what earlier loads kept of a channel's day whose raw file is
+    gone, as after a re-scrape that found no messages: the messages posted
+    on that day (UTC) in raw.telegram_messages, the file's raw.loaded_files
+    entry and its files in the processed layer. Returns the rows deleted.
+    """
+    paths = partition_file_paths(day, channel_name, base_path)
+    engine = get_db_connection()
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        _ensure_incremental_tables(cursor)
+        # Raw dates are ISO 8601 strings in UTC, so a day is a prefix
+        cursor.execute("DELETE FROM raw.telegram_messages WHERE channel_name = %s AND date LIKE %s;",
+                       (channel_name, f"{day}%"))
+        deleted = cursor.rowcount
+        cursor.execute("DELETE FROM raw.loaded_files WHERE file_path = ANY(%s);", (paths,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error removing {channel_name} {day} from Postgres: {e}")
+        raise
+    finally:
+        conn.close()
+
+    for file_path in paths:
+        processed_layer.remove_messages(file_path, channel_name)
+    print(f"Removed {deleted} rows of {channel_name} posted on {day}: its raw file is gone.")
+    return deleted
+
+LOAD_MODES = {
+    'pandas': load_data_pandas,
+    'copy': load_data_copy,
+    'incremental': load_data_incremental,
+}
+
+def load_data(mode='copy'):
+    """Loads raw JSON files into PostgreSQL using the given mode, recorded as the 'load' stage."""
+    with instrumentation.stage('load', unit='rows') as loaded:
+        result = LOAD_MODES[mode]()
+        loaded.items = sum(child.items for child in loaded.children if child.name == 'copy')
+    return result
 
 if __name__ == "__main__":
-    load_data()
+    parser = argparse.ArgumentParser(description="Load raw Telegram JSON files into PostgreSQL.")
+    parser.add_argument('--mode', choices=sorted(LOAD_MODES), default='copy',
+                        help="'copy' streams chunks through COPY FROM STDIN and swaps the table (default); "
+                             "'incremental' loads only new or changed files and upserts them; "
+                             "'pandas' is the legacy in-memory DataFrame load.")
+    parser.add_argument('--report', help="Write a JSON report of stage timings to this path.")
+    args = parser.parse_args()
+    load_data(args.mode)
+    if args.report:
+        instrumentation.write_report(args.report, script='loader', mode=args.mode)
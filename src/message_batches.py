@@ -0,0 +1,154 @@
+"""
+Parallel parsing of raw message files into Arrow record batches.
+
+Each file is parsed with orjson in a worker process and comes back as one
+RecordBatch with the caller's schema (see arrow_schema), so the loader never
+builds per-record Python dicts and the parsing spreads over all cores.
+Batches go to Postgres as CSV written by pyarrow (see copy_table).
+"""
+import os
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import orjson
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# Processes parsing files at once; 0 parses in the calling process
+PARSE_WORKERS = int(os.getenv("LOADER_PARSE_WORKERS", str(os.cpu_count() or 4)))
+# Parsed files held ahead of the database writer, per worker
+PREFETCH_FILES = 2
+
+ARROW_TYPES = {
+    'BIGINT': pa.int64(),
+    'INTEGER': pa.int32(),
+    'TEXT': pa.string(),
+    'BOOLEAN': pa.bool_(),
+}
+
+def arrow_schema(columns):
+    """Arrow schema for (name, Postgres type) columns."""
+    return pa.schema([(col, ARROW_TYPES[col_type]) for col, col_type in columns])
+
+def _int_or_none(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _str_or_none(value):
+    return value if value is None or isinstance(value, str) else str(value)
+
+TRUE_STRINGS = {'true', 't', 'yes', 'y', '1'}
+FALSE_STRINGS = {'false', 'f', 'no', 'n', '0', ''}
+
+def _bool_or_none(value):
+    # bool("false") is True, so strings are read by their spelling
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in TRUE_STRINGS:
+            return True
+        if text in FALSE_STRINGS:
+            return False
+    return None
+
+COERCE = {pa.int64(): _int_or_none, pa.int32(): _int_or_none, pa.string(): _str_or_none, pa.bool_(): _bool_or_none}
+
+def _column(values, arrow_type):
+    """Builds a typed column, coercing values one by one only if the fast conversion rejects them."""
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+        coerce = COERCE[arrow_type]
+        return pa.array([coerce(value) for value in values], type=arrow_type)
+
+def read_records(file_path):
+    """
+    Returns the records of one raw file parsed with orjson. NDJSON is parsed
+    line by line and malformed lines (e.g. the tail of a write cut short by a
+    crash) are logged and skipped; JSON array files are parsed whole.
+    """
+    with open(file_path, 'rb') as f:
+        if not file_path.endswith('.jsonl'):
+            data = orjson.loads(f.read())
+            return data if isinstance(data, list) else [data]
+
+        records = []
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                records.append(orjson.loads(line))
+            except orjson.JSONDecodeError as e:
+                print(f"Skipping malformed line {line_number} in {file_path}: {e}")
+        return records
+
+def parse_file(file_path, schema):
+    """
+    Parses one raw file into a RecordBatch with schema. Returns
+    (file_path, batch, None), or (file_path, None, error message) if the file
+    cannot be read or holds anything but JSON objects.
+    """
+    try:
+        records = read_records(file_path)
+    except (OSError, orjson.JSONDecodeError) as e:
+        return file_path, None, str(e)
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            return file_path, None, f"record {index} is a JSON {type(record).__name__}, not an object"
+    columns = [_column([record.get(field.name) for record in records], field.type) for field in schema]
+    return file_path, pa.RecordBatch.from_arrays(columns, schema=schema), None
+
+def iter_file_batches(file_paths, schema, workers=PARSE_WORKERS):
+    """
+    Yields (file_path, batch, error) for each file, in order. Files are
+    parsed by a pool of worker processes at most PREFETCH_FILES per worker
+    ahead of the consumer, so memory stays bounded however many files there
+    are. A single file, or workers=0, is parsed in this process.
+    """
+    if workers <= 0 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield parse_file(file_path, schema)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+        pending = deque()
+        paths = iter(file_paths)
+        for file_path in paths:
+            pending.append(executor.submit(parse_file, file_path, schema))
+            if len(pending) >= workers * PREFETCH_FILES:
+                break
+        while pending:
+            yield pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(executor.submit(parse_file, next_path, schema))
+
+def iter_tables(batches, chunk_rows):
+    """Groups record batches into Tables of about chunk_rows rows, one per COPY round-trip."""
+    chunk, rows = [], 0
+    for batch in batches:
+        chunk.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_rows:
+            yield pa.Table.from_batches(chunk)
+            chunk, rows = [], 0
+    if chunk:
+        yield pa.Table.from_batches(chunk)
+
+def copy_table(cursor, table_name, table):
+    """
+    Streams an Arrow table into table_name with COPY FROM STDIN. pyarrow
+    quotes every string and leaves nulls as bare empty fields, which Postgres
+    CSV reads as NULL, so empty strings and NULLs stay distinct.
+    """
+    buffer = io.BytesIO()
+    pa_csv.write_csv(table, buffer, pa_csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+
+    column_list = ', '.join(table.column_names)
+    cursor.copy_expert(f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
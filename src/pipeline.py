@@ -1,6 +1,29 @@
 import os
+import sys
+import asyncio
 import subprocess
-from dagster import job, op, ScheduleDefinition, get_dagster_logger
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from dagster import (
+    AssetKey,
+    DagsterEventType,
+    DagsterRunStatus,
+    DailyPartitionsDefinition,
+    Definitions,
+    EventRecordsFilter,
+    MaterializeResult,
+    MetadataValue,
+    MultiPartitionKey,
+    MultiPartitionsDefinition,
+    RunRequest,
+    SkipReason,
+    StaticPartitionsDefinition,
+    asset,
+    build_schedule_from_partitioned_job,
+    define_asset_job,
+    get_dagster_logger,
+    run_status_sensor,
+)
 
 logger = get_dagster_logger()
 
@@ -8,101 +31,253 @@ logger = get_dagster_logger()
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SRC_DIR = os.path.join(BASE_DIR, 'src')
 DBT_DIR = os.path.join(BASE_DIR, 'medical_warehouse')
+DBT_RUN_RESULTS = os.path.join(DBT_DIR, 'target', 'run_results.json')
 
-@op
-def scrape_telegram_data():
-    """Runs the Telethon scraper script."""
-    logger.info("Starting Telegram Scraper...")
-    try:
-        # Running as subprocess to avoid asyncio conflict with Dagster/Telethon
-        result = subprocess.run(
-            ['python3', 'src/scraper.py'], 
-            cwd=BASE_DIR, 
-            capture_output=True, 
-            text=True
-        )
-        if result.returncode != 0:
-             raise Exception(f"Scraper failed: {result.stderr}")
-        logger.info(f"Scraper output: {result.stdout}")
-    except Exception as e:
-        logger.error(f"Scraping error: {str(e)}")
-        raise
-
-@op
-def load_raw_to_postgres():
-    """Runs the data loader to Postgres."""
-    logger.info("Loading data to PostgreSQL...")
+sys.path.insert(0, SRC_DIR)
+
+from scraper import CHANNELS
+import instrumentation
+
+# First day the pipeline keeps partitions for
+PARTITION_START_DATE = os.getenv("PIPELINE_START_DATE", "2024-01-01")
+
+partitions_def = MultiPartitionsDefinition({
+    "date": DailyPartitionsDefinition(start_date=PARTITION_START_DATE),
+    "channel": StaticPartitionsDefinition(CHANNELS),
+})
+
+@contextmanager
+def at_base_dir():
+    """
+    Runs a stage from the repository root, for the duration of one asset:
+    the stages run in-process and, like their scripts, resolve data/..., the
+    model weights and the product dictionary against the working directory.
+    """
+    previous = os.getcwd()
+    os.chdir(BASE_DIR)
     try:
-        result = subprocess.run(
-            ['python3', 'src/loader.py'], 
-            cwd=BASE_DIR, 
-            capture_output=True, 
-            text=True
+        yield
+    finally:
+        os.chdir(previous)
+
+def partition_scope(context):
+    """Returns (channel_name, day) of the partition being materialized."""
+    keys = context.partition_key.keys_by_dimension
+    return keys["channel"], date.fromisoformat(keys["date"])
+
+def stage_report(context, report_dir, metadata=None):
+    """
+    Writes the stages recorded while materializing an asset to
+    <report_dir>/<asset>.json and returns a MaterializeResult carrying the
+    given metadata plus the stage measurements.
+    """
+    asset_name = context.asset_key.to_user_string()
+    path = instrumentation.write_report(
+        os.path.join(report_dir, f"{asset_name}.json"),
+        run_id=context.run_id,
+        asset=asset_name,
+        partition=context.partition_key if context.has_partition_key else None,
+    )
+    return MaterializeResult(metadata={
+        **(metadata or {}),
+        **instrumentation.metadata(),
+        "report": MetadataValue.path(path),
+    })
+
+def partition_report_dir(channel_name, day):
+    # Reports of one day sit together, so two nights compare directory to directory
+    return os.path.join(BASE_DIR, instrumentation.REPORT_DIR, str(day), channel_name)
+
+def run_report_dir():
+    return os.path.join(BASE_DIR, instrumentation.REPORT_DIR, datetime.now(timezone.utc).date().isoformat(),
+                        "warehouse")
+
+@asset(
+    partitions_def=partitions_def,
+    # One Telegram session at a time: set a limit with `dagster instance concurrency set telegram_api 1`
+    op_tags={"dagster/concurrency_key": "telegram_api"},
+    compute_kind="telethon",
+)
+def telegram_message_files(context):
+    """A channel's messages posted on one day, scraped into data/raw/telegram_messages/<day>/<channel>.jsonl."""
+    import scraper
+
+    instrumentation.reset()
+    channel_name, day = partition_scope(context)
+    with at_base_dir():
+        scraper.configure_logging()
+        count = asyncio.run(scraper.scrape_partition(channel_name, day))
+    return stage_report(context, partition_report_dir(channel_name, day), {"messages": count})
+
+@asset(partitions_def=partitions_def, deps=[telegram_message_files], compute_kind="postgres")
+def raw_telegram_messages(context):
+    """
+    The partition's raw files upserted into raw.telegram_messages. When the
+    day has no file any more, its earlier rows are removed instead.
+    """
+    import loader
+
+    instrumentation.reset()
+    channel_name, day = partition_scope(context)
+    with at_base_dir(), instrumentation.stage('load', unit='rows') as loaded:
+        json_files = loader.find_partition_files(day, channel_name)
+        if json_files:
+            summary = loader.load_data_incremental(json_files=json_files)
+            loaded.items = summary['rows_read']
+        else:
+            # A re-scrape found no messages and removed the day's file
+            summary = {"rows_deleted": loader.remove_partition(day, channel_name)}
+    return stage_report(context, partition_report_dir(channel_name, day), summary)
+
+@asset(partitions_def=partitions_def, deps=[raw_telegram_messages], compute_kind="yolo")
+def raw_image_detections(context):
+    """
+    Detections for the photos of the partition's messages, upserted into
+    raw.image_detections. The image paths come from the partition's slice of
+    the processed layer's 'messages' dataset, which the load just wrote.
+    """
+    import processed_layer
+    import yolo_detect
+
+    instrumentation.reset()
+    channel_name, day = partition_scope(context)
+    with at_base_dir():
+        messages = processed_layer.read('messages', ['image_path'], dates=[day], channels=[channel_name])
+        image_paths = sorted({
+            image_path for image_path in messages.column('image_path').to_pylist()
+            if image_path and os.path.exists(image_path)
+        })
+        if not image_paths:
+            return MaterializeResult(metadata={"images": 0})
+
+        # Every message read was posted on the partition's day, so no other day's partitions are opened
+        message_dates = {image_path: day.isoformat() for image_path in image_paths}
+        summary = yolo_detect.run_detection(image_paths, write_groups=False, message_dates=message_dates)
+    return stage_report(context, partition_report_dir(channel_name, day), summary)
+
+@asset(partitions_def=partitions_def, deps=[raw_telegram_messages], compute_kind="aho-corasick")
+def raw_product_mentions(context):
+    """
+    Product and drug mentions in the text of the partition's loaded messages,
+    stored in raw.product_mentions. Messages already matched against the
+    current dictionary are skipped.
+    """
+    import text_enrich
+
+    instrumentation.reset()
+    channel_name, day = partition_scope(context)
+    with at_base_dir():
+        summary = text_enrich.run_extraction(channel_name=channel_name, day=day)
+    return stage_report(context, partition_report_dir(channel_name, day), summary)
+
+@asset(deps=[raw_image_detections], compute_kind="postgres")
+def image_duplicate_groups(context):
+    """raw.image_duplicate_groups rebuilt across all partitions from the stored image hashes."""
+    import yolo_detect
+
+    instrumentation.reset()
+    yolo_detect.update_duplicate_groups()
+    return stage_report(context, run_report_dir())
+
+def run_dbt(*args):
+    """
+    Runs a dbt command in the dbt project as a stage, streaming its output to
+    the Dagster log. run and test also record each node's timing.
+    """
+    with instrumentation.stage(f"dbt {args[0]}", unit='nodes') as dbt_stage:
+        process = subprocess.Popen(
+            ['dbt', *args],
+            cwd=DBT_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
         )
-        if result.returncode != 0:
-             raise Exception(f"Loader failed: {result.stderr}")
-        logger.info(f"Loader output: {result.stdout}")
-    except Exception as e:
-        logger.error(f"Loading error: {str(e)}")
-        raise
-
-@op
-def run_yolo_enrichment():
-    """Runs YOLOv8 object detection."""
-    logger.info("Running YOLO Enrichment...")
-    try:
-        result = subprocess.run(
-            ['python3', 'src/yolo_detect.py'], 
-            cwd=BASE_DIR, 
-            capture_output=True, 
-            text=True
+        for line in process.stdout:
+            logger.info(line.rstrip())
+        returncode = process.wait()
+        if args[0] in ('run', 'test'):
+            instrumentation.record_dbt_results(DBT_RUN_RESULTS)
+            dbt_stage.items = len(dbt_stage.children)
+        if returncode != 0:
+            raise Exception(f"dbt {' '.join(args)} failed")
+
+@asset(deps=[raw_telegram_messages, raw_image_detections, raw_product_mentions, image_duplicate_groups],
+       compute_kind="dbt")
+def warehouse_marts(context):
+    """Runs dbt seed, dbt run and dbt test, then bumps the warehouse data version."""
+    instrumentation.reset()
+    with instrumentation.stage('dbt'):
+        # Reloads the product dictionary, in case it was edited
+        run_dbt('seed')
+        run_dbt('run')
+        run_dbt('test')
+        # Only a tested build gets a new version; the API's response cache keys on it
+        run_dbt('run-operation', 'bump_warehouse_version')
+    return stage_report(context, run_report_dir())
+
+medical_pipeline_job = define_asset_job(
+    "medical_pipeline_job",
+    selection=[telegram_message_files, raw_telegram_messages, raw_image_detections, raw_product_mentions],
+    partitions_def=partitions_def,
+)
+
+warehouse_job = define_asset_job(
+    "warehouse_job",
+    selection=[image_duplicate_groups, warehouse_marts],
+)
+
+# One run per channel for the previous day, every day at midnight
+daily_schedule = build_schedule_from_partitioned_job(medical_pipeline_job, hour_of_day=0)
+
+# Assets every channel of a day must have materialized before the warehouse is rebuilt
+PARTITION_ASSETS = ["raw_telegram_messages", "raw_image_detections", "raw_product_mentions"]
+
+def latest_materialization_id(instance, asset_names, partition_keys):
+    """Storage id of the newest materialization of any of the given partitions of the assets, or 0."""
+    latest = 0
+    for asset_name in asset_names:
+        records = instance.get_event_records(
+            EventRecordsFilter(DagsterEventType.ASSET_MATERIALIZATION, asset_key=AssetKey(asset_name),
+                               asset_partitions=partition_keys),
+            limit=1,
+            ascending=False,
         )
-        if result.returncode != 0:
-             raise Exception(f"YOLO detection failed: {result.stderr}")
-        logger.info(f"YOLO output: {result.stdout}")
-    except Exception as e:
-        logger.error(f"Enrichment error: {str(e)}")
-        raise
-
-@op
-def run_dbt_transformations():
-    """Runs dbt run and dbt test."""
-    logger.info("Running dbt transformations...")
-    
-    # dbt run
-    run_res = subprocess.run(
-        ['dbt', 'run'], 
-        cwd=DBT_DIR, 
-        capture_output=True, 
-        text=True
-    )
-    if run_res.returncode != 0:
-        logger.error(f"dbt run failed: {run_res.stderr}")
-        raise Exception("dbt run failed")
-    logger.info(f"dbt run output: {run_res.stdout}")
-
-    # dbt test
-    test_res = subprocess.run(
-        ['dbt', 'test'], 
-        cwd=DBT_DIR, 
-        capture_output=True, 
-        text=True
-    )
-    if test_res.returncode != 0:
-        logger.error(f"dbt test failed: {test_res.stderr}")
-        raise Exception("dbt test failed")
-    logger.info(f"dbt test output: {test_res.stdout}")
-
-@job
-def medical_pipeline_job():
-    """Defines the full pipeline execution order."""
-    scraped = scrape_telegram_data()
-    loaded = load_raw_to_postgres(scraped) # wait for scrape
-    enriched = run_yolo_enrichment(loaded) # wait for load
-    run_dbt_transformations(enriched) # wait for enrich
-
-# Schedule the job to run daily at midnight
-daily_schedule = ScheduleDefinition(
-    job=medical_pipeline_job,
-    cron_schedule="0 0 * * *", 
+        if records:
+            latest = max(latest, records[0].storage_id)
+    return latest
+
+@run_status_sensor(
+    run_status=DagsterRunStatus.SUCCESS,
+    monitored_jobs=[medical_pipeline_job],
+    request_job=warehouse_job,
+)
+def warehouse_after_partitions(context):
+    """
+    Rebuilds the warehouse once every channel of a day has been loaded and enriched.
+    The run key names the day's newest partition materialization: runs that
+    finish together see the same one and request a single rebuild, while
+    re-running a partition of the day materializes again and requests
+    another. Backfill runs are skipped; run warehouse_job once the backfill
+    finishes.
+    """
+    tags = context.dagster_run.tags
+    day = tags.get("dagster/partition/date")
+    if day is None or "dagster/backfill" in tags:
+        return SkipReason("Not a scheduled partition run")
+
+    done = set.intersection(*(set(context.instance.get_materialized_partitions(AssetKey(asset_name)))
+                              for asset_name in PARTITION_ASSETS))
+    partition_keys = [MultiPartitionKey({"date": day, "channel": channel}) for channel in CHANNELS]
+    waiting = [key.keys_by_dimension["channel"] for key in partition_keys if key not in done]
+    if waiting:
+        return SkipReason(f"{day}: waiting for {', '.join(waiting)}")
+    latest = latest_materialization_id(context.instance, PARTITION_ASSETS, partition_keys)
+    return RunRequest(run_key=f"warehouse-{day}-{latest}")
+
+defs = Definitions(
+    assets=[telegram_message_files, raw_telegram_messages, raw_image_detections, raw_product_mentions,
+            image_duplicate_groups, warehouse_marts],
+    jobs=[medical_pipeline_job, warehouse_job],
+    schedules=[daily_schedule],
+    sensors=[warehouse_after_partitions],
 )
@@ -0,0 +1,245 @@
+"""
+The processed layer: Parquet datasets under data/processed/<dataset>/date=YYYY-MM-DD/channel=<name>/.
+
+'messages' holds raw Telegram messages with typed columns, written by the
+loader in every mode; 'detections' holds YOLO results with detected_objects
+as a list column, written by yolo_detect and partitioned by the day their
+message was posted. Writes only add files: each one goes to a temporary name
+and is renamed into place, so readers never see half a file. Writers pass a
+`pending` list to keep the temporary names until their database transaction
+commits, then publish() them (or discard() them on rollback). A message file
+is named after the raw file it came from and replaced when that raw file
+changes; detection files are never rewritten. Rows of the same message or
+image may therefore appear more than once; read(latest=True) keeps the most
+recently written.
+
+Read only what you need:
+
+    python src/processed_layer.py show detections --date 2024-01-05 --channel tikvahpharma \\
+        --columns image_path,detected_objects
+"""
+import os
+import glob
+import uuid
+import hashlib
+import argparse
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PROCESSED_DIR = 'data/processed'
+# Partition value for rows without a date or channel
+UNKNOWN = 'unknown'
+
+SCHEMAS = {
+    'messages': pa.schema([
+        ('message_id', pa.int64()),
+        ('channel_name', pa.string()),
+        ('message_date', pa.timestamp('us', tz='UTC')),
+        ('message_text', pa.string()),
+        ('views', pa.int64()),
+        ('forwards', pa.int64()),
+        ('has_media', pa.bool_()),
+        ('image_path', pa.string()),
+        ('written_at', pa.timestamp('us', tz='UTC')),
+    ]),
+    'detections': pa.schema([
+        ('message_id', pa.int64()),
+        ('image_path', pa.string()),
+        ('detected_objects', pa.list_(pa.string())),
+        ('confidence_score', pa.float64()),
+        ('image_category', pa.string()),
+        ('content_hash', pa.string()),
+        ('model_key', pa.string()),
+        ('copied_from', pa.string()),
+        ('written_at', pa.timestamp('us', tz='UTC')),
+    ]),
+}
+# Columns identifying a row, for read(latest=True)
+KEYS = {
+    'messages': ['channel_name', 'message_id'],
+    'detections': ['image_path'],
+}
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string()), ('channel', pa.string())]), flavor='hive')
+
+def dataset_dir(dataset, base_dir=PROCESSED_DIR):
+    return os.path.join(base_dir, dataset)
+
+def _write_file(table, path, pending=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Dataset discovery skips dot files, so readers never open a file being written
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    pq.write_table(table, tmp_path, compression='zstd')
+    if pending is None:
+        os.replace(tmp_path, path)
+    else:
+        pending.append((tmp_path, path))
+
+def publish(pending):
+    """Renames the files held back in pending into place and empties it."""
+    for tmp_path, path in pending:
+        os.replace(tmp_path, path)
+    pending.clear()
+
+def discard(pending):
+    """Deletes the files held back in pending and empties it."""
+    for tmp_path, _ in pending:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+    pending.clear()
+
+def image_channel(image_path):
+    """The channel of an image, from its folder: data/raw/images/<channel>/<message_id>.jpg."""
+    return os.path.basename(os.path.dirname(image_path))
+
+def write_partitions(dataset, table, dates, channels, name, base_dir=PROCESSED_DIR, pending=None):
+    """
+    Writes table's rows to <dataset>/date=<date>/channel=<channel>/<name>.parquet,
+    one file per partition, where dates and channels give each row's partition.
+    With a pending list the files keep their temporary names and are added
+    to it; see publish(). Returns the paths written.
+    """
+    rows_by_partition = {}
+    for index, (day, channel_name) in enumerate(zip(dates, channels)):
+        rows_by_partition.setdefault((day or UNKNOWN, channel_name or UNKNOWN), []).append(index)
+
+    paths = []
+    for (day, channel_name), indices in sorted(rows_by_partition.items()):
+        path = os.path.join(dataset_dir(dataset, base_dir), f"date={day}", f"channel={channel_name}",
+                            f"{name}.parquet")
+        _write_file(table.take(indices), path, pending)
+        paths.append(path)
+    return paths
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def write_messages(batch, source_path, base_dir=PROCESSED_DIR, pending=None):
+    """
+    Writes the messages parsed from one raw file (a RecordBatch with the
+    loader's MESSAGE_COLUMNS), partitioned by the UTC day each was posted.
+    The files are named after source_path, so loading a changed raw file
+    again replaces its earlier files instead of adding more.
+    """
+    try:
+        message_dates = pc.cast(batch.column('date'), pa.timestamp('us', tz='UTC'))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        message_dates = pa.array([_parse_timestamp(value) for value in batch.column('date').to_pylist()],
+                                 pa.timestamp('us', tz='UTC'))
+    written_at = pa.array([_now()] * batch.num_rows, pa.timestamp('us', tz='UTC'))
+    table = pa.Table.from_arrays(
+        [batch.column('message_id'), batch.column('channel_name'), message_dates, batch.column('message_text'),
+         batch.column('views'), batch.column('forwards'), batch.column('has_media'), batch.column('image_path'),
+         written_at],
+        schema=SCHEMAS['messages'],
+    )
+    name = _source_name(source_path)
+    dates = pc.strftime(message_dates, format='%Y-%m-%d').to_pylist()
+    return write_partitions('messages', table, dates, batch.column('channel_name').to_pylist(), name, base_dir,
+                            pending)
+
+def _source_name(source_path):
+    return f"part-{hashlib.sha1(source_path.encode('utf-8')).hexdigest()[:16]}"
+
+def remove_messages(source_path, channel_name, base_dir=PROCESSED_DIR):
+    """Deletes the 'messages' files written for a raw file of channel_name, e.g. once the file is gone."""
+    pattern = os.path.join(dataset_dir('messages', base_dir), 'date=*', f"channel={channel_name or UNKNOWN}",
+                           f"{_source_name(source_path)}.parquet")
+    paths = glob.glob(pattern)
+    for path in paths:
+        os.remove(path)
+    return paths
+
+def _parse_timestamp(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def write_detections(records, dates, base_dir=PROCESSED_DIR, pending=None):
+    """
+    Appends detection result rows (dicts as built by yolo_detect) as new
+    files, partitioned by dates, the day each record's message was posted
+    (see message_dates), and by the channel folder of each image.
+    """
+    if not records:
+        return []
+    written_at = _now()
+    table = pa.Table.from_pylist([{**record, 'written_at': written_at} for record in records],
+                                 schema=SCHEMAS['detections'])
+    channels = [image_channel(record['image_path']) for record in records]
+    name = f"part-{written_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    return write_partitions('detections', table, dates, channels, name, base_dir, pending)
+
+def message_dates(channels, base_dir=PROCESSED_DIR):
+    """
+    Returns {(channel_name, message_id): 'YYYY-MM-DD'} for the messages of the
+    given channels, read from the 'messages' dataset's partition names.
+    """
+    table = read('messages', ['channel_name', 'message_id', 'date'], channels=channels, base_dir=base_dir)
+    return {(channel_name, message_id): day
+            for channel_name, message_id, day in zip(*(table.column(name).to_pylist() for name in table.column_names))}
+
+def read(dataset, columns=None, dates=None, channels=None, where=None, latest=False, base_dir=PROCESSED_DIR):
+    """
+    Returns a dataset's rows as an Arrow table, opening only the partitions
+    for the given dates and channels and reading only the given columns
+    (the partition columns 'date' and 'channel' can be selected too).
+    where is an extra pyarrow.dataset filter expression. latest=True keeps only
+    the most recently written row per message or image.
+    """
+    path = dataset_dir(dataset, base_dir)
+    schema = pa.unify_schemas([SCHEMAS[dataset], PARTITIONING.schema])
+    if not os.path.isdir(path):
+        return schema.empty_table().select(columns) if columns else SCHEMAS[dataset].empty_table()
+
+    dataset_obj = ds.dataset(path, schema=schema, format='parquet', partitioning=PARTITIONING)
+    expression = None
+    for field, values in (('date', dates), ('channel', channels)):
+        if values is not None:
+            condition = ds.field(field).isin([str(value) for value in values])
+            expression = condition if expression is None else expression & condition
+    if where is not None:
+        expression = where if expression is None else expression & where
+
+    if not latest:
+        return dataset_obj.to_table(columns=columns, filter=expression)
+
+    keys = KEYS[dataset]
+    needed = None if columns is None else list(dict.fromkeys([*columns, *keys, 'written_at']))
+    table = dataset_obj.to_table(columns=needed, filter=expression)
+    table = table.sort_by([(key, 'ascending') for key in keys] + [('written_at', 'descending')])
+    key_columns = [table.column(key).to_pylist() for key in keys]
+    previous = object()
+    newest = []
+    for index, key in enumerate(zip(*key_columns)):
+        if key != previous:
+            newest.append(index)
+            previous = key
+    table = table.take(newest)
+    return table.select(columns) if columns else table
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the Parquet processed layer.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help="Print rows of a dataset")
+    show_parser.add_argument('dataset', choices=sorted(SCHEMAS))
+    show_parser.add_argument('--date', action='append', help="Partition date (YYYY-MM-DD); repeatable")
+    show_parser.add_argument('--channel', action='append', help="Partition channel; repeatable")
+    show_parser.add_argument('--columns', help="Comma-separated columns to read")
+    show_parser.add_argument('--latest', action='store_true', help="Only the newest row per message or image")
+    show_parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    table = read(args.dataset, args.columns.split(',') if args.columns else None, args.date, args.channel,
+                 latest=args.latest)
+    print(f"{table.num_rows} rows")
+    print(table.slice(0, args.limit).to_pandas().to_string())
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,17 @@
 import os
 import json
+import time
+import random
 import logging
 import asyncio
-from datetime import datetime
+import argparse
+import itertools
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError, ServerError
 from dotenv import load_dotenv
+import instrumentation
 
 # Load environment variables
 load_dotenv()
@@ -13,16 +20,27 @@ API_ID = os.getenv('TG_API_ID')
 API_HASH = os.getenv('TG_API_HASH')
 SESSION_NAME = 'medical_scraper_session'
 
-# Configure logging
-os.makedirs('logs', exist_ok=True)
-logging.basicConfig(
-    filename='logs/scraper.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-logging.getLogger('').addHandler(console_handler)
+_logging_configured = False
+
+def configure_logging():
+    """
+    Logs to logs/scraper.log, relative to the working directory, and to the
+    console. Called by the entry points rather than at import, so importing
+    the module (e.g. for CHANNELS) creates no files.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    os.makedirs('logs', exist_ok=True)
+    logging.basicConfig(
+        filename='logs/scraper.log',
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    logging.getLogger('').addHandler(console_handler)
+    _logging_configured = True
 
 # List of channels to scrape
 # Note: 'CheMed123' is a placeholder, verify the actual username for "CheMed Telegram Channel"
@@ -32,67 +50,549 @@ CHANNELS = [
     'CheMed123' 
 ]
 
-async def scrape_channel(client, channel_name):
+# Number of channels scraped at the same time
+CHANNEL_CONCURRENCY = int(os.getenv('SCRAPER_CHANNEL_CONCURRENCY', '3'))
+# Number of concurrent photo downloads; 0 downloads inline while iterating
+MEDIA_WORKERS = int(os.getenv('SCRAPER_MEDIA_WORKERS', '4'))
+# Pending downloads allowed before message iteration waits for the workers
+MEDIA_QUEUE_SIZE = int(os.getenv('SCRAPER_MEDIA_QUEUE_SIZE', '200'))
+
+# Messages per history request; Telegram serves at most 100 per call
+PAGE_SIZE = int(os.getenv('SCRAPER_PAGE_SIZE', '100'))
+# Messages fetched from a channel that has no checkpoint yet (outside backfill)
+INITIAL_LIMIT = int(os.getenv('SCRAPER_INITIAL_LIMIT', '100'))
+# Records appended between fsyncs of the NDJSON output
+FSYNC_EVERY = int(os.getenv('SCRAPER_FSYNC_EVERY', '100'))
+# Per-channel high-water marks and backfill progress
+CHECKPOINT_DIR = 'data/raw/checkpoints'
+
+# Requests per second allowed for each Telegram API method, and how many may go out in a burst
+RATE_LIMITS = {
+    'get_entity': (float(os.getenv('SCRAPER_ENTITY_RATE', '0.5')), 3),
+    'history': (float(os.getenv('SCRAPER_HISTORY_RATE', '3')), 5),
+    'download': (float(os.getenv('SCRAPER_DOWNLOAD_RATE', '10')), 10),
+}
+# Attempts after a transient error, with exponential backoff from RETRY_BASE_DELAY seconds
+MAX_RETRIES = int(os.getenv('SCRAPER_MAX_RETRIES', '5'))
+RETRY_BASE_DELAY = float(os.getenv('SCRAPER_RETRY_BASE_DELAY', '1'))
+RETRY_MAX_DELAY = float(os.getenv('SCRAPER_RETRY_MAX_DELAY', '60'))
+# FloodWaits up to this many seconds are slept through in place; longer ones reschedule the channel
+FLOOD_WAIT_INLINE = int(os.getenv('SCRAPER_FLOOD_WAIT_INLINE', '5'))
+# Longest FloodWait slept through where there is no channel to reschedule (photos, single-day scrapes)
+MAX_FLOOD_WAIT = int(os.getenv('SCRAPER_MAX_FLOOD_WAIT', '900'))
+# Times a channel is put back in the queue after FloodWaits before it is given up for the run
+MAX_RESCHEDULES = int(os.getenv('SCRAPER_MAX_RESCHEDULES', '5'))
+
+# Errors worth retrying: dropped connections, timeouts and Telegram internal errors
+TRANSIENT_ERRORS = (ConnectionError, asyncio.TimeoutError, ServerError)
+
+class TokenBucket:
+    """
+    Paces one API method to `rate` requests per second with bursts of up to
+    `burst`, adapting the rate additively up and multiplicatively down (AIMD)
+    as requests succeed or hit a FloodWait. A FloodWait halves the rate and
+    caps its recovery just below the rate that drew it; the cap then creeps
+    back towards `rate` so a limit Telegram has since raised is found again.
+
+    Callers reserve a token and sleep until it is theirs, so waiting needs no
+    lock and one bucket can serve every channel task of the session. A
+    FloodWait voids the outstanding reservations: their callers queue again
+    behind the wait at the lowered rate instead of all firing when it ends.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.max_rate = rate
+        self.rate = rate
+        self.ceiling = rate
+        self.min_rate = rate / 16
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.flood_waits = 0
+
+    def _reserve(self):
+        """Takes a token, possibly going into debt, and returns the seconds until it may be used."""
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        self.tokens -= 1
+        debt = -self.tokens / self.rate if self.tokens < 0 else 0
+        return self.updated - now + debt
+
+    async def acquire(self):
+        """Waits for a token; returns the FloodWait count it was granted under, for on_flood_wait."""
+        while True:
+            flood_waits = self.flood_waits
+            delay = self._reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.flood_waits == flood_waits:
+                return flood_waits
+
+    def on_success(self):
+        self.ceiling = min(self.max_rate, self.ceiling + self.max_rate / 1000)
+        self.rate = min(self.ceiling, self.rate + self.max_rate / 20)
+
+    def on_flood_wait(self, seconds, granted_under):
+        """
+        Holds every caller until Telegram's wait is over. Only the first of the
+        requests sent before it backs the rate off; the rest hit the same limit.
+        """
+        self.updated = max(self.updated, time.monotonic() + seconds)
+        self.tokens = 0
+        if granted_under != self.flood_waits:
+            return
+        self.flood_waits += 1
+        self.ceiling = max(self.min_rate, self.rate * 0.9)
+        self.rate = max(self.min_rate, self.rate / 2)
+
+class RateLimiter:
+    """One token bucket per API method, shared by all requests of the session."""
+
+    def __init__(self, rate_limits=RATE_LIMITS):
+        self.buckets = {method: TokenBucket(rate, burst) for method, (rate, burst) in rate_limits.items()}
+        self.flood_waits = 0
+
+    async def call(self, method, request):
+        """Awaits request() once method's bucket has a token; FloodWaitError is recorded and re-raised."""
+        bucket = self.buckets[method]
+        granted_under = await bucket.acquire()
+        try:
+            result = await request()
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            bucket.on_flood_wait(e.seconds, granted_under)
+            logging.warning(f"FloodWait of {e.seconds}s on {method}; rate lowered to {bucket.rate:.2f}/s")
+            raise
+        bucket.on_success()
+        return result
+
+rate_limiter = RateLimiter()
+
+async def call_with_retries(method, request, description, max_flood_wait=FLOOD_WAIT_INLINE):
+    """
+    Calls request() through the rate limiter. Transient errors are retried
+    up to MAX_RETRIES times with jittered exponential backoff, and FloodWaits
+    of at most max_flood_wait seconds are waited out (the bucket holds the
+    retry back). Longer FloodWaits and exhausted retries propagate.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await rate_limiter.call(method, request)
+        except FloodWaitError as e:
+            attempt += 1
+            if e.seconds > max_flood_wait or attempt > MAX_RETRIES:
+                raise
+        except TRANSIENT_ERRORS as e:
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                raise
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+            logging.warning(f"{description} failed ({e!r}); retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def download_photo(client, media, image_path):
+    """
+    Downloads a photo to image_path via a temporary file, so an interrupted
+    download never leaves a truncated image that later runs would skip.
+    """
+    logging.info(f"Downloading image {image_path}")
+    partial_path = f"{image_path}.part"
+    await call_with_retries('download', lambda: client.download_media(media, file=partial_path),
+                            f"Download of {image_path}", max_flood_wait=MAX_FLOOD_WAIT)
+    os.replace(partial_path, image_path)
+
+async def media_worker(client, media_queue):
+    """Downloads queued (media, image_path) pairs until cancelled."""
+    while True:
+        media, image_path = await media_queue.get()
+        try:
+            await download_photo(client, media, image_path)
+        except Exception as e:
+            logging.error(f"Error downloading {image_path}: {str(e)}")
+        finally:
+            media_queue.task_done()
+
+def checkpoint_path(channel_name):
+    return os.path.join(CHECKPOINT_DIR, f"{channel_name}.json")
+
+def load_checkpoint(channel_name):
+    """Returns the saved scrape state for a channel, or an empty dict."""
+    path = checkpoint_path(channel_name)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_checkpoint(channel_name, checkpoint):
+    """Writes the channel's scrape state atomically, so a crash never leaves half a file."""
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    checkpoint['channel_name'] = channel_name
+    checkpoint['updated_at'] = datetime.now().isoformat()
+    path = checkpoint_path(channel_name)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+def advance_high_water_mark(checkpoint, messages):
+    """Moves last_message_id/last_message_date forward to the newest of messages."""
+    newest = max(messages, key=lambda m: m.id)
+    if newest.id > (checkpoint.get('last_message_id') or 0):
+        checkpoint['last_message_id'] = newest.id
+        checkpoint['last_message_date'] = newest.date.isoformat()
+
+async def fetch_page(client, entity, offset_id=0, min_id=0, limit=PAGE_SIZE, offset_date=None,
+                     max_flood_wait=FLOOD_WAIT_INLINE):
+    """
+    Fetches one page of messages older than offset_id (0 = newest) or
+    offset_date and newer than min_id, newest first, as one rate-limited
+    history request; see call_with_retries.
+    """
+    async def request():
+        return [message async for message in client.iter_messages(
+            entity, limit=limit, offset_id=offset_id, min_id=min_id, offset_date=offset_date)]
+
+    return await call_with_retries('history', request, f"History page of {entity} below {offset_id}",
+                                   max_flood_wait)
+
+async def get_entity(client, channel_name, max_flood_wait=FLOOD_WAIT_INLINE):
+    return await call_with_retries('get_entity', lambda: client.get_entity(channel_name),
+                                   f"Lookup of {channel_name}", max_flood_wait)
+
+async def process_message(client, message, channel_name, channel_image_dir, media_queue=None):
+    """Builds the metadata record for a message and schedules its photo download."""
+    msg_data = {
+        'message_id': message.id,
+        'channel_name': channel_name,
+        'date': message.date.isoformat(),
+        'message_text': message.text,
+        'views': getattr(message, 'views', 0),
+        'forwards': getattr(message, 'forwards', 0),
+        'has_media': False,
+        'image_path': None
+    }
+
+    # Download image if present
+    if message.photo:
+        msg_data['has_media'] = True
+        image_filename = f"{message.id}.jpg"
+        image_path = os.path.join(channel_image_dir, image_filename)
+
+        # Verify if we've already downloaded it to save bandwidth/time
+        if not os.path.exists(image_path):
+            if media_queue is None:
+                await download_photo(client, message.media, image_path)
+            else:
+                await media_queue.put((message.media, image_path))
+
+        msg_data['image_path'] = image_path
+
+    return msg_data
+
+class NdjsonWriter:
+    """
+    Appends message records to data/raw/telegram_messages/YYYY-MM-DD/channel_name.jsonl
+    as they are fetched, one JSON object per line.
+
+    Data is flushed and fsynced every FSYNC_EVERY records and on sync()/close(),
+    so a crash loses at most the records since the last sync instead of the
+    whole channel. Runs on the same day append to the same file, which is
+    only created once there is a record to write.
+
+    date_str picks the dated folder (default: today). With replace=True the
+    records go to a temporary file that replaces the existing one only when
+    the writer closes without an error, so re-scraping a day is idempotent;
+    closing without having written a record removes the existing file.
+    """
+
+    def __init__(self, channel_name, date_str=None, replace=False):
+        date_str = date_str or datetime.now().strftime('%Y-%m-%d')
+        self.path = os.path.join(f"data/raw/telegram_messages/{date_str}", f"{channel_name}.jsonl")
+        self.replace = replace
+        self.count = 0
+        self._unsynced = 0
+        self._file = None
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.replace:
+            self._file = open(f"{self.path}.part", 'wb')
+            return
+        self._file = open(self.path, 'ab')
+
+        # A crash mid-write can leave a partial last line; terminate it so the
+        # next record starts on a line of its own (the loader skips the fragment).
+        if self._file.tell() > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write(b'\n')
+
+    def write(self, record):
+        if self._file is None:
+            self._open()
+        self._file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.count += 1
+        self._unsynced += 1
+        if self._unsynced >= FSYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        if self._file is None or self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self, commit=True):
+        if self._file is not None and not self._file.closed:
+            self.sync()
+            self._file.close()
+            if self.replace:
+                if commit:
+                    os.replace(self._file.name, self.path)
+                else:
+                    os.remove(self._file.name)
+        elif self._file is None and self.replace and commit:
+            # The day has no messages any more, so an earlier scrape's file is stale
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(commit=exc_type is None)
+        return False
+
+async def scrape_new_messages(client, entity, channel_name, checkpoint, channel_image_dir, media_queue=None):
+    """
+    Fetches messages newer than the channel's high-water mark, page by page,
+    appending each record to the day's NDJSON file as it arrives.
+
+    A channel without a checkpoint gets its INITIAL_LIMIT most recent
+    messages; use backfill mode for full history. Messages arrive newest
+    first, so the high-water mark only advances once the whole range is
+    written. Until then the range's progress is saved as 'catch_up' after
+    every page, and a run interrupted by a FloodWait or an error resumes
+    below the last written page instead of starting the range over.
+    """
+    catch_up = checkpoint.get('catch_up') or {
+        'min_id': checkpoint.get('last_message_id') or 0,
+        'offset_id': 0,
+        'count': 0,
+    }
+    min_id = catch_up['min_id']
+    max_messages = None if min_id else INITIAL_LIMIT
+    if catch_up['offset_id']:
+        logging.info(f"Resuming {channel_name} below message {catch_up['offset_id']} "
+                     f"({catch_up['count']} messages already saved)")
+
+    with NdjsonWriter(channel_name) as writer:
+        while True:
+            limit = PAGE_SIZE if max_messages is None else min(PAGE_SIZE, max_messages - catch_up['count'])
+            if limit <= 0:
+                break
+            page = await fetch_page(client, entity, offset_id=catch_up['offset_id'], min_id=min_id, limit=limit)
+            if page:
+                for message in page:
+                    writer.write(await process_message(client, message, channel_name, channel_image_dir,
+                                                       media_queue))
+                writer.sync()
+                advance_high_water_mark(catch_up, page)
+                catch_up['offset_id'] = page[-1].id
+                catch_up['count'] += len(page)
+                checkpoint['catch_up'] = catch_up
+                save_checkpoint(channel_name, checkpoint)
+            if len(page) < limit:
+                break
+
+    checkpoint.pop('catch_up', None)
+    if not catch_up['count']:
+        logging.info(f"No new messages in {channel_name} since message {min_id}.")
+        return 0
+
+    checkpoint['last_message_id'] = catch_up['last_message_id']
+    checkpoint['last_message_date'] = catch_up['last_message_date']
+    save_checkpoint(channel_name, checkpoint)
+    logging.info(f"Successfully scraped {channel_name}. Saved {catch_up['count']} messages to {writer.path}")
+    return writer.count
+
+async def backfill_channel(client, entity, channel_name, checkpoint, channel_image_dir, media_queue=None):
+    """
+    Walks a channel's full history from newest to oldest in PAGE_SIZE pages.
+
+    Each page is appended and fsynced before its position is saved, so an
+    interrupted backfill resumes from the last completed page.
+    """
+    if checkpoint.get('backfill_complete'):
+        logging.info(f"Backfill of {channel_name} already complete.")
+        return 0
+
+    offset_id = checkpoint.get('backfill_offset_id') or 0
+    if offset_id:
+        logging.info(f"Resuming backfill of {channel_name} below message {offset_id}")
+
+    with NdjsonWriter(channel_name) as writer:
+        while True:
+            page = await fetch_page(client, entity, offset_id=offset_id)
+            if page:
+                for message in page:
+                    writer.write(await process_message(client, message, channel_name, channel_image_dir, media_queue))
+                writer.sync()
+                advance_high_water_mark(checkpoint, page)
+                offset_id = page[-1].id
+
+            checkpoint['backfill_offset_id'] = offset_id
+            checkpoint['backfill_complete'] = len(page) < PAGE_SIZE
+            save_checkpoint(channel_name, checkpoint)
+            if checkpoint['backfill_complete']:
+                break
+
+    logging.info(f"Backfill of {channel_name} complete. Saved {writer.count} messages this run to {writer.path}")
+    return writer.count
+
+async def scrape_channel(client, channel_name, media_queue=None, backfill=False):
     """
     Scrapes messages and images from a single Telegram channel.
+
+    By default only messages newer than the channel's checkpoint are fetched;
+    backfill=True walks the full history instead. When media_queue is given,
+    photos are handed to the download workers and message iteration
+    continues; otherwise each photo is downloaded inline.
+
+    A FloodWaitError too long to wait out in place propagates so the caller
+    can reschedule the channel; progress up to it is in the checkpoint.
+    Other errors are logged and end the channel's scrape for this run.
     """
-    logging.info(f"Starting scrape for channel: {channel_name}")
-    
+    logging.info(f"Starting {'backfill' if backfill else 'scrape'} for channel: {channel_name}")
+
     # Create directories for images
     channel_image_dir = f"data/raw/images/{channel_name}"
     os.makedirs(channel_image_dir, exist_ok=True)
-    
-    messages_data = []
-    
+
     try:
+        checkpoint = load_checkpoint(channel_name)
+
         # Get the channel entity
-        entity = await client.get_entity(channel_name)
-        
-        # Iterate over messages (limit set to 100 for initial testing)
-        # Remove limit=100 or increase it for full scraping
-        async for message in client.iter_messages(entity, limit=100):
-            msg_data = {
-                'message_id': message.id,
-                'channel_name': channel_name,
-                'date': message.date.isoformat(),
-                'message_text': message.text,
-                'views': getattr(message, 'views', 0),
-                'forwards': getattr(message, 'forwards', 0),
-                'has_media': False,
-                'image_path': None
-            }
-            
-            # Download image if present
-            if message.photo:
-                msg_data['has_media'] = True
-                image_filename = f"{message.id}.jpg"
-                image_path = os.path.join(channel_image_dir, image_filename)
-                
-                # Verify if we've already downloaded it to save bandwidth/time
-                if not os.path.exists(image_path):
-                    logging.info(f"Downloading image for message {message.id}")
-                    await client.download_media(message.media, file=image_path)
-                
-                msg_data['image_path'] = image_path
-            
-            messages_data.append(msg_data)
-            
-        # Save metadata to JSON
-        # File structure: data/raw/telegram_messages/YYYY-MM-DD/channel_name.json
-        date_str = datetime.now().strftime('%Y-%m-%d')
-        json_dir = f"data/raw/telegram_messages/{date_str}"
-        os.makedirs(json_dir, exist_ok=True)
-        json_path = os.path.join(json_dir, f"{channel_name}.json")
-        
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(messages_data, f, ensure_ascii=False, indent=4)
-            
-        logging.info(f"Successfully scraped {channel_name}. Saved {len(messages_data)} messages to {json_path}")
+        entity = await get_entity(client, channel_name)
+
+        with instrumentation.stage(f"channel:{channel_name}", unit='messages') as scraped:
+            if backfill:
+                scraped.items = await backfill_channel(client, entity, channel_name, checkpoint,
+                                                       channel_image_dir, media_queue)
+            else:
+                scraped.items = await scrape_new_messages(client, entity, channel_name, checkpoint,
+                                                          channel_image_dir, media_queue)
 
+    except FloodWaitError:
+        raise
     except Exception as e:
         logging.error(f"Error scraping channel {channel_name}: {str(e)}")
 
-async def main():
+@asynccontextmanager
+async def media_downloads(client, media_workers=MEDIA_WORKERS):
+    """
+    Yields a bounded photo download queue served by media_workers tasks, or
+    None when media_workers is 0 (photos then download inline). On a clean
+    exit waits for queued downloads to finish.
+    """
+    if media_workers <= 0:
+        yield None
+        return
+
+    media_queue = asyncio.Queue(maxsize=MEDIA_QUEUE_SIZE)
+    workers = [asyncio.create_task(media_worker(client, media_queue)) for _ in range(media_workers)]
+    try:
+        yield media_queue
+        with instrumentation.stage('wait_for_downloads'):
+            await media_queue.join()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+async def scrape_channel_day(client, channel_name, day, media_workers=MEDIA_WORKERS):
+    """
+    Scrapes the messages a channel posted on `day` (UTC) into
+    data/raw/telegram_messages/<day>/<channel_name>.jsonl, replacing that
+    file, and downloads their photos. Checkpoints are neither read nor moved,
+    so any day can be re-scraped on its own. With no other channel to turn
+    to, FloodWaits of up to MAX_FLOOD_WAIT seconds are waited out in place,
+    keeping the pages already written. Errors propagate to the caller.
+    Returns the number of messages written.
+    """
+    channel_image_dir = f"data/raw/images/{channel_name}"
+    os.makedirs(channel_image_dir, exist_ok=True)
+    day_start = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+    day_end = day_start + timedelta(days=1)
+
+    with instrumentation.stage('scrape', unit='messages') as scraped:
+        entity = await get_entity(client, channel_name, max_flood_wait=MAX_FLOOD_WAIT)
+        async with media_downloads(client, media_workers) as media_queue:
+            with instrumentation.stage('fetch_messages', unit='messages') as fetched:
+                with NdjsonWriter(channel_name, date_str=day.isoformat(), replace=True) as writer:
+                    # Newest first, starting just before the end of the day
+                    offset_id = 0
+                    while True:
+                        page = await fetch_page(client, entity, offset_id=offset_id,
+                                                offset_date=None if offset_id else day_end,
+                                                max_flood_wait=MAX_FLOOD_WAIT)
+                        in_day = [message for message in page if message.date >= day_start]
+                        for message in in_day:
+                            writer.write(await process_message(client, message, channel_name, channel_image_dir,
+                                                               media_queue))
+                        if len(in_day) < PAGE_SIZE:
+                            break
+                        offset_id = page[-1].id
+                fetched.items = writer.count
+        scraped.items = writer.count
+
+    logging.info(f"Scraped {writer.count} messages of {channel_name} posted on {day} into {writer.path}")
+    return writer.count
+
+async def scrape_channels(client, channels, channel_concurrency=CHANNEL_CONCURRENCY,
+                          media_workers=MEDIA_WORKERS, backfill=False):
+    """
+    Scrapes channels concurrently, with at most channel_concurrency in flight.
+
+    Photos from every channel go through one bounded queue served by
+    media_workers download tasks, so message metadata keeps streaming while
+    images download. A channel stopped by a FloodWait goes back in the queue,
+    due once the wait is over, and the workers carry on with other channels
+    meanwhile; it resumes from its checkpoint. Returns once all channels and
+    queued downloads finish.
+    """
+    # (due time, order, channel, reschedules): the channel due first is taken first
+    channel_queue = asyncio.PriorityQueue()
+    order = itertools.count()
+    for channel in channels:
+        channel_queue.put_nowait((0.0, next(order), channel, 0))
+
+    async with media_downloads(client, media_workers) as media_queue:
+        async def channel_worker():
+            while not channel_queue.empty():
+                due, _, channel, reschedules = channel_queue.get_nowait()
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    await scrape_channel(client, channel, media_queue, backfill)
+                except FloodWaitError as e:
+                    if reschedules >= MAX_RESCHEDULES:
+                        logging.error(f"Giving up on {channel} for this run after {reschedules} FloodWaits")
+                        continue
+                    logging.warning(f"FloodWait of {e.seconds}s while scraping {channel}; rescheduling it")
+                    channel_queue.put_nowait((time.monotonic() + e.seconds, next(order), channel, reschedules + 1))
+
+        await asyncio.gather(*(channel_worker() for _ in range(max(1, channel_concurrency))))
+
+async def main(backfill=False):
     """
     Main entry point for the scraper.
     """
@@ -101,11 +601,38 @@ async def main():
         print("Error: Please set TG_API_ID and TG_API_HASH in your .env file.")
         return
 
-    async with TelegramClient(SESSION_NAME, API_ID, API_HASH) as client:
+    # flood_sleep_threshold=0: telethon raises every FloodWait instead of sleeping through short
+    # ones inside the request, so the rate limiter sees them and other channels keep going.
+    async with TelegramClient(SESSION_NAME, API_ID, API_HASH, flood_sleep_threshold=0) as client:
         logging.info("Telegram client started.")
-        for channel in CHANNELS:
-            await scrape_channel(client, channel)
+        with instrumentation.stage('scrape', unit='channels', items=len(CHANNELS)):
+            await scrape_channels(client, CHANNELS, backfill=backfill)
         logging.info("Scraping completed for all channels.")
 
+async def scrape_partition(channel_name, day):
+    """Scrapes one channel's messages for one day with a fresh client; see scrape_channel_day."""
+    if not API_ID or not API_HASH:
+        raise RuntimeError("TG_API_ID and TG_API_HASH must be set in the .env file.")
+
+    # FloodWaits are raised to the rate limiter; see main()
+    async with TelegramClient(SESSION_NAME, API_ID, API_HASH, flood_sleep_threshold=0) as client:
+        return await scrape_channel_day(client, channel_name, day)
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Scrape Telegram channels into data/raw.")
+    parser.add_argument('--backfill', action='store_true',
+                        help="Walk each channel's full history, resuming from the saved checkpoint.")
+    parser.add_argument('--channel', help="With --date, scrape only this channel's messages of that day.")
+    parser.add_argument('--date', type=date.fromisoformat,
+                        help="With --channel, the day (YYYY-MM-DD, UTC) to scrape, replacing its file.")
+    parser.add_argument('--report', help="Write a JSON report of stage timings to this path.")
+    args = parser.parse_args()
+    configure_logging()
+    if args.channel or args.date:
+        if not (args.channel and args.date):
+            parser.error("--channel and --date must be given together")
+        asyncio.run(scrape_partition(args.channel, args.date))
+    else:
+        asyncio.run(main(backfill=args.backfill))
+    if args.report:
+        instrumentation.write_report(args.report, script='scraper')
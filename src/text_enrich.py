@@ -0,0 +1,340 @@
+import os
+import re
+import csv
+import hashlib
+import argparse
+import unicodedata
+from datetime import date, timedelta
+import ahocorasick
+from psycopg2.extras import execute_values
+from sqlalchemy import create_engine
+from dotenv import load_dotenv
+import logging
+import instrumentation
+
+# Load environment variables
+load_dotenv()
+
+# Setup Logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Database Config
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+# CSV of product_name,product_type,alias rows; also loaded into the warehouse by `dbt seed`
+DICTIONARY_PATH = os.getenv("TEXT_ENRICH_DICTIONARY", 'medical_warehouse/seeds/product_dictionary.csv')
+# Messages read, matched and committed per round-trip
+BATCH_ROWS = int(os.getenv("TEXT_ENRICH_BATCH_ROWS", "5000"))
+# Bumped whenever normalize() changes, so every message is matched again
+NORMALIZER_VERSION = 1
+# How far below the last run's newest loaded_at to look again. loaded_at is the
+# loading transaction's now(), so a load that commits after a run started can
+# hold older timestamps than the rows that run saw.
+LOOKBACK = timedelta(minutes=int(os.getenv("TEXT_ENRICH_LOOKBACK_MINUTES", "60")))
+
+# Ethiopic letters that spell the same sound, mapped to one form per sound:
+# ሐ and ኀ to ሀ, ሠ to ሰ, ዐ to አ and ፀ to ጸ. Each letter is a row of seven
+# vowel orders in consecutive code points, so whole rows are mapped at once.
+ETHIOPIC_HOMOPHONES = {0x1210: 0x1200, 0x1280: 0x1200, 0x1220: 0x1230, 0x12D0: 0x12A0, 0x1340: 0x1338}
+ETHIOPIC_TRANSLATION = {variant + order: base + order
+                        for variant, base in ETHIOPIC_HOMOPHONES.items() for order in range(7)}
+# Splits '500mg' and 'ፓራሲታሞል500' into separate words
+DIGIT_BOUNDARY = re.compile(r'(?<=[^\W\d_])(?=\d)|(?<=\d)(?=[^\W\d_])')
+NON_WORD = re.compile(r'[\W_]+')
+
+def get_db_connection():
+    db_url = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    return create_engine(db_url)
+
+def normalize(text):
+    """
+    Folds spelling variants of Latin and Amharic text to one form: case,
+    accents, Ethiopic homophone letters and punctuation (including Ethiopic
+    word and sentence separators), leaving single-space separated words.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold().translate(ETHIOPIC_TRANSLATION)
+    # Drops Latin accents and the Ethiopic gemination marks
+    text = ''.join(char for char in unicodedata.normalize('NFD', text) if not unicodedata.combining(char))
+    text = DIGIT_BOUNDARY.sub(' ', text)
+    return NON_WORD.sub(' ', text).strip()
+
+def load_dictionary(path=DICTIONARY_PATH):
+    """
+    Returns ([(alias, product_name, product_type), ...], dictionary hash).
+    Every product name is an alias of itself. The hash covers the normalized
+    entries and NORMALIZER_VERSION, so it changes exactly when matching would.
+    """
+    entries = {}
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            product_name = (row.get('product_name') or '').strip()
+            if not product_name:
+                continue
+            product_type = (row.get('product_type') or '').strip() or None
+            for alias in (product_name, row.get('alias') or ''):
+                key = normalize(alias)
+                if not key:
+                    continue
+                if key in entries and entries[key][0] != product_name:
+                    logging.warning(f"Alias '{alias}' of {product_name} already names {entries[key][0]}; keeping the first.")
+                    continue
+                entries[key] = (product_name, product_type)
+
+    digest = hashlib.sha256(f"normalizer:{NORMALIZER_VERSION}\n".encode('utf-8'))
+    for key, (product_name, product_type) in sorted(entries.items()):
+        digest.update(f"{key}\t{product_name}\t{product_type}\n".encode('utf-8'))
+    return [(key, *value) for key, value in entries.items()], digest.hexdigest()[:16]
+
+class ProductMatcher:
+    """
+    An Aho-Corasick automaton over every normalized alias, so one scan of a
+    message finds all dictionary entries in it whatever the dictionary size.
+    Aliases match whole words only: both the aliases and the text are padded
+    with spaces, and normalize() leaves single spaces between words.
+    """
+
+    def __init__(self, entries):
+        self.automaton = ahocorasick.Automaton()
+        for alias, product_name, product_type in entries:
+            self.automaton.add_word(f" {alias} ", (len(alias) + 2, product_name, product_type))
+        if len(self.automaton):
+            self.automaton.make_automaton()
+
+    def find(self, text):
+        """
+        Returns {(product_name, product_type): mentions} for a message text.
+        Overlapping matches resolve to the leftmost, then longest, so
+        'vitamin d3' does not also count as a shorter alias inside it.
+        """
+        if not text or self.automaton.kind != ahocorasick.AHOCORASICK:
+            return {}
+        matches = sorted(
+            (end - length + 1, -length, product_name, product_type)
+            for end, (length, product_name, product_type) in self.automaton.iter(f" {normalize(text)} ")
+        )
+        mentions = {}
+        last_end = 0
+        for start, negative_length, product_name, product_type in matches:
+            # Neighbouring words share the space between them
+            if start < last_end:
+                continue
+            last_end = start - negative_length - 1
+            key = (product_name, product_type)
+            mentions[key] = mentions.get(key, 0) + 1
+        return mentions
+
+def ensure_mention_tables(cursor):
+    """
+    Creates raw.product_mentions; raw.message_enrichment, which records
+    for each message the loaded_at and dictionary hash it was last matched
+    with, so only new, changed or re-dictionaried messages are matched again;
+    and raw.enrichment_watermarks, the newest loaded_at a full run has
+    matched up to per dictionary. Also indexes raw.telegram_messages for
+    fetch_pending. A copy-mode load rebuilds that table without them; the
+    next run creates them again.
+    """
+    # Partitioned pipeline runs start concurrently; serialise the DDL until the caller commits
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('raw.product_mentions'));")
+    cursor.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS raw.product_mentions (
+            channel_name TEXT NOT NULL,
+            message_id BIGINT NOT NULL,
+            product_name TEXT NOT NULL,
+            product_type TEXT,
+            mention_count INTEGER NOT NULL,
+            extracted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (channel_name, message_id, product_name)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS raw.message_enrichment (
+            channel_name TEXT NOT NULL,
+            message_id BIGINT NOT NULL,
+            loaded_at TIMESTAMPTZ,
+            dictionary_hash TEXT NOT NULL,
+            extracted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (channel_name, message_id)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS raw.enrichment_watermarks (
+            dictionary_hash TEXT PRIMARY KEY,
+            loaded_at TIMESTAMPTZ NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+    cursor.execute("SELECT to_regclass('raw.telegram_messages');")
+    if cursor.fetchone()[0] is None:
+        return
+    # The loader builds and swaps this table under its own lock
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('raw.telegram_messages'));")
+    # New rows since the watermark
+    cursor.execute("CREATE INDEX IF NOT EXISTS telegram_messages_loaded_at ON raw.telegram_messages (loaded_at);")
+    # One channel's day, for partition runs; "C" keeps ISO 8601 strings in date order
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS telegram_messages_channel_date "
+        "ON raw.telegram_messages (channel_name, date COLLATE \"C\");"
+    )
+    # The batch keyset; incremental loads already index it as their unique key
+    cursor.execute("""
+        SELECT 1 FROM pg_indexes
+        WHERE schemaname = 'raw' AND indexname = 'telegram_messages_natural_key';
+    """)
+    if cursor.fetchone() is None:
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS telegram_messages_channel_message "
+            "ON raw.telegram_messages (channel_name, message_id);"
+        )
+
+def fetch_watermark(cursor, dictionary_hash):
+    """The newest loaded_at a full run has matched with this dictionary, or None."""
+    cursor.execute("SELECT loaded_at FROM raw.enrichment_watermarks WHERE dictionary_hash = %s;", (dictionary_hash,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def store_watermark(cursor, dictionary_hash, loaded_at):
+    cursor.execute("""
+        INSERT INTO raw.enrichment_watermarks (dictionary_hash, loaded_at)
+        VALUES (%s, %s)
+        ON CONFLICT (dictionary_hash) DO UPDATE
+        SET loaded_at = GREATEST(raw.enrichment_watermarks.loaded_at, EXCLUDED.loaded_at),
+            updated_at = now();
+    """, (dictionary_hash, loaded_at))
+
+def fetch_pending(cursor, dictionary_hash, after=None, channel_name=None, day=None, since=None, limit=BATCH_ROWS):
+    """
+    Returns up to limit (channel_name, message_id, message_text, loaded_at)
+    rows not yet matched against this dictionary in their current version,
+    in key order after the key `after`. Only rows loaded after since, one
+    channel and/or one day are considered if given; each of these filters
+    has an index (see ensure_mention_tables).
+    """
+    conditions = ["(e.message_id IS NULL OR e.dictionary_hash <> %(hash)s OR e.loaded_at IS DISTINCT FROM m.loaded_at)",
+                  "m.message_id IS NOT NULL"]
+    params = {"hash": dictionary_hash, "limit": limit}
+    if after is not None:
+        conditions.append("(m.channel_name, m.message_id) > (%(after_channel)s, %(after_id)s)")
+        params.update(after_channel=after[0], after_id=after[1])
+    if channel_name is not None:
+        conditions.append("m.channel_name = %(channel)s")
+        params["channel"] = channel_name
+    if day is not None:
+        # Raw dates are ISO 8601 strings, so a day is a range of them
+        day = date.fromisoformat(str(day))
+        conditions.append("m.date COLLATE \"C\" >= %(day)s AND m.date COLLATE \"C\" < %(next_day)s")
+        params.update(day=day.isoformat(), next_day=(day + timedelta(days=1)).isoformat())
+    if since is not None:
+        conditions.append("m.loaded_at > %(since)s")
+        params["since"] = since
+    cursor.execute(f"""
+        SELECT m.channel_name, m.message_id, m.message_text, m.loaded_at
+        FROM raw.telegram_messages m
+        LEFT JOIN raw.message_enrichment e
+            ON e.channel_name = m.channel_name AND e.message_id = m.message_id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY m.channel_name, m.message_id
+        LIMIT %(limit)s;
+    """, params)
+    return cursor.fetchall()
+
+def store_mentions(cursor, rows, mentions_by_row, dictionary_hash):
+    """Replaces the mentions of the given messages and marks them matched."""
+    cursor.execute("""
+        DELETE FROM raw.product_mentions p
+        USING (SELECT unnest(%s::text[]) AS channel_name, unnest(%s::bigint[]) AS message_id) k
+        WHERE p.channel_name = k.channel_name AND p.message_id = k.message_id;
+    """, ([row[0] for row in rows], [row[1] for row in rows]))
+    mention_rows = [
+        (row[0], row[1], product_name, product_type, count)
+        for row, mentions in zip(rows, mentions_by_row)
+        for (product_name, product_type), count in mentions.items()
+    ]
+    if mention_rows:
+        execute_values(cursor, """
+            INSERT INTO raw.product_mentions (channel_name, message_id, product_name, product_type, mention_count)
+            VALUES %s;
+        """, mention_rows)
+    execute_values(cursor, """
+        INSERT INTO raw.message_enrichment (channel_name, message_id, loaded_at, dictionary_hash)
+        VALUES %s
+        ON CONFLICT (channel_name, message_id) DO UPDATE
+        SET loaded_at = EXCLUDED.loaded_at,
+            dictionary_hash = EXCLUDED.dictionary_hash,
+            extracted_at = now();
+    """, [(row[0], row[1], row[3], dictionary_hash) for row in rows])
+    return len(mention_rows)
+
+def run_extraction(channel_name=None, day=None, dictionary_path=DICTIONARY_PATH, batch_rows=BATCH_ROWS):
+    """
+    Matches the product dictionary against raw.telegram_messages, optionally
+    only one channel and/or day, and stores the mentions in
+    raw.product_mentions. Only messages loaded or changed since they were
+    last matched, or every message after the dictionary changes, are matched.
+    A run over every channel and day only reads rows loaded since its
+    dictionary's watermark (less LOOKBACK) and advances it once it finishes.
+    A copy-mode load rewrites every row's loaded_at, so the run after one
+    matches the whole table again; incremental loads keep it to new rows.
+    Each batch commits on its own. Returns {'messages': ..., 'mentions': ...}.
+    The work is recorded as the 'extract_mentions' stage.
+    """
+    with instrumentation.stage('extract_mentions', unit='messages') as extract_stage:
+        entries, dictionary_hash = load_dictionary(dictionary_path)
+        matcher = ProductMatcher(entries)
+        logging.info(f"Matching {len(entries)} aliases from {dictionary_path} (dictionary {dictionary_hash}).")
+
+        conn = get_db_connection().raw_connection()
+        try:
+            cursor = conn.cursor()
+            ensure_mention_tables(cursor)
+            conn.commit()
+
+            full_run = channel_name is None and day is None
+            since = watermark = None
+            if full_run:
+                previous = fetch_watermark(cursor, dictionary_hash)
+                since = previous - LOOKBACK if previous is not None else None
+                cursor.execute("SELECT max(loaded_at) FROM raw.telegram_messages;")
+                watermark = cursor.fetchone()[0]
+
+            messages = mentions = 0
+            after = None
+            while True:
+                rows = fetch_pending(cursor, dictionary_hash, after, channel_name, day, since, batch_rows)
+                if not rows:
+                    break
+                mentions += store_mentions(cursor, rows, [matcher.find(row[2]) for row in rows], dictionary_hash)
+                conn.commit()
+                messages += len(rows)
+                after = (rows[-1][0], rows[-1][1])
+
+            if watermark is not None:
+                store_watermark(cursor, dictionary_hash, watermark)
+                conn.commit()
+
+            extract_stage.items = messages
+            logging.info(f"Matched {messages} messages; stored {mentions} product mentions in raw.product_mentions.")
+            return {'messages': messages, 'mentions': mentions, 'dictionary_hash': dictionary_hash}
+
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Database error: {e}")
+            raise
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract product and drug mentions from message text.")
+    parser.add_argument('--channel', help="Only this channel's messages")
+    parser.add_argument('--date', help="Only messages posted on this day (YYYY-MM-DD)")
+    parser.add_argument('--dictionary', default=DICTIONARY_PATH)
+    parser.add_argument('--report', help="Write a JSON report of stage timings to this path.")
+    args = parser.parse_args()
+    run_extraction(args.channel, args.date, args.dictionary)
+    if args.report:
+        instrumentation.write_report(args.report, script='text_enrich')
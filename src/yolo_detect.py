@@ -1,10 +1,24 @@
 import os
 import glob
-import pandas as pd
+import queue
+import time
+import hashlib
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import torch
+import ultralytics
 from ultralytics import YOLO
-from sqlalchemy import create_engine, text
+from psycopg2.extras import execute_values
+from sqlalchemy import create_engine
 from dotenv import load_dotenv
 import logging
+import image_dedup
+import instrumentation
+import processed_layer
 
 # Load environment variables
 load_dotenv()
@@ -19,10 +33,68 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
+IMAGE_DIR = 'data/raw/images'
+MODEL_WEIGHTS = os.getenv("YOLO_WEIGHTS", "yolov8n.pt")
+# Images per model call
+BATCH_SIZE = int(os.getenv("YOLO_BATCH_SIZE", "16"))
+# Threads decoding and letterboxing images ahead of the model
+DECODE_WORKERS = int(os.getenv("YOLO_DECODE_WORKERS", str(os.cpu_count() or 4)))
+# Batches decoded ahead of the one being inferred
+PREFETCH_BATCHES = 2
+# Square model input size in pixels
+IMGSZ = int(os.getenv("YOLO_IMGSZ", "640"))
+# Inference backend, one of BACKENDS
+BACKEND = os.getenv("YOLO_BACKEND", "torch")
+BACKENDS = ('torch', 'onnx')
+# Max differing bits between perceptual hashes of near-duplicate images; 0 groups exact matches only
+PHASH_MAX_DISTANCE = int(os.getenv("YOLO_PHASH_MAX_DISTANCE", "4"))
+# Inference processes; 1 runs the model in-process
+WORKERS = int(os.getenv("YOLO_WORKERS", "1"))
+# Result rows buffered before each cache/database flush
+FLUSH_ROWS = int(os.getenv("YOLO_FLUSH_ROWS", "500"))
+
 def get_db_connection():
     db_url = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     return create_engine(db_url)
 
+def backend_weights(backend=BACKEND, weights=MODEL_WEIGHTS):
+    """
+    Returns the weights file for a backend. The ONNX model is exported from
+    the PyTorch weights on first use, with dynamic axes so any batch and
+    input size can be used; ultralytics runs it on ONNX Runtime's CPU provider.
+    """
+    if backend == 'torch':
+        return weights
+    if backend == 'onnx':
+        onnx_path = os.path.splitext(weights)[0] + '.onnx'
+        if not os.path.exists(onnx_path):
+            logging.info(f"Exporting {weights} to ONNX...")
+            onnx_path = YOLO(weights).export(format='onnx', dynamic=True, simplify=True)
+        return onnx_path
+    raise ValueError(f"Unknown backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+def load_model(backend=BACKEND, weights=MODEL_WEIGHTS):
+    """Loads the detection model for a backend and returns (model, weights path)."""
+    weights_path = backend_weights(backend, weights)
+    return YOLO(weights_path, task='detect'), weights_path
+
+def set_onnx_threads(model, weights, threads, imgsz=IMGSZ):
+    """
+    Gives an ONNX model's Runtime session an intra-op pool of `threads`.
+    ultralytics creates the session itself, sized to every core, when the
+    first prediction sets up its predictor, so one blank image is run to
+    create it and the session is then rebuilt with the thread budget.
+    """
+    import onnxruntime
+
+    model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+    backend = model.predictor.model
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    backend.session = onnxruntime.InferenceSession(weights, sess_options=options,
+                                                   providers=backend.session.get_providers())
+
 def classify_image(detected_classes):
     """
     Classifies image based on detected objects.
@@ -42,102 +114,766 @@ def classify_image(detected_classes):
     else:
         return 'other'
 
-def main():
-    # 1. Load Model
-    model = YOLO('yolov8n.pt')  # loads pretrained YOLOv8n model
-    
-    # 2. Find Images
-    image_dir = 'data/raw/images'
-    image_paths = glob.glob(os.path.join(image_dir, '**', '*.jpg'), recursive=True)
-    
-    if not image_paths:
-        logging.warning("No images found to process.")
-        return
+def find_images(image_dir=IMAGE_DIR):
+    """Returns all downloaded images, in a stable order."""
+    return sorted(glob.glob(os.path.join(image_dir, '**', '*.jpg'), recursive=True))
 
-    logging.info(f"Found {len(image_paths)} images. Starting detection...")
-    
-    results_list = []
-    
+def letterbox(image, size=IMGSZ, color=(114, 114, 114)):
+    """Resizes an image to fit a size x size square, keeping aspect ratio and padding the rest."""
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    top = (size - new_height) // 2
+    left = (size - new_width) // 2
+    return cv2.copyMakeBorder(image, top, size - new_height - top, left, size - new_width - left,
+                              cv2.BORDER_CONSTANT, value=color)
+
+def load_image(img_path, imgsz=IMGSZ):
+    """Decodes a JPEG (BGR, as the model expects) and letterboxes it to the model input size."""
+    image = cv2.imread(img_path)
+    if image is None:
+        raise ValueError("could not decode image")
+    return letterbox(image, imgsz)
+
+def iter_batches(image_paths, batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS, imgsz=IMGSZ,
+                 prefetch_batches=PREFETCH_BATCHES):
+    """
+    Yields (paths, images) batches while a thread pool decodes and letterboxes
+    the next prefetch_batches batches ahead of the model. OpenCV releases the
+    GIL while decoding, so the threads run in parallel. Unreadable images are
+    logged and left out of their batch.
+    """
+    starts = iter(range(0, len(image_paths), batch_size))
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=decode_workers) as pool:
+        def submit_next():
+            start = next(starts, None)
+            if start is None:
+                return
+            batch = image_paths[start:start + batch_size]
+            pending.append((batch, [pool.submit(load_image, path, imgsz) for path in batch]))
+
+        for _ in range(prefetch_batches + 1):
+            submit_next()
+
+        while pending:
+            batch, futures = pending.popleft()
+            submit_next()
+
+            paths, images = [], []
+            for img_path, future in zip(batch, futures):
+                try:
+                    images.append(future.result())
+                    paths.append(img_path)
+                except Exception as e:
+                    logging.error(f"Error processing {img_path}: {e}")
+            if images:
+                yield paths, images
+
+def extract_detections(result, names):
+    """Returns (class names, max confidence) for one result, reading the box tensors as whole arrays."""
+    class_ids = result.boxes.cls.cpu().numpy().astype(int)
+    confidences = result.boxes.conf.cpu().numpy()
+    detected_classes = [names[class_id] for class_id in class_ids]
+    max_conf = float(confidences.max()) if confidences.size else 0.0
+    return detected_classes, max_conf
+
+def build_record(img_path, detected_classes, max_conf):
+    """Builds the result row for an image, or None if its filename is not a message id."""
+    # Extract message_id (filename without extension)
+    # path: data/raw/images/channel_name/12345.jpg -> 12345
+    message_id = os.path.splitext(os.path.basename(img_path))[0]
+
+    # Sanity check if message_id is numeric
+    if not message_id.isdigit():
+        return None
+
+    return {
+        'message_id': int(message_id),
+        'image_path': img_path,
+        'detected_objects': detected_classes,  # List/Array
+        'confidence_score': max_conf,
+        'image_category': classify_image(set(detected_classes))
+    }
+
+def iter_detections(model, image_paths, batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS, imgsz=IMGSZ):
+    """Runs batched inference over image_paths, yielding the result rows of each batch."""
+    for paths, images in iter_batches(image_paths, batch_size, decode_workers, imgsz):
+        try:
+            results = model(images, imgsz=imgsz, verbose=False)
+        except Exception as e:
+            logging.error(f"Error running inference on batch starting at {paths[0]}: {e}")
+            continue
+
+        records = []
+        for img_path, result in zip(paths, results):
+            detected_classes, max_conf = extract_detections(result, model.names)
+            record = build_record(img_path, detected_classes, max_conf)
+            if record is not None:
+                records.append(record)
+        yield records
+
+def detect_images(model, image_paths, batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS, imgsz=IMGSZ):
+    """Runs batched inference over image_paths and returns one result row per image."""
+    return [record for records in iter_detections(model, image_paths, batch_size, decode_workers, imgsz)
+            for record in records]
+
+def file_sha256(file_path):
+    """Returns the hex SHA-256 of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_images(image_paths, workers=DECODE_WORKERS, known=None):
+    """
+    Returns {image_path: (content hash, file size, file mtime)}. Files whose
+    size and mtime match known, {image_path: (content hash, size, mtime)} as
+    recorded by an earlier run, keep their hash unread; the new or changed
+    ones are hashed in parallel.
+    """
+    known = known or {}
+    files = {}
+    to_hash = []
     for img_path in image_paths:
+        stat = os.stat(img_path)
+        recorded = known.get(img_path)
+        if recorded and recorded[0] and recorded[1:] == (stat.st_size, stat.st_mtime):
+            files[img_path] = recorded
+        else:
+            files[img_path] = (None, stat.st_size, stat.st_mtime)
+            to_hash.append(img_path)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for img_path, content_hash in zip(to_hash, pool.map(file_sha256, to_hash)):
+            files[img_path] = (content_hash, *files[img_path][1:])
+    return files
+
+def model_cache_key(model, weights=MODEL_WEIGHTS, imgsz=IMGSZ):
+    """
+    Identifies what produced a detection: the weights file content, the
+    ultralytics version and the input size. Changing any of them gives a new
+    key, so cached detections from another model are never reused.
+    """
+    weights_path = getattr(model, 'ckpt_path', None) or weights
+    return (f"{os.path.basename(weights_path)}:{file_sha256(weights_path)[:16]}"
+            f":ultralytics-{ultralytics.__version__}:imgsz{imgsz}")
+
+def _column_type(cursor, table, column):
+    cursor.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'raw' AND table_name = %s AND column_name = %s;
+    """, (table, column))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+# Turns the old '["bottle", "wine glass"]' strings into {bottle,"wine glass"} arrays
+LEGACY_OBJECTS_TO_ARRAY = """translate(detected_objects, '[]"', '{}')::text[]"""
+
+def ensure_detection_tables(cursor):
+    """
+    Creates the cache and result tables. Tables from earlier versions, with
+    detected_objects stored as a JSON-like string, are converted to text[].
+    """
+    # Partitioned pipeline runs start concurrently; serialise the DDL until the caller commits
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('raw.image_detections'));")
+    cursor.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS raw.detection_cache (
+            content_hash TEXT NOT NULL,
+            model_key TEXT NOT NULL,
+            detected_objects TEXT[] NOT NULL,
+            confidence_score DOUBLE PRECISION NOT NULL,
+            image_category TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (content_hash, model_key)
+        );
+    """)
+    if _column_type(cursor, 'detection_cache', 'detected_objects') == 'text':
+        cursor.execute(f"""
+            ALTER TABLE raw.detection_cache
+            ALTER COLUMN detected_objects TYPE TEXT[] USING {LEGACY_OBJECTS_TO_ARRAY};
+        """)
+
+    if _column_type(cursor, 'image_detections', 'detected_objects') == 'text':
+        # The dbt staging view depends on the column, so rebuild the table
+        # instead of altering it; CASCADE drops the view and the next
+        # `dbt run` recreates it.
+        cursor.execute("ALTER TABLE raw.image_detections RENAME TO image_detections_legacy;")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS raw.image_detections (
+            message_id BIGINT,
+            image_path TEXT,
+            detected_objects TEXT[],
+            confidence_score DOUBLE PRECISION,
+            image_category TEXT,
+            content_hash TEXT,
+            model_key TEXT,
+            copied_from TEXT,
+            file_size BIGINT,
+            file_mtime DOUBLE PRECISION,
+            detected_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    # Lets the next run skip hashing files whose size and mtime are unchanged
+    cursor.execute("""
+        ALTER TABLE raw.image_detections
+            ADD COLUMN IF NOT EXISTS file_size BIGINT,
+            ADD COLUMN IF NOT EXISTS file_mtime DOUBLE PRECISION;
+    """)
+    if _column_type(cursor, 'image_detections', 'copied_from') is None:
+        cursor.execute("ALTER TABLE raw.image_detections ADD COLUMN copied_from TEXT;")
+        # Earlier versions cached detections copied from a near-duplicate under
+        # the copy's own hash. Drop the cache entries of grouped images so each
+        # group is inferred once more and only model output stays cached.
+        cursor.execute("SELECT to_regclass('raw.image_duplicate_groups');")
+        if cursor.fetchone()[0] is not None:
+            cursor.execute("""
+                DELETE FROM raw.detection_cache
+                WHERE content_hash IN (SELECT content_hash FROM raw.image_duplicate_groups);
+            """)
+
+    cursor.execute("SELECT to_regclass('raw.image_detections_legacy');")
+    if cursor.fetchone()[0] is not None:
+        cursor.execute("""
+            ALTER TABLE raw.image_detections_legacy
+                ADD COLUMN IF NOT EXISTS content_hash TEXT,
+                ADD COLUMN IF NOT EXISTS model_key TEXT,
+                ADD COLUMN IF NOT EXISTS detected_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        """)
+        cursor.execute(f"""
+            INSERT INTO raw.image_detections
+                (message_id, image_path, detected_objects, confidence_score, image_category,
+                 content_hash, model_key, detected_at)
+            SELECT message_id, image_path, {LEGACY_OBJECTS_TO_ARRAY}, confidence_score, image_category,
+                   content_hash, model_key, detected_at
+            FROM raw.image_detections_legacy;
+        """)
+        cursor.execute("DROP TABLE raw.image_detections_legacy CASCADE;")
+
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS image_detections_image_path "
+        "ON raw.image_detections (image_path);"
+    )
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS raw.image_phashes (
+            content_hash TEXT PRIMARY KEY,
+            phash BIGINT NOT NULL
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS raw.image_duplicate_groups (
+            group_id TEXT NOT NULL,
+            group_size INTEGER NOT NULL,
+            message_id BIGINT NOT NULL,
+            channel_name TEXT NOT NULL,
+            image_path TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            phash BIGINT,
+            hamming_distance INTEGER,
+            is_representative BOOLEAN NOT NULL
+        );
+    """)
+
+def group_images(cursor, paths_by_hash, workers=DECODE_WORKERS):
+    """
+    Groups distinct files whose perceptual hashes are within PHASH_MAX_DISTANCE
+    bits. Hashes are kept in raw.image_phashes, so only new files are decoded.
+    Returns ({content_hash: group_id}, {content_hash: phash}); a group_id is
+    the content hash of one of its members.
+    """
+    cursor.execute("SELECT content_hash, phash FROM raw.image_phashes WHERE content_hash = ANY(%s);",
+                   (list(paths_by_hash),))
+    phashes = {row[0]: image_dedup.from_signed64(row[1]) for row in cursor.fetchall()}
+
+    missing = {paths[0]: content_hash for content_hash, paths in paths_by_hash.items()
+               if content_hash not in phashes}
+    if missing:
+        computed = {missing[path]: value for path, value in image_dedup.dhash_images(list(missing), workers).items()}
+        if computed:
+            execute_values(cursor, """
+                INSERT INTO raw.image_phashes (content_hash, phash) VALUES %s
+                ON CONFLICT (content_hash) DO NOTHING;
+            """, [(content_hash, image_dedup.to_signed64(value)) for content_hash, value in computed.items()])
+        phashes.update(computed)
+
+    group_of = image_dedup.group_near_duplicates(phashes, PHASH_MAX_DISTANCE)
+    # Files that could not be hashed stand alone
+    for content_hash in paths_by_hash:
+        group_of.setdefault(content_hash, content_hash)
+    return group_of, phashes
+
+def write_duplicate_groups(cursor, members, paths_by_hash, phashes):
+    """
+    Replaces raw.image_duplicate_groups with every image that shares its
+    group with at least one other image, whether an exact copy or a
+    near-duplicate, so analysts can follow reposts within and across channels.
+    """
+    rows = []
+    for group_id, content_hashes in members.items():
+        paths = [path for content_hash in content_hashes for path in paths_by_hash[content_hash]]
+        if len(paths) < 2:
+            continue
+        representative = phashes.get(group_id)
+        for content_hash in content_hashes:
+            phash = phashes.get(content_hash)
+            distance = (phash ^ representative).bit_count() if phash is not None and representative is not None else None
+            for img_path in paths_by_hash[content_hash]:
+                rows.append((
+                    group_id, len(paths),
+                    int(os.path.splitext(os.path.basename(img_path))[0]),
+                    os.path.basename(os.path.dirname(img_path)),
+                    img_path, content_hash,
+                    image_dedup.to_signed64(phash) if phash is not None else None,
+                    distance,
+                    img_path == paths_by_hash[group_id][0],
+                ))
+
+    cursor.execute("TRUNCATE raw.image_duplicate_groups;")
+    if rows:
+        execute_values(cursor, """
+            INSERT INTO raw.image_duplicate_groups
+                (group_id, group_size, message_id, channel_name, image_path, content_hash, phash,
+                 hamming_distance, is_representative)
+            VALUES %s;
+        """, rows)
+    logging.info(f"{len(rows)} images in {len({row[0] for row in rows})} duplicate groups.")
+
+def refresh_duplicate_groups(cursor):
+    """
+    Rebuilds raw.image_duplicate_groups across every detected image from the
+    content hashes in raw.image_detections and the stored perceptual hashes,
+    without reading any image. Partitioned runs only see their own images, so
+    the pipeline calls this once they are done.
+    """
+    cursor.execute("SELECT image_path, content_hash FROM raw.image_detections WHERE content_hash IS NOT NULL;")
+    paths_by_hash = {}
+    for img_path, content_hash in sorted(cursor.fetchall()):
+        paths_by_hash.setdefault(content_hash, []).append(img_path)
+
+    cursor.execute("SELECT content_hash, phash FROM raw.image_phashes WHERE content_hash = ANY(%s);",
+                   (list(paths_by_hash),))
+    phashes = {row[0]: image_dedup.from_signed64(row[1]) for row in cursor.fetchall()}
+
+    group_of = image_dedup.group_near_duplicates(phashes, PHASH_MAX_DISTANCE)
+    members = {}
+    for content_hash in paths_by_hash:
+        members.setdefault(group_of.get(content_hash, content_hash), []).append(content_hash)
+    write_duplicate_groups(cursor, members, paths_by_hash, phashes)
+
+def fetch_cached_detections(cursor, model_key, content_hashes):
+    """Returns {content_hash: (detected_objects, confidence_score, image_category)} for this model."""
+    cursor.execute("""
+        SELECT content_hash, detected_objects, confidence_score, image_category
+        FROM raw.detection_cache
+        WHERE model_key = %s AND content_hash = ANY(%s);
+    """, (model_key, list(content_hashes)))
+    return {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+
+def store_cached_detections(cursor, model_key, records):
+    """Adds freshly inferred records to the detection cache."""
+    execute_values(cursor, """
+        INSERT INTO raw.detection_cache
+            (content_hash, model_key, detected_objects, confidence_score, image_category)
+        VALUES %s
+        ON CONFLICT (content_hash, model_key) DO NOTHING;
+    """, [(r['content_hash'], model_key, r['detected_objects'], r['confidence_score'],
+           r['image_category']) for r in records])
+
+def upsert_detections(cursor, records):
+    """Inserts or replaces rows of raw.image_detections keyed by image_path."""
+    execute_values(cursor, """
+        INSERT INTO raw.image_detections
+            (message_id, image_path, detected_objects, confidence_score, image_category,
+             content_hash, model_key, copied_from, file_size, file_mtime)
+        VALUES %s
+        ON CONFLICT (image_path) DO UPDATE
+        SET message_id = EXCLUDED.message_id,
+            detected_objects = EXCLUDED.detected_objects,
+            confidence_score = EXCLUDED.confidence_score,
+            image_category = EXCLUDED.image_category,
+            content_hash = EXCLUDED.content_hash,
+            model_key = EXCLUDED.model_key,
+            copied_from = EXCLUDED.copied_from,
+            file_size = EXCLUDED.file_size,
+            file_mtime = EXCLUDED.file_mtime,
+            detected_at = now();
+    """, [(r['message_id'], r['image_path'], r['detected_objects'], r['confidence_score'],
+           r['image_category'], r['content_hash'], r['model_key'], r['copied_from'],
+           r['file_size'], r['file_mtime']) for r in records])
+
+class ResultWriter:
+    """
+    Streams result rows to the database and the processed layer.
+
+    Every FLUSH_ROWS rows, fresh detections go into the cache, changed rows
+    are upserted into raw.image_detections, and the transaction commits.
+    The same rows are then published to the 'detections' Parquet dataset
+    (see processed_layer), under the day their message was posted:
+    message_dates, {image_path: 'YYYY-MM-DD'}, when the caller already read
+    its messages, else the day recorded in the 'messages' dataset for every
+    channel the run touches. Work done before a crash is kept.
+    """
+
+    def __init__(self, conn, model_key, image_paths, flush_rows=FLUSH_ROWS, message_dates=None):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.model_key = model_key
+        self.flush_rows = flush_rows
+        self.row_count = 0
+        self.upserted = 0
+        self._pending_cache = {}
+        self._pending_rows = []
+
+        # Only the rows of this run's images are needed to spot unchanged ones
+        self.cursor.execute("""
+            SELECT image_path, content_hash, model_key, copied_from, file_size, file_mtime
+            FROM raw.image_detections
+            WHERE image_path = ANY(%s);
+        """, (list(image_paths),))
+        self._existing = {row[0]: tuple(row[1:]) for row in self.cursor.fetchall()}
+        # {image_path: (content_hash, file_size, file_mtime)} as last stored, for hash_images
+        self.known_files = {path: (row[0], row[3], row[4]) for path, row in self._existing.items()}
+
+        self._dates_by_path = message_dates
+        # (channel_name, message_id) -> day posted, for the channels seen so far
+        self._message_dates = {}
+        self._channels_read = set()
+        self.files_written = 0
+
+    def add(self, records, inferred_hash=None):
+        """
+        Queues result rows. inferred_hash names the content hash the model
+        has just run on; its rows go into the cache. Rows of other hashes,
+        copied from a near-duplicate, never do.
+        """
+        for record in records:
+            self.row_count += 1
+            if inferred_hash is not None and record['content_hash'] == inferred_hash:
+                self._pending_cache[inferred_hash] = record
+            key = (record['content_hash'], record['model_key'], record['copied_from'],
+                   record['file_size'], record['file_mtime'])
+            if self._existing.get(record['image_path']) != key:
+                self._pending_rows.append(record)
+        if len(self._pending_rows) + len(self._pending_cache) >= self.flush_rows:
+            self.flush()
+
+    def message_dates(self, records):
+        """The day each record's message was posted, or None if it is not known."""
+        if self._dates_by_path is not None:
+            return [self._dates_by_path.get(record['image_path']) for record in records]
+        channels = {processed_layer.image_channel(record['image_path']) for record in records} - self._channels_read
+        if channels:
+            self._message_dates.update(processed_layer.message_dates(channels))
+            self._channels_read |= channels
+        return [self._message_dates.get((processed_layer.image_channel(record['image_path']), record['message_id']))
+                for record in records]
+
+    def flush(self):
+        layer_files = []
+        if self._pending_cache:
+            store_cached_detections(self.cursor, self.model_key, list(self._pending_cache.values()))
+        if self._pending_rows:
+            upsert_detections(self.cursor, self._pending_rows)
+            self.upserted += len(self._pending_rows)
+            processed_layer.write_detections(self._pending_rows, self.message_dates(self._pending_rows),
+                                             pending=layer_files)
         try:
-            # Run inference
-            results = model(img_path, verbose=False)
-            result = results[0]
-            
-            # Extract detected classes and confidence
-            detected_classes = []
-            confidences = []
-            
-            for box in result.boxes:
-                cls_id = int(box.cls[0])
-                cls_name = model.names[cls_id]
-                conf = float(box.conf[0])
-                
-                detected_classes.append(cls_name)
-                confidences.append(conf)
-            
-            # Helper: get max confidence or 0
-            max_conf = max(confidences) if confidences else 0.0
-            
-            # Determine category
-            category = classify_image(set(detected_classes))
-            
-            # Extract message_id (filename without extension)
-            # path: data/raw/images/channel_name/12345.jpg -> 12345
-            message_id = os.path.splitext(os.path.basename(img_path))[0]
-            
-            # Sanity check if message_id is numeric
-            if not message_id.isdigit():
+            self.conn.commit()
+        except Exception:
+            processed_layer.discard(layer_files)
+            raise
+        self.files_written += len(layer_files)
+        processed_layer.publish(layer_files)
+        self._pending_cache = {}
+        self._pending_rows = []
+
+    def close(self):
+        self.flush()
+        logging.info(f"Upserted {self.upserted} rows into raw.image_detections and "
+                     f"{processed_layer.dataset_dir('detections')} ({self.files_written} files).")
+
+def _shard_worker(worker_id, image_paths, result_queue, weights, threads, batch_size, decode_workers, imgsz):
+    """
+    Runs in a child process: loads its own model with a fixed thread budget
+    and streams ('batch', worker_id, records) messages for its shard, then
+    ('done', worker_id, image_count, seconds).
+    """
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+    model = YOLO(weights, task='detect')
+    if weights.endswith('.onnx'):
+        # ONNX Runtime ignores torch's setting and would start a thread per core in every worker
+        set_onnx_threads(model, weights, threads, imgsz)
+
+    start = time.perf_counter()
+    for records in iter_detections(model, image_paths, batch_size, min(decode_workers, threads), imgsz):
+        result_queue.put(('batch', worker_id, records))
+    result_queue.put(('done', worker_id, len(image_paths), time.perf_counter() - start))
+
+def run_sharded(image_paths, on_records, workers, threads_per_worker, weights=MODEL_WEIGHTS,
+                batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS, imgsz=IMGSZ):
+    """
+    Splits image_paths across `workers` processes and passes each batch of
+    result rows to on_records in this process, which is the single writer.
+
+    A worker that dies before finishing is restarted once on the images it
+    had not returned yet. If it crashes again those images are logged and
+    left uncached, so the next run retries them. Prints a per-worker
+    throughput report.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    result_queue = ctx.Queue()
+    shards = {worker_id: image_paths[worker_id::workers] for worker_id in range(workers)}
+    returned = {worker_id: set() for worker_id in shards}
+    attempts = {worker_id: 0 for worker_id in shards}
+    stats = {}
+    processes = {}
+
+    def start_worker(worker_id, paths):
+        attempts[worker_id] += 1
+        process = ctx.Process(
+            target=_shard_worker,
+            args=(worker_id, paths, result_queue, weights, threads_per_worker, batch_size, decode_workers, imgsz),
+            daemon=True,
+        )
+        process.start()
+        processes[worker_id] = process
+
+    def handle(message):
+        kind, worker_id = message[0], message[1]
+        if kind == 'batch':
+            records = message[2]
+            returned[worker_id].update(r['image_path'] for r in records)
+            on_records(records)
+        elif kind == 'done':
+            stats[worker_id] = (len(returned[worker_id]), message[3], 'ok')
+
+    for worker_id, paths in shards.items():
+        if paths:
+            start_worker(worker_id, paths)
+
+    while processes:
+        try:
+            handle(result_queue.get(timeout=1))
+            continue
+        except queue.Empty:
+            pass
+
+        for worker_id, process in list(processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del processes[worker_id]
+            # Collect anything the worker sent before exiting
+            while True:
+                try:
+                    handle(result_queue.get(timeout=0.1))
+                except queue.Empty:
+                    break
+            if worker_id in stats:
                 continue
 
-            results_list.append({
-                'message_id': int(message_id),
-                'image_path': img_path,
-                'detected_objects': detected_classes,  # List/Array
-                'confidence_score': max_conf,
-                'image_category': category
-            })
-            
-        except Exception as e:
-            logging.error(f"Error processing {img_path}: {e}")
+            remaining = [p for p in shards[worker_id] if p not in returned[worker_id]]
+            logging.error(f"Worker {worker_id} exited with code {process.exitcode} "
+                          f"with {len(remaining)} images unprocessed.")
+            if attempts[worker_id] < 2 and remaining:
+                logging.info(f"Restarting worker {worker_id} on its remaining images.")
+                start_worker(worker_id, remaining)
+            else:
+                stats[worker_id] = (len(returned[worker_id]), None, f"crashed ({len(remaining)} images left)")
 
-    # 3. Save to CSV
-    if not results_list:
-        logging.info("No results generated.")
-        return
+    logging.info("Per-worker throughput:")
+    for worker_id in sorted(stats):
+        images, seconds, status = stats[worker_id]
+        rate = f"{images / seconds:.1f} images/s" if seconds else "-"
+        logging.info(f"  worker {worker_id}: {images} images, {rate}, {status}")
+
+def run_cached_detection(model, model_key, image_paths, writer, batch_size=BATCH_SIZE,
+                         decode_workers=DECODE_WORKERS, imgsz=IMGSZ, workers=1,
+                         threads_per_worker=None, weights=MODEL_WEIGHTS, write_groups=True):
+    """
+    Writes result rows for every image, running the model only on content
+    not yet in the cache for model_key. Files whose size and mtime match
+    their stored row (writer.known_files) are not read to hash them again.
+
+    Identical files and near-duplicates (reposted product photos, grouped by
+    perceptual hash) are inferred once per group, and the detections are
+    copied to every message in the group. A group with any member already
+    cached needs no inference at all. Only files the model ran on are
+    cached; copied rows name their source in copied_from, so after
+    PHASH_MAX_DISTANCE is lowered the files no longer grouped with it are
+    inferred and their rows replaced. With workers > 1 inference is sharded
+    across processes, each loading `weights` itself. write_groups=False
+    leaves raw.image_duplicate_groups alone, for runs that only see a subset
+    of the images. Returns the number of images sent to the model.
+    """
+    # Images whose filename is not a message id produce no row, so skip them up front
+    image_paths = [p for p in image_paths if os.path.splitext(os.path.basename(p))[0].isdigit()]
+    with instrumentation.stage('hash', unit='images', items=len(image_paths)):
+        files = hash_images(image_paths, decode_workers, writer.known_files)
+        hashes = {img_path: content_hash for img_path, (content_hash, _, _) in files.items()}
+    with instrumentation.stage('cache_lookup', unit='files', items=len(set(hashes.values()))):
+        cached = fetch_cached_detections(writer.cursor, model_key, set(hashes.values()))
+
+    paths_by_hash = {}
+    for img_path, content_hash in hashes.items():
+        paths_by_hash.setdefault(content_hash, []).append(img_path)
+
+    with instrumentation.stage('group', unit='files', items=len(paths_by_hash)):
+        group_of, phashes = group_images(writer.cursor, paths_by_hash, decode_workers)
+        members = {}
+        for content_hash, group_id in group_of.items():
+            members.setdefault(group_id, []).append(content_hash)
+        if write_groups:
+            write_duplicate_groups(writer.cursor, members, paths_by_hash, phashes)
+
+    def to_rows(content_hashes, source_hash, detected_classes, max_conf, category):
+        """Rows for the images of content_hashes carrying the detections made on source_hash."""
+        rows = []
+        for content_hash in content_hashes:
+            for img_path in paths_by_hash[content_hash]:
+                record = build_record(img_path, detected_classes, max_conf)
+                record['image_category'] = category
+                record['content_hash'] = content_hash
+                record['model_key'] = model_key
+                record['copied_from'] = None if content_hash == source_hash else source_hash
+                record['file_size'], record['file_mtime'] = files[img_path][1:]
+                rows.append(record)
+        return rows
+
+    to_infer = []
+    copied = 0
+    for group_id, content_hashes in members.items():
+        hit = next((h for h in content_hashes if h in cached), None)
+        if hit is None:
+            to_infer.append(paths_by_hash[group_id][0])
+            continue
+        # Cached members keep their own detections; the rest copy the hit's,
+        # which stay out of the cache: they were not inferred on those files
+        uncached = []
+        for content_hash in content_hashes:
+            if content_hash in cached:
+                writer.add(to_rows([content_hash], content_hash, *cached[content_hash]))
+            else:
+                uncached.append(content_hash)
+        copied += len(uncached)
+        writer.add(to_rows(uncached, hit, *cached[hit]))
+
+    logging.info(f"{len(hashes)} images, {len(paths_by_hash)} distinct files in {len(members)} near-duplicate "
+                 f"groups. {len(paths_by_hash) - len(to_infer) - copied} files served from the detection cache, "
+                 f"{copied} copied from a cached near-duplicate; running the model on {len(to_infer)}.")
+
+    def on_records(records):
+        for r in records:
+            inferred_hash = hashes[r['image_path']]
+            rows = to_rows(members[group_of[inferred_hash]], inferred_hash, r['detected_objects'],
+                           r['confidence_score'], r['image_category'])
+            writer.add(rows, inferred_hash=inferred_hash)
+
+    if not to_infer:
+        return 0
+
+    start = time.perf_counter()
+    with instrumentation.stage('inference', unit='images', items=len(to_infer)):
+        if workers > 1:
+            threads = threads_per_worker or max(1, (os.cpu_count() or workers) // workers)
+            run_sharded(to_infer, on_records, workers, threads, weights, batch_size, decode_workers, imgsz)
+        else:
+            for records in iter_detections(model, to_infer, batch_size, decode_workers, imgsz):
+                on_records(records)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Inferred {len(to_infer)} images in {elapsed:.2f}s ({len(to_infer) / elapsed:.1f} images/s).")
+    return len(to_infer)
+
+def run_detection(image_paths, write_groups=True,
+                  batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS, imgsz=IMGSZ, workers=WORKERS,
+                  threads_per_worker=None, backend=BACKEND, message_dates=None):
+    """
+    Detects objects in image_paths and stores the results; see
+    run_cached_detection. message_dates, {image_path: 'YYYY-MM-DD'}, gives
+    the day each image's message was posted when the caller knows it; see
+    ResultWriter. Returns {'images': ..., 'inferred': ..., 'upserted': ...}.
+    The work is recorded as the 'detect' stage.
+    """
+    with instrumentation.stage('detect', unit='images', items=len(image_paths)):
+        return _run_detection(image_paths, write_groups, batch_size, decode_workers, imgsz,
+                              workers, threads_per_worker, backend, message_dates)
+
+def _run_detection(image_paths, write_groups, batch_size, decode_workers, imgsz, workers,
+                   threads_per_worker, backend, message_dates):
+    # 1. Load Model
+    with instrumentation.stage('load_model'):
+        model, weights = load_model(backend)
+        model_key = model_cache_key(model, weights, imgsz)
+    logging.info(f"Processing {len(image_paths)} images. Model: {model_key}")
 
-    df = pd.DataFrame(results_list)
-    output_dir = 'data/processed'
-    os.makedirs(output_dir, exist_ok=True)
-    csv_path = os.path.join(output_dir, 'yolo_results.csv')
-    df.to_csv(csv_path, index=False)
-    logging.info(f"Results saved to {csv_path}")
-
-    # 4. Load to Database
-    # We need to serialize the list of objects for Postgres (e.g., to JSON string or Array)
-    # SQLAlchemy/Pandas handle list->ARRAY mapping for Postgres if configured, 
-    # but safer to ensure it's compatible. Let's rely on pandas default behavior 
-    # which might need adjustment for List types. 
-    # Simple approach: Convert list to comma-separated string for 'raw' storage 
-    # or keep it as list and ensure table uses JSONB or ARRAY. 
-    # 'to_sql' with sqlalchemy and lists can be tricky.
-    # Let's convert to JSON string for safety in a raw table.
-    
-    df_db = df.copy()
-    df_db['detected_objects'] = df_db['detected_objects'].apply(lambda x: str(x).replace("'", '"')) # Simple JSON-like string
-    
     engine = get_db_connection()
+    conn = engine.raw_connection()
     try:
-        with engine.connect() as conn:
-            conn.execute(text("CREATE SCHEMA IF NOT EXISTS raw;"))
-            conn.commit()
-            
-        logging.info("Loading results to raw.image_detections...")
-        df_db.to_sql('image_detections', engine, schema='raw', if_exists='replace', index=False)
+        ensure_detection_tables(conn.cursor())
+        conn.commit()
+
+        # 2. Detect, reusing cached results for unchanged images, and stream
+        #    results to the database and the processed layer
+        writer = ResultWriter(conn, model_key, image_paths, message_dates=message_dates)
+        inferred = run_cached_detection(model, model_key, image_paths, writer, batch_size, decode_workers,
+                                        imgsz, workers, threads_per_worker, weights, write_groups)
+        with instrumentation.stage('write', unit='rows', items=writer.row_count):
+            writer.close()
         logging.info("Database load complete.")
-        
+        return {'images': len(image_paths), 'inferred': inferred, 'upserted': writer.upserted}
+
     except Exception as e:
+        conn.rollback()
         logging.error(f"Database error: {e}")
+        raise
+    finally:
+        conn.close()
+
+def update_duplicate_groups():
+    """Rebuilds raw.image_duplicate_groups from stored hashes; see refresh_duplicate_groups."""
+    conn = get_db_connection().raw_connection()
+    try:
+        cursor = conn.cursor()
+        ensure_detection_tables(cursor)
+        with instrumentation.stage('duplicate_groups'):
+            refresh_duplicate_groups(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+
+def main(batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS, imgsz=IMGSZ, workers=WORKERS,
+         threads_per_worker=None, backend=BACKEND):
+    image_paths = find_images()
+
+    if not image_paths:
+        logging.warning("No images found to process.")
+        return
+
+    logging.info(f"Found {len(image_paths)} images.")
+    run_detection(image_paths, batch_size=batch_size, decode_workers=decode_workers, imgsz=imgsz,
+                  workers=workers, threads_per_worker=threads_per_worker, backend=backend)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run YOLOv8 detection over downloaded images.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--decode-workers', type=int, default=DECODE_WORKERS)
+    parser.add_argument('--imgsz', type=int, default=IMGSZ,
+                        help="Model input size; a smaller size such as 320 trades accuracy for speed")
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND,
+                        help="'torch' runs the PyTorch weights; 'onnx' exports them once and runs ONNX Runtime on CPU")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="Inference processes, each with its own model (default: 1, in-process)")
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help="Torch or ONNX Runtime threads per worker process (default: CPU count / workers)")
+    parser.add_argument('--report', help="Write a JSON report of stage timings to this path.")
+    args = parser.parse_args()
+    main(args.batch_size, args.decode_workers, args.imgsz, args.workers, args.threads_per_worker, args.backend)
+    if args.report:
+        instrumentation.write_report(args.report, script='yolo_detect', backend=args.backend, imgsz=args.imgsz)
@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from api import analytics, cache
+
+def serve(monkeypatch, versions, load):
+    """Points the holder at a sequence of warehouse versions and a snapshot loader."""
+    versions = iter(versions)
+
+    async def get_version(db):
+        return next(versions)
+
+    monkeypatch.setattr(cache.data_version, 'get', get_version)
+    monkeypatch.setattr(analytics, 'load_snapshot', load)
+    return analytics.SnapshotHolder()
+
+def test_new_version_waits_for_its_snapshot(monkeypatch):
+    async def load(version):
+        await asyncio.sleep(0)
+        return analytics.Snapshot(version, [], [], [])
+
+    holder = serve(monkeypatch, ['v1', 'v2'], load)
+
+    async def scenario():
+        return (await holder.get(None)).version, (await holder.get(None)).version
+
+    assert asyncio.run(scenario()) == ('v1', 'v2')
+
+def test_failed_rebuild_is_logged_and_retried(monkeypatch, caplog):
+    attempts = []
+
+    async def load(version):
+        attempts.append(version)
+        if len(attempts) == 2:
+            raise ConnectionError("warehouse unavailable")
+        return analytics.Snapshot(version, [], [], [])
+
+    holder = serve(monkeypatch, ['v1', 'v2', 'v2'], load)
+
+    async def scenario():
+        await holder.get(None)
+        with pytest.raises(ConnectionError):
+            await holder.get(None)
+        return (await holder.get(None)).version
+
+    assert asyncio.run(scenario()) == 'v2'
+    assert attempts == ['v1', 'v2', 'v2']
+    assert "rebuild failed" in caplog.text
+
+# dim_channels, fct_messages (channel_key, date_key, view_count, forward_count),
+# fct_image_detections joined to its message's views, and fct_product_mentions
+CHANNELS = [(1, 'tikvahpharma'), (2, 'lobelia4cosmetics'), (3, 'chemed')]
+MESSAGES = [(1, 20240105, 100, 1), (1, 20240105, 50, 0), (1, 20240106, 30, 0), (2, 20240105, 10, 0)]
+DETECTIONS = [
+    ('promotional', ['person', 'bottle', 'bottle'], 100),
+    ('product_display', ['bottle'], 50),
+    ('product_display', ['cup'], 30),
+    ('other', [], 10),
+]
+MENTIONS = ['paracetamol', 'amoxicillin', 'paracetamol', 'vitamin d', 'paracetamol', 'amoxicillin']
+
+def test_snapshot_reports_match_the_sql_queries():
+    snapshot = analytics.Snapshot('v1', CHANNELS, MESSAGES, DETECTIONS, MENTIONS)
+
+    # What the queries in api/main.py return for the marts these rows make up
+    assert snapshot.top_products(2) == [
+        {"product_name": "paracetamol", "count": 3},
+        {"product_name": "amoxicillin", "count": 2},
+    ]
+    # Object instances, so the promotional image's two bottles count twice
+    assert snapshot.top_objects(10) == [
+        {"object_name": "bottle", "count": 3},
+        {"object_name": "cup", "count": 1},
+    ]
+    assert snapshot.channel_activity('tikvahpharma') == [
+        {"date": "2024-01-06", "post_count": 1},
+        {"date": "2024-01-05", "post_count": 2},
+    ]
+    assert snapshot.channel_activity('chemed') == []
+    assert not snapshot.has_channel('unknown')
+    # GROUP BY image_category has no order
+    assert sorted(snapshot.visual_content(), key=lambda row: row["image_category"]) == [
+        {"image_category": "other", "count": 1, "avg_views": 10.0},
+        {"image_category": "product_display", "count": 2, "avg_views": 40.0},
+        {"image_category": "promotional", "count": 1, "avg_views": 100.0},
+    ]
+    # Distinct (image, object) pairs, so an image counts once per object
+    assert snapshot.engagement_by_object(10, 1) == [
+        {"object_name": "person", "image_count": 1, "total_views": 100, "avg_views": 100.0},
+        {"object_name": "bottle", "image_count": 2, "total_views": 150, "avg_views": 75.0},
+        {"object_name": "cup", "image_count": 1, "total_views": 30, "avg_views": 30.0},
+    ]
+    assert snapshot.engagement_by_object(10, 2) == [
+        {"object_name": "bottle", "image_count": 2, "total_views": 150, "avg_views": 75.0},
+    ]
@@ -0,0 +1,30 @@
+from typing import List
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from api import cache, schemas
+
+def make_client(monkeypatch, version):
+    async def get_version(db):
+        return version
+    monkeypatch.setattr(cache.data_version, 'get', get_version)
+    cache.response_cache._entries.clear()
+
+    app = FastAPI()
+
+    @app.get("/top-products", response_model=List[schemas.TopProduct])
+    async def top_products(request: Request):
+        async def compute():
+            # A driver value FastAPI would coerce, and a column the schema leaves out
+            return [{"product_name": "Paracetamol", "count": "12", "product_type": "drug"}]
+        return await cache.cached_response(request, None, compute, List[schemas.TopProduct])
+
+    return TestClient(app)
+
+def test_cached_responses_match_uncached_ones(monkeypatch):
+    uncached = make_client(monkeypatch, None).get("/top-products")
+    client = make_client(monkeypatch, "v1")
+    miss, hit = client.get("/top-products"), client.get("/top-products")
+
+    assert uncached.json() == [{"product_name": "Paracetamol", "count": 12}]
+    assert miss.content == hit.content == uncached.content
+    assert hit.headers["etag"] == miss.headers["etag"]
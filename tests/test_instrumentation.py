@@ -0,0 +1,32 @@
+import json
+import instrumentation
+
+def test_record_dbt_results_nests_nodes_under_the_current_stage(tmp_path):
+    path = tmp_path / 'run_results.json'
+    path.write_text(json.dumps({'results': [
+        {'unique_id': 'model.medical_warehouse.fct_messages', 'execution_time': 1.5,
+         'adapter_response': {'rows_affected': 42}},
+        {'unique_id': 'seed.medical_warehouse.product_dictionary', 'execution_time': 0.2,
+         'adapter_response': {}},
+    ]}))
+
+    instrumentation.reset()
+    with instrumentation.stage('dbt run', unit='nodes'):
+        instrumentation.record_dbt_results(str(path))
+        instrumentation.record_dbt_results(str(tmp_path / 'missing.json'))
+    children = instrumentation.stages()[0]['children']
+
+    assert [(child['name'], child['items'], child['wall_s']) for child in children] == [
+        ('model:fct_messages', 42, 1.5), ('seed:product_dictionary', 0, 0.2)]
+    instrumentation.reset()
+
+def test_unrecorded_stages_are_dropped():
+    instrumentation.reset()
+    with instrumentation.stage('loader'):
+        with instrumentation.unrecorded():
+            with instrumentation.stage('seed'):
+                pass
+        with instrumentation.stage('incremental_noop'):
+            pass
+    assert [child['name'] for child in instrumentation.stages()[0]['children']] == ['incremental_noop']
+    instrumentation.reset()
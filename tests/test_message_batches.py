@@ -0,0 +1,32 @@
+import message_batches
+from loader import MESSAGE_COLUMNS
+
+SCHEMA = message_batches.arrow_schema(MESSAGE_COLUMNS)
+
+def test_non_object_records_fail_the_file(tmp_path):
+    good = tmp_path / 'good.jsonl'
+    good.write_text('{"message_id": 1, "channel_name": "tikvahpharma", "views": "12"}\n')
+    bad = tmp_path / 'bad.jsonl'
+    bad.write_text('{"message_id": 2}\n[3, 4]\n')
+    scalar = tmp_path / 'scalar.json'
+    scalar.write_text('"not a message"')
+
+    # Parsed by worker processes, so an exception there would surface from the pool
+    results = list(message_batches.iter_file_batches([str(good), str(bad), str(scalar)], SCHEMA, workers=2))
+
+    file_path, batch, error = results[0]
+    assert error is None
+    assert batch.to_pylist()[0]['views'] == 12
+    assert results[1][0] == str(bad) and results[1][1] is None
+    assert results[1][2] == "record 1 is a JSON list, not an object"
+    assert results[2][1] is None and results[2][2] == "record 0 is a JSON str, not an object"
+
+def test_string_booleans_are_parsed_by_spelling(tmp_path):
+    path = tmp_path / 'flags.jsonl'
+    path.write_text(''.join(
+        f'{{"message_id": {i}, "has_media": {value}}}\n'
+        for i, value in enumerate(['"false"', '"True"', '"0"', '1', 'false', '"maybe"', 'null'])))
+
+    batch = message_batches.parse_file(str(path), SCHEMA)[1]
+
+    assert batch.column('has_media').to_pylist() == [False, True, False, True, False, None, None]
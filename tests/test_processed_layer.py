@@ -0,0 +1,61 @@
+import os
+import pyarrow as pa
+import message_batches
+import processed_layer
+from loader import MESSAGE_COLUMNS
+
+def message_batch(rows):
+    return pa.RecordBatch.from_pylist(rows, schema=message_batches.arrow_schema(MESSAGE_COLUMNS))
+
+def test_pending_files_are_hidden_until_published(tmp_path):
+    batch = message_batch([
+        {'message_id': 1, 'channel_name': 'lobelia4cosmetics', 'date': '2024-01-05T08:00:00+00:00'},
+    ])
+    pending = []
+    processed_layer.write_messages(batch, 'a.jsonl', base_dir=tmp_path, pending=pending)
+    assert processed_layer.read('messages', base_dir=tmp_path).num_rows == 0
+
+    processed_layer.publish(pending)
+    assert pending == []
+    assert processed_layer.read('messages', ['message_id'], base_dir=tmp_path).to_pylist() == [{'message_id': 1}]
+
+def test_discarded_files_are_removed(tmp_path):
+    batch = message_batch([{'message_id': 1, 'channel_name': 'tikvahpharma', 'date': '2024-01-05T08:00:00'}])
+    pending = []
+    paths = processed_layer.write_messages(batch, 'a.jsonl', base_dir=tmp_path, pending=pending)
+    processed_layer.discard(pending)
+    assert not any(files for _, _, files in os.walk(tmp_path))
+    assert not any(os.path.exists(path) for path in paths)
+
+def test_detections_are_partitioned_by_message_date(tmp_path):
+    batch = message_batch([
+        {'message_id': 7, 'channel_name': 'tikvahpharma', 'date': '2024-01-05T23:30:00+00:00'},
+        {'message_id': 8, 'channel_name': 'tikvahpharma', 'date': '2024-01-06T00:10:00+00:00'},
+    ])
+    processed_layer.write_messages(batch, 'a.jsonl', base_dir=tmp_path)
+    dates = processed_layer.message_dates(['tikvahpharma'], base_dir=tmp_path)
+    assert dates == {('tikvahpharma', 7): '2024-01-05', ('tikvahpharma', 8): '2024-01-06'}
+
+    records = [
+        {'message_id': message_id, 'image_path': f'data/raw/images/tikvahpharma/{message_id}.jpg',
+         'detected_objects': ['bottle'], 'confidence_score': 0.9, 'image_category': 'product_display',
+         'content_hash': 'h', 'model_key': 'm', 'copied_from': None}
+        for message_id in (7, 8, 9)
+    ]
+    processed_layer.write_detections(
+        records, [dates.get(('tikvahpharma', r['message_id'])) for r in records], base_dir=tmp_path)
+    table = processed_layer.read('detections', ['message_id', 'date', 'detected_objects'], base_dir=tmp_path)
+    assert sorted((row['message_id'], row['date']) for row in table.to_pylist()) == [
+        (7, '2024-01-05'), (8, '2024-01-06'), (9, processed_layer.UNKNOWN)]
+    assert table.column('detected_objects').to_pylist() == [['bottle']] * 3
+
+def test_remove_messages_deletes_only_that_files_parts(tmp_path):
+    rows = [{'message_id': 1, 'channel_name': 'tikvahpharma', 'date': '2024-01-05T08:00:00+00:00'},
+            {'message_id': 2, 'channel_name': 'tikvahpharma', 'date': '2024-01-04T23:00:00+00:00'}]
+    processed_layer.write_messages(message_batch(rows), 'day/2024-01-05/tikvahpharma.jsonl', base_dir=tmp_path)
+    processed_layer.write_messages(message_batch(rows[:1]), 'other.jsonl', base_dir=tmp_path)
+
+    removed = processed_layer.remove_messages('day/2024-01-05/tikvahpharma.jsonl', 'tikvahpharma', base_dir=tmp_path)
+
+    assert len(removed) == 2
+    assert processed_layer.read('messages', ['message_id'], base_dir=tmp_path).to_pylist() == [{'message_id': 1}]
@@ -0,0 +1,137 @@
+import os
+import json
+import scraper
+
+def test_replacing_a_day_without_messages_removes_its_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with scraper.NdjsonWriter('tikvahpharma', date_str='2024-01-05', replace=True) as writer:
+        writer.write({'message_id': 1})
+    assert os.path.exists(writer.path)
+
+    # The message was deleted; re-scraping the day finds nothing
+    with scraper.NdjsonWriter('tikvahpharma', date_str='2024-01-05', replace=True) as writer:
+        pass
+    assert writer.count == 0
+    assert not os.path.exists(writer.path)
+
+def test_failed_replace_keeps_the_previous_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with scraper.NdjsonWriter('tikvahpharma', date_str='2024-01-05', replace=True) as writer:
+        writer.write({'message_id': 1})
+
+    try:
+        with scraper.NdjsonWriter('tikvahpharma', date_str='2024-01-05', replace=True) as writer:
+            raise ConnectionError
+    except ConnectionError:
+        pass
+    with open(writer.path, 'rb') as f:
+        assert f.read() == b'{"message_id": 1}\n'
+
+def test_import_creates_no_files(tmp_path, monkeypatch):
+    import importlib
+
+    monkeypatch.chdir(tmp_path)
+    importlib.reload(scraper)
+    assert list(tmp_path.iterdir()) == []
+
+class FakeClock:
+    """Stands in for time.monotonic and asyncio.sleep; sleeping moves the clock on at once."""
+
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        self.sleeps = []
+        real_sleep = scraper.asyncio.sleep
+
+        async def sleep(delay):
+            self.sleeps.append(delay)
+            self.now += max(0, delay)
+            await real_sleep(0)
+
+        monkeypatch.setattr(scraper, 'time', self)
+        monkeypatch.setattr(scraper.asyncio, 'sleep', sleep)
+
+    def monotonic(self):
+        return self.now
+
+def flood_wait(seconds):
+    return scraper.FloodWaitError(None, capture=seconds)
+
+def test_flood_wait_halves_the_rate_once_and_holds_callers(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    bucket = scraper.TokenBucket(rate=2, burst=1)
+    granted_under = scraper.asyncio.run(bucket.acquire())
+
+    bucket.on_flood_wait(30, granted_under)
+    # A request sent before the wait hits the same limit and backs off no further
+    bucket.on_flood_wait(30, granted_under)
+    assert bucket.rate == 1
+    assert bucket.ceiling == 1.8
+
+    scraper.asyncio.run(bucket.acquire())
+    assert clock.now >= 1030
+
+def test_rate_recovers_additively_up_to_the_ceiling(monkeypatch):
+    FakeClock(monkeypatch)
+    bucket = scraper.TokenBucket(rate=2, burst=1)
+    bucket.on_flood_wait(1, bucket.flood_waits)
+
+    bucket.on_success()
+    assert bucket.rate == 1.1
+    for _ in range(20):
+        bucket.on_success()
+    # Held just below the rate that drew the FloodWait, which creeps back up slowly
+    assert bucket.rate == bucket.ceiling
+    assert 1.8 < bucket.ceiling < 2
+
+def test_flood_waited_channel_is_rescheduled_after_the_others(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    calls = []
+
+    async def scrape_channel(client, channel, media_queue, backfill):
+        calls.append((channel, clock.now))
+        if channel == 'tikvahpharma' and len(calls) == 1:
+            raise flood_wait(60)
+
+    monkeypatch.setattr(scraper, 'scrape_channel', scrape_channel)
+    scraper.asyncio.run(scraper.scrape_channels(None, ['tikvahpharma', 'lobelia4cosmetics'],
+                                                channel_concurrency=1, media_workers=0))
+
+    assert [channel for channel, _ in calls] == ['tikvahpharma', 'lobelia4cosmetics', 'tikvahpharma']
+    assert calls[2][1] >= calls[0][1] + 60
+
+def test_scrape_resumes_below_the_last_saved_page(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(scraper, 'PAGE_SIZE', 2)
+    stamp = scraper.datetime(2024, 1, 5, tzinfo=scraper.timezone.utc)
+    history = [SimpleNamespace(id=i, date=stamp, text=f'message {i}', photo=None) for i in range(16, 10, -1)]
+    scraper.save_checkpoint('tikvahpharma', {'last_message_id': 10})
+    requests = []
+
+    async def fetch_page(client, entity, offset_id=0, min_id=0, limit=2, **kwargs):
+        requests.append(offset_id)
+        if len(requests) == 2:
+            raise flood_wait(600)
+        below = [m for m in history if m.id > min_id and (not offset_id or m.id < offset_id)]
+        return below[:limit]
+
+    monkeypatch.setattr(scraper, 'fetch_page', fetch_page)
+
+    def scrape():
+        checkpoint = scraper.load_checkpoint('tikvahpharma')
+        return scraper.asyncio.run(scraper.scrape_new_messages(None, None, 'tikvahpharma', checkpoint, 'images'))
+
+    try:
+        scrape()
+    except scraper.FloodWaitError:
+        pass
+    # The high-water mark holds until the whole range is written
+    assert scraper.load_checkpoint('tikvahpharma')['last_message_id'] == 10
+
+    assert scrape() == 4
+    assert requests == [0, 15, 15, 13, 11]
+    checkpoint = scraper.load_checkpoint('tikvahpharma')
+    assert checkpoint['last_message_id'] == 16 and 'catch_up' not in checkpoint
+    with open('data/raw/telegram_messages/' + scraper.datetime.now().strftime('%Y-%m-%d') + '/tikvahpharma.jsonl') as f:
+        assert [json.loads(line)['message_id'] for line in f] == list(range(16, 10, -1))
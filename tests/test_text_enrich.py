@@ -0,0 +1,25 @@
+import os
+import text_enrich
+
+DICTIONARY = os.path.join(os.path.dirname(__file__), '..', 'medical_warehouse', 'seeds', 'product_dictionary.csv')
+
+def matcher():
+    entries, _ = text_enrich.load_dictionary(DICTIONARY)
+    return text_enrich.ProductMatcher(entries)
+
+def test_amharic_names_match_with_a_unit_suffix():
+    assert matcher().find("ፓራሲታሞል500 ሚግ በቅናሽ") == {('paracetamol', 'drug'): 1}
+
+def test_strength_suffix_matches_the_longest_alias_once():
+    assert matcher().find("New stock: vitamin D3 1000IU and Panadol 500mg") == {
+        ('vitamin d', 'supplement'): 1,
+        ('paracetamol', 'drug'): 1,
+    }
+
+def test_homophone_letters_and_accents_fold_to_one_spelling():
+    # ሐ spells the same sound as ሀ; É folds to e
+    assert text_enrich.normalize("ሐሎ ÉTHIOPIA፡፡") == text_enrich.normalize("ሀሎ ethiopia")
+    assert text_enrich.normalize("ፓራሲታሞል500ሚግ") == "ፓራሲታሞል 500 ሚግ"
+
+def test_aliases_match_whole_words_only():
+    assert matcher().find("multivitamin syrup") == {('multivitamin', 'supplement'): 1}
@@ -0,0 +1,131 @@
+import yolo_detect
+
+PATHS = {'A': 'data/raw/images/channel/1.jpg', 'B': 'data/raw/images/channel/2.jpg'}
+
+class FakeWriter:
+    """Collects rows and detection cache writes the way ResultWriter decides them."""
+
+    def __init__(self, cache):
+        self.cursor = None
+        self.known_files = {}
+        self.cache = cache
+        self.rows = {}
+
+    def add(self, records, inferred_hash=None):
+        for record in records:
+            if record['content_hash'] == inferred_hash:
+                self.cache[inferred_hash] = (record['detected_objects'], record['confidence_score'],
+                                             record['image_category'])
+            self.rows[record['image_path']] = record
+
+def run(monkeypatch, cache, group_of):
+    """Runs run_cached_detection over images A and B with the given grouping; returns (inferred paths, rows)."""
+    inferred = []
+
+    def fake_iter_detections(model, image_paths, *args):
+        inferred.extend(image_paths)
+        yield [yolo_detect.build_record(path, ['bottle'], 0.9) for path in image_paths]
+
+    monkeypatch.setattr(yolo_detect, 'hash_images',
+                        lambda image_paths, workers, known: {path: (h, 100, 1.0) for h, path in PATHS.items()})
+    monkeypatch.setattr(yolo_detect, 'fetch_cached_detections',
+                        lambda cursor, model_key, hashes: {h: cache[h] for h in hashes if h in cache})
+    monkeypatch.setattr(yolo_detect, 'group_images', lambda cursor, paths_by_hash, workers: (dict(group_of), {}))
+    monkeypatch.setattr(yolo_detect, 'iter_detections', fake_iter_detections)
+
+    writer = FakeWriter(cache)
+    yolo_detect.run_cached_detection(None, 'model', list(PATHS.values()), writer, write_groups=False)
+    return inferred, writer.rows
+
+def test_copied_detections_are_not_cached(monkeypatch):
+    cache = {}
+    inferred, rows = run(monkeypatch, cache, {'A': 'A', 'B': 'A'})
+
+    assert inferred == [PATHS['A']]
+    assert set(cache) == {'A'}
+    assert rows[PATHS['A']]['copied_from'] is None
+    assert rows[PATHS['B']]['copied_from'] == 'A'
+
+    # Same grouping: B copies A's cached detections again without inference
+    inferred, rows = run(monkeypatch, cache, {'A': 'A', 'B': 'A'})
+    assert inferred == []
+    assert set(cache) == {'A'}
+
+def test_lowering_distance_infers_former_copies(monkeypatch):
+    cache = {}
+    run(monkeypatch, cache, {'A': 'A', 'B': 'A'})
+
+    # With a smaller PHASH_MAX_DISTANCE, B is no longer grouped with A
+    inferred, rows = run(monkeypatch, cache, {'A': 'A', 'B': 'B'})
+
+    assert inferred == [PATHS['B']]
+    assert set(cache) == {'A', 'B'}
+    assert rows[PATHS['B']]['copied_from'] is None
+
+def test_unchanged_files_are_not_hashed_again(tmp_path, monkeypatch):
+    unchanged, changed, new = (tmp_path / name for name in ('1.jpg', '2.jpg', '3.jpg'))
+    for path in (unchanged, changed, new):
+        path.write_bytes(path.name.encode())
+    known = {str(path): ('recorded', path.stat().st_size, path.stat().st_mtime) for path in (unchanged, changed)}
+    changed.write_bytes(b'edited')
+
+    read = []
+    monkeypatch.setattr(yolo_detect, 'file_sha256', lambda path: read.append(path) or f'sha:{path}')
+    files = yolo_detect.hash_images([str(unchanged), str(changed), str(new)], 2, known)
+
+    assert sorted(read) == [str(changed), str(new)]
+    assert files[str(unchanged)] == known[str(unchanged)]
+    assert files[str(changed)] == (f'sha:{changed}', 6, changed.stat().st_mtime)
+
+def test_onnx_session_gets_the_thread_budget(monkeypatch):
+    import sys
+    import types
+
+    class SessionOptions:
+        intra_op_num_threads = inter_op_num_threads = 0
+
+    class InferenceSession:
+        def __init__(self, path, sess_options=None, providers=None):
+            self.path, self.options, self.providers = path, sess_options, providers
+
+        def get_providers(self):
+            return self.providers
+
+    monkeypatch.setitem(sys.modules, 'onnxruntime',
+                        types.SimpleNamespace(SessionOptions=SessionOptions, InferenceSession=InferenceSession))
+
+    class FakeModel:
+        predictor = None
+
+        def __call__(self, images, **kwargs):
+            # ultralytics builds its own session, one thread per core, on the first call
+            backend = types.SimpleNamespace(session=InferenceSession('yolov8n.onnx', providers=['CPUExecutionProvider']))
+            self.predictor = types.SimpleNamespace(model=backend)
+
+    model = FakeModel()
+    yolo_detect.set_onnx_threads(model, 'yolov8n.onnx', 3, imgsz=32)
+
+    session = model.predictor.model.session
+    assert session.options.intra_op_num_threads == 3
+    assert session.options.inter_op_num_threads == 1
+    assert session.providers == ['CPUExecutionProvider']
+
+def test_writer_uses_the_callers_message_dates(monkeypatch):
+    class Cursor:
+        def execute(self, *args):
+            pass
+
+        def fetchall(self):
+            return []
+
+    class Conn:
+        def cursor(self):
+            return Cursor()
+
+    def no_layer_read(channels):
+        raise AssertionError("read the messages dataset")
+
+    monkeypatch.setattr(yolo_detect.processed_layer, 'message_dates', no_layer_read)
+    writer = yolo_detect.ResultWriter(Conn(), 'model', [PATHS['A']], message_dates={PATHS['A']: '2024-01-05'})
+    records = [{'image_path': PATHS['A'], 'message_id': 1}, {'image_path': PATHS['B'], 'message_id': 2}]
+    assert writer.message_dates(records) == ['2024-01-05', None]